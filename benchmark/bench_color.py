@@ -0,0 +1,85 @@
+"""
+Benchmark hex color resolution in LEDController.
+
+Compares the original linear scan (re-parsing all 128 palette strings per call)
+against the memoized lookup and a pre-resolved Color.
+
+Usage:
+    python benchmark/bench_color.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import apc40mk2  # noqa: E402
+
+
+def legacy_find_closest_color(hex_color):
+    """The pre-cache implementation, kept here as the baseline."""
+    def hex_to_rgb(hex_code):
+        hex_code = hex_code.lstrip("#")
+        return [int(hex_code[i:i+2], 16) for i in (0, 2, 4)]
+
+    target_rgb = hex_to_rgb(hex_color)
+    closest_index = None
+    closest_distance = float("inf")
+
+    for index, code in apc40mk2.COLOR_CODES:
+        current_rgb = hex_to_rgb(code)
+        distance = sum((t - c) ** 2 for t, c in zip(target_rgb, current_rgb))
+        if distance < closest_distance:
+            closest_distance = distance
+            closest_index = index
+
+    return closest_index
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    rng = random.Random(0)
+    colors = [f"#{rng.randrange(0x1000000):06X}" for _ in range(45)]
+    led = apc40mk2.LEDController(apc40mk2.MockMidiOut(record=False))
+    prebuilt = [apc40mk2.Color(c) for c in colors]
+
+    for color in colors:
+        assert legacy_find_closest_color(color) == apc40mk2._find_closest_color(color)
+
+    def legacy():
+        for color in colors:
+            legacy_find_closest_color(color)
+
+    def cold():
+        apc40mk2._find_closest_color.cache_clear()
+        for color in colors:
+            apc40mk2._find_closest_color(color)
+
+    def cached():
+        for color in colors:
+            apc40mk2._find_closest_color(color)
+
+    def setter_hex():
+        for i, color in enumerate(colors[:40]):
+            led.set_clip_launch(i // 8 + 1, i % 8 + 1, color, 0)
+
+    def setter_color():
+        for i, color in enumerate(prebuilt[:40]):
+            led.set_clip_launch(i // 8 + 1, i % 8 + 1, color, 0)
+
+    n = len(colors)
+    print(f"{'case':<32}{'us/call':>10}")
+    print(f"{'legacy linear scan':<32}{per_call_us(legacy, 200) / n:>10.3f}")
+    print(f"{'pre-parsed scan (cache miss)':<32}{per_call_us(cold, 200) / n:>10.3f}")
+    print(f"{'memoized (cache hit)':<32}{per_call_us(cached, 2000) / n:>10.3f}")
+    print(f"{'set_clip_launch(hex)':<32}{per_call_us(setter_hex, 2000) / 40:>10.3f}")
+    print(f"{'set_clip_launch(Color)':<32}{per_call_us(setter_color, 2000) / 40:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark the raw MIDI byte encoder against the MIDI Out CHOP path.
+
+Each frame repaints the 40 clip pads and moves the 80 knob rings. The CHOP path goes
+through DirectOutput (float velocities, one call per message) into a MockMidiOut; the
+raw paths go through RawBytesOutput into an unbuffered file on the null device, so every
+write is a real system call.
+
+Usage:
+    python benchmark/bench_encoder.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import numpy as np  # noqa: E402
+
+import apc40mk2  # noqa: E402
+
+
+def frame_func(apc):
+    grids = [np.full((5, 8), color, dtype=np.uint8) for color in (5, 45)]
+    knobs = [[value] * 8 for value in (0, 127)]
+    state = {"frame": 0}
+
+    def frame():
+        state["frame"] ^= 1
+        apc.led.set_clip_grid(grids[state["frame"]])
+        for index in range(1, 9):
+            apc.knob.set_track_knob_value(index, knobs[state["frame"]][index - 1])
+        for channel in range(1, 10):
+            for index in range(1, 9):
+                apc.knob.set_device_ctrl_knob_value(channel, index, knobs[state["frame"]][index - 1])
+        apc.tick()
+
+    return frame
+
+
+def main():
+    frames = 500
+    print(f"{'case':<32}{'us/frame':>10}{'writes/frame':>14}{'bytes/frame':>13}")
+
+    midiout = apc40mk2.MockMidiOut(record=False)
+    chop = frame_func(apc40mk2.APC40MK2(midiout))
+    midiout.clear()
+    best = min(timeit.repeat(chop, number=frames, repeat=5))
+    calls = midiout.count / (5 * frames)
+    print(f"{'CHOP (DirectOutput)':<32}{best / frames * 1e6:>10.1f}{calls:>14.1f}{'':>13}")
+
+    for name, options in (("raw, one write per message", dict(batched=False)),
+                          ("raw, one write per frame", dict(running_status=False)),
+                          ("raw, per frame + running status", dict())):
+        with open(os.devnull, "wb", buffering=0) as sink:
+            output = apc40mk2.RawBytesOutput(sink, **options)
+            frame = frame_func(apc40mk2.APC40MK2(output))
+            frame()
+            output.writes = output.bytes_written = 0
+            best = min(timeit.repeat(frame, number=frames, repeat=5))
+        total = 5 * frames
+        print(f"{name:<32}{best / frames * 1e6:>10.1f}{output.writes / total:>14.1f}"
+              f"{output.bytes_written / total:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
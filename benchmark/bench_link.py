@@ -0,0 +1,127 @@
+"""
+Run LEDController and KnobController workloads against a SimulatedAPC40MK2 on a
+virtual 60 fps clock, with and without output rate limiting.
+
+For each case, reports the messages the modeled device received and dropped, the
+LEDs and knob rings left showing something other than what the framebuffer
+believes once the link has drained, and the latency from a pad press to the
+pad's LED being processed.
+
+Usage:
+    python benchmark/bench_link.py
+    python benchmark/bench_link.py --overflow delay --bytes-per-second 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import numpy as np  # noqa: E402
+
+import apc40mk2  # noqa: E402
+
+FPS = 60
+TRACKS = range(1, 9)
+
+
+def workloads():
+    """(name, per-frame callable taking (apc, frame)) for each workload."""
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (5, 9, 3)) for _ in range(8)]
+
+    def grid_repaint(apc, frame):
+        apc.led.set_clip_grid(frames[frame % len(frames)])
+
+    def knob_sweep(apc, frame):
+        value = frame * 7 % 128
+        for index in TRACKS:
+            apc.knob.set_track_knob_value(index, value)
+        for channel in range(1, 10):
+            for index in TRACKS:
+                apc.knob.set_device_ctrl_knob_value(channel, index, value)
+
+    def track_rows(apc, frame):
+        for kind in apc40mk2.LED_ROW_SLOTS:
+            apc.led.set_track_row(kind, frame * 37 & 0xFF)
+
+    def full_surface(apc, frame):
+        grid_repaint(apc, frame)
+        knob_sweep(apc, frame)
+        track_rows(apc, frame)
+
+    return [("grid_repaint", grid_repaint), ("knob_sweep", knob_sweep), ("track_rows", track_rows),
+            ("full_surface", full_surface)]
+
+
+def run_case(workload, frames, messages_per_tick, link):
+    clock = apc40mk2.VirtualClock()
+    sim = apc40mk2.SimulatedAPC40MK2(clock=clock, **link)
+    apc = apc40mk2.APC40MK2(sim, messages_per_tick=messages_per_tick)
+    sim.on_input = apc.input.receive_bytes
+    colors = ("white", "red")
+
+    def on_pad(control, value):
+        if value:
+            _, row, column = control
+            apc.led.set_clip_launch(row, column, colors[int(clock.now * FPS) & 1], 0)
+
+    apc.input.on("clip", on_pad)
+    rng = random.Random(1)
+    for frame in range(frames):
+        sim.poll()
+        workload(apc, frame)
+        if frame % 6 == 0:
+            sim.press(rng.randint(1, 5), rng.randint(1, 8))
+        apc.tick()
+        clock.advance(1 / FPS)
+
+    # Drain the rate limiter and the link before comparing.
+    for _ in range(FPS * 10):
+        sim.poll()
+        apc.tick()
+        clock.advance(1 / FPS)
+    expected, shown = apc.snapshot(), sim.state()
+    wrong_leds = int((expected.led_color != shown.led_color).sum() + (expected.led_type != shown.led_type).sum())
+    wrong_knobs = int((expected.knob_value != shown.knob_value).sum() + (expected.knob_type != shown.knob_type).sum())
+    latency = sim.latency_percentiles((50, 99))
+    return {
+        "received": sum(sim.received.values()),
+        "dropped": sum(sim.dropped.values()),
+        "wrong_leds": wrong_leds,
+        "wrong_knobs": wrong_knobs,
+        "p50_ms": latency.get(50, float("nan")),
+        "p99_ms": latency.get(99, float("nan")),
+        "max_delay_ms": sim.max_delay * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=600, help="frames per case")
+    parser.add_argument("--bytes-per-second", type=float, default=40000.0)
+    parser.add_argument("--per-message-us", type=float, default=100.0)
+    parser.add_argument("--buffer-bytes", type=int, default=256)
+    parser.add_argument("--overflow", choices=apc40mk2.SIMULATED_OVERFLOW, default="drop")
+    options = parser.parse_args()
+    link = {
+        "bytes_per_second": options.bytes_per_second,
+        "per_message_us": options.per_message_us,
+        "buffer_bytes": options.buffer_bytes,
+        "overflow": options.overflow,
+    }
+
+    print(f"{'case':<28}{'received':>10}{'dropped':>9}{'bad LEDs':>10}{'bad knobs':>11}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'max delay':>11}")
+    for name, workload in workloads():
+        for budget in (None, 64, 32):
+            r = run_case(workload, options.frames, budget, link)
+            label = f"{name}[{'direct' if budget is None else budget}]"
+            print(f"{label:<28}{r['received']:>10}{r['dropped']:>9}{r['wrong_leds']:>10}{r['wrong_knobs']:>11}"
+                  f"{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['max_delay_ms']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark scrolling text on the clip launch grid.
+
+Compares computing each frame's pixels from the font and calling set_clip_launch
+for every pad against the cached-strip text effect of GridEffects, for a long
+string scrolled at several speeds.
+
+Usage:
+    python benchmark/bench_scroller.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import apc40mk2  # noqa: E402
+
+TEXT = "APC40 MK2 - NOW PLAYING: A VERY LONG SONG TITLE 128 BPM - " * 4
+FPS = 60
+FRAMES = 600
+
+
+def per_pad(apc, speed):
+    """Rebuild the pixels of every frame from the glyphs and set all 40 pads."""
+    glyphs = apc40mk2._GLYPHS
+
+    def run():
+        for frame in range(FRAMES):
+            start = int(frame / FPS * speed)
+            columns = []
+            for char in TEXT:
+                glyph = glyphs.get(char.upper(), glyphs["?"])
+                columns.extend(glyph[:, i] for i in range(glyph.shape[1]))
+                columns.append(None)
+                if len(columns) > start + 8:
+                    break
+            for column in range(8):
+                pixels = columns[(start + column) % len(columns)]
+                for row in range(5):
+                    lit = pixels is not None and pixels[row]
+                    apc.led.set_clip_launch(row + 1, column + 1, "white" if lit else "black", 0)
+
+    return run
+
+
+def effect(apc, speed):
+    apc.effects.clear()
+    apc.effects.add("text", apc.effects.text(TEXT, "white", speed=speed, gap=0))
+
+    def run():
+        for frame in range(FRAMES):
+            apc.effects.tick(frame / FPS)
+
+    return run
+
+
+def main():
+    print(f"{'case':<28}{'us/frame':>10}{'msgs/frame':>12}")
+    for speed in (8, 30, 120):
+        for name, build in (("per_pad", per_pad), ("text_effect", effect)):
+            midiout = apc40mk2.MockMidiOut(record=False)
+            apc = apc40mk2.APC40MK2(midiout)
+            run = build(apc, speed)
+            best = min(timeit.repeat(run, number=1, repeat=3))
+            print(f"{f'{name}[{speed} col/s]':<28}{best / FRAMES * 1e6:>10.1f}{midiout.count / (3 * FRAMES):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
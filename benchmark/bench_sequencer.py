@@ -0,0 +1,82 @@
+"""
+Benchmark StepSequencer against redrawing the whole grid on every step.
+
+Both run 16th-note steps on a virtual 60 fps clock, so step timing (lateness and
+jitter) reflects frame quantization only, while draw cost is measured in real time.
+
+Usage:
+    python benchmark/bench_sequencer.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import numpy as np  # noqa: E402
+
+import apc40mk2  # noqa: E402
+
+FPS = 60
+SECONDS = 30
+COLORS = ("black", "blue", "white", "red")
+
+
+def pattern():
+    return (np.random.default_rng(0).random((5, 16)) < 0.3).astype(np.uint8)
+
+
+def full_redraw(bpm):
+    """Redraw all 40 pads with set_clip_launch whenever the step changes."""
+    midiout = apc40mk2.MockMidiOut(record=False)
+    apc = apc40mk2.APC40MK2(midiout)
+    cells = pattern()
+    clock = apc40mk2.VirtualClock()
+    costs = []
+    last = None
+    for _ in range(SECONDS * FPS):
+        step = int(clock.now * bpm / 60 * 4) % 16
+        if step != last:
+            last = step
+            started = time.perf_counter()
+            page = step // 8
+            for row in range(5):
+                for column in range(8):
+                    cell = page * 8 + column
+                    color = COLORS[(cell == step) * 2 + int(cells[row, cell])]
+                    apc.led.set_clip_launch(row + 1, column + 1, color, 0)
+            costs.append(time.perf_counter() - started)
+        apc.tick()
+        clock.advance(1 / FPS)
+    return {"steps": len(costs), "cost_us_mean": np.mean(costs) * 1e6, "cost_us_p99": np.percentile(costs, 99) * 1e6,
+            "messages_per_step": midiout.count / len(costs)}
+
+
+def sequencer(bpm):
+    midiout = apc40mk2.MockMidiOut(record=False)
+    apc = apc40mk2.APC40MK2(midiout)
+    clock = apc40mk2.VirtualClock()
+    transport = apc40mk2.BlinkClock(apc.led, bpm=bpm, clock=clock)
+    seq = apc40mk2.StepSequencer(apc.led, apc.input, transport, steps=16, colors=COLORS, clock=clock)
+    seq.load(pattern())
+    midiout.clear()
+    for _ in range(SECONDS * FPS):
+        seq.tick()
+        apc.tick()
+        clock.advance(1 / FPS)
+    return seq.metrics()
+
+
+def main():
+    print(f"{'case':<24}{'steps':>7}{'us/step':>9}{'p99 us':>9}{'msgs/step':>11}{'late ms':>9}{'jitter ms':>11}")
+    for bpm in (120, 200, 240):
+        for name, run in (("full_redraw", full_redraw), ("sequencer", sequencer)):
+            r = run(bpm)
+            print(f"{f'{name}[{bpm} bpm]':<24}{r['steps']:>7}{r['cost_us_mean']:>9.1f}{r['cost_us_p99']:>9.1f}"
+                  f"{r['messages_per_step']:>11.2f}{r.get('late_ms_mean', float('nan')):>9.2f}"
+                  f"{r.get('jitter_ms', float('nan')):>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Benchmark every public setter of LEDController, KnobController and DeviceModeController,
+plus whole-surface workloads, against a MockMidiOut.
+
+Every case cycles its arguments so each call changes the target's value and is
+actually sent (the LED framebuffer would otherwise skip repeated values).
+
+Usage:
+    python benchmark/bench_setters.py                 # table on stdout
+    python benchmark/bench_setters.py --json out.json # also write machine-readable results
+    python benchmark/bench_setters.py --json -        # JSON on stdout instead of the table
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import numpy as np  # noqa: E402
+
+import apc40mk2  # noqa: E402
+
+TRACKS = range(1, 9)
+ON_OFF = (True, False)
+
+
+def method_cases():
+    """(name, method name on the controller, argument list) for each public setter."""
+    rng = random.Random(0)
+    hex_colors = [f"#{rng.randrange(0x1000000):06X}" for _ in range(16)]
+    grid = [(row, column) for row in range(1, 6) for column in range(1, 9)]
+    led = [
+        ("led.set_clip_launch", "set_clip_launch",
+         [(row, column, color, 0) for color in (5, 45) for row, column in grid]),
+        ("led.set_clip_launch[hex]", "set_clip_launch",
+         [(row, column, color, 0) for color in hex_colors[:2] for row, column in grid]),
+        ("led.set_scene_launch", "set_scene_launch",
+         [(scene, color, 0) for color in ("red", "blue") for scene in range(1, 6)]),
+        ("led.set_track_clip_stop", "set_track_clip_stop",
+         [(track, state) for state in (1, 2) for track in TRACKS]),
+        ("led.set_track_ab_assign", "set_track_ab_assign",
+         [(track, state) for state in (1, 2) for track in TRACKS]),
+    ]
+    led.append(("led.set_track_row", "set_track_row",
+                [(kind, mask) for mask in (0x55, 0xAA) for kind in apc40mk2.LED_ROW_SLOTS]))
+    led.append(("led.set_track_row[unchecked]", "set_track_row",
+                [(kind, mask, True) for mask in (0x55, 0xAA) for kind in apc40mk2.LED_ROW_SLOTS]))
+    for name in ("set_track_record", "set_track_solo", "set_track_number", "set_track_select",
+                 "set_device_ctrl_button"):
+        led.append((f"led.{name}", name, [(track, state) for state in ON_OFF for track in TRACKS]))
+    for name in ("set_master_track", "set_pan", "set_sends", "set_user", "set_metronome",
+                 "set_play", "set_record", "set_session", "set_bank"):
+        led.append((f"led.{name}", name, [(state,) for state in ON_OFF]))
+
+    knob = [
+        ("knob.set_track_knob_type", "set_track_knob_type",
+         [(index, knob_type) for knob_type in (1, 2) for index in TRACKS]),
+        ("knob.set_track_knob_value", "set_track_knob_value",
+         [(index, value) for value in (0, 127) for index in TRACKS]),
+        ("knob.set_device_ctrl_knob_type", "set_device_ctrl_knob_type",
+         [(channel, index, knob_type) for knob_type in (1, 2) for channel in range(1, 10) for index in TRACKS]),
+        ("knob.set_device_ctrl_knob_value", "set_device_ctrl_knob_value",
+         [(channel, index, value) for value in (0, 127) for channel in range(1, 10) for index in TRACKS]),
+    ]
+    mode = [("mode.set_device_mode", "set_device_mode", [(0,), (1,), (2,)])]
+    return [("led",) + case for case in led] + [("knob",) + case for case in knob] + \
+        [("mode",) + case for case in mode]
+
+
+def workload_cases(apc):
+    """(name, callable, setter calls per run) for whole-surface workloads."""
+    rng = random.Random(1)
+    hex_frames = [[f"#{rng.randrange(0x1000000):06X}" for _ in range(40)] for _ in range(2)]
+    rgb_frames = [np.random.default_rng(seed).integers(0, 256, (5, 9, 3)) for seed in (2, 3)]
+    index_frames = [[(frame * 40 + i) % 128 for i in range(40)] for frame in (0, 1)]
+    state = {"frame": 0}
+
+    def next_frame():
+        state["frame"] ^= 1
+        return state["frame"]
+
+    def full_grid_repaint():
+        colors = index_frames[next_frame()]
+        for i in range(40):
+            apc.led.set_clip_launch(i // 8 + 1, i % 8 + 1, colors[i], 0)
+
+    def hex_grid_repaint():
+        colors = hex_frames[next_frame()]
+        for i in range(40):
+            apc.led.set_clip_launch(i // 8 + 1, i % 8 + 1, colors[i], 0)
+
+    def batched_grid_repaint():
+        colors = index_frames[next_frame()]
+        with apc.led.batch():
+            for i in range(40):
+                apc.led.set_clip_launch(i // 8 + 1, i % 8 + 1, colors[i], 0)
+
+    def array_grid_repaint():
+        apc.led.set_clip_grid(rgb_frames[next_frame()])
+
+    def knob_sweep():
+        for value in range(128):
+            for index in TRACKS:
+                apc.knob.set_track_knob_value(index, value)
+            for channel in range(1, 10):
+                for index in TRACKS:
+                    apc.knob.set_device_ctrl_knob_value(channel, index, value)
+
+    return [
+        ("workload.full_grid_repaint", full_grid_repaint, 40),
+        ("workload.hex_grid_repaint", hex_grid_repaint, 40),
+        ("workload.batched_grid_repaint", batched_grid_repaint, 40),
+        ("workload.array_grid_repaint", array_grid_repaint, 1),
+        ("workload.knob_sweep", knob_sweep, 128 * 80),
+    ]
+
+
+def measure(func, calls_per_run, midiout, min_time):
+    """Return timing stats for func, which performs calls_per_run setter calls."""
+    runs = 1
+    while timeit.timeit(func, number=runs) < min_time:
+        runs *= 2
+    midiout.clear()
+    best = min(timeit.repeat(func, number=runs, repeat=5))
+    calls = runs * calls_per_run
+    return {
+        "calls_per_run": calls_per_run,
+        "us_per_run": best / runs * 1e6,
+        "us_per_call": best / calls * 1e6,
+        "calls_per_second": calls / best,
+        "messages_per_call": midiout.count / (calls * 5),
+    }
+
+
+def run(min_time):
+    results = []
+    for controller, name, method, args in method_cases():
+        midiout = apc40mk2.MockMidiOut(record=False)
+        apc = apc40mk2.APC40MK2(midiout)
+        bound = getattr(getattr(apc, controller), method)
+
+        def func(bound=bound, args=args):
+            for a in args:
+                bound(*a)
+
+        results.append(dict(name=name, **measure(func, len(args), midiout, min_time)))
+
+    midiout = apc40mk2.MockMidiOut(record=False)
+    apc = apc40mk2.APC40MK2(midiout)
+    for name, func, calls in workload_cases(apc):
+        results.append(dict(name=name, **measure(func, calls, midiout, min_time)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", help="write JSON results to this path ('-' for stdout)")
+    parser.add_argument("--label", default="", help="free-form label stored with the results")
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per timing run")
+    options = parser.parse_args()
+
+    report = {
+        "label": options.label,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "results": run(options.min_time),
+    }
+
+    if options.json:
+        text = json.dumps(report, indent=2)
+        if options.json == "-":
+            print(text)
+            return
+        with open(options.json, "w") as f:
+            f.write(text + "\n")
+
+    print(f"{'case':<40}{'us/call':>10}{'calls/s':>14}{'msgs/call':>11}")
+    for result in report["results"]:
+        print(f"{result['name']:<40}{result['us_per_call']:>10.3f}"
+              f"{result['calls_per_second']:>14,.0f}{result['messages_per_call']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark module import, APC40MK2 construction, and the apc40mk2.get() registry.
+
+Import time is measured in fresh interpreters, minus the time to import NumPy alone. It
+includes compiling the source unless Python has cached bytecode for it; TouchDesigner
+compiles a module held in a Text DAT on import.
+Construction builds a new APC40MK2 (every controller, framebuffer and table view);
+get() returns the instance the registry already holds, as it does when a TouchDesigner
+script is re-executed.
+
+Usage:
+    python benchmark/bench_startup.py
+"""
+
+import os
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+sys.path.insert(0, SRC)
+
+import apc40mk2  # noqa: E402
+
+
+def import_ms(statement, repeat=7):
+    """Best wall time of running statement in a fresh interpreter, in milliseconds."""
+    code = f"import sys, time; sys.path.insert(0, {SRC!r}); t = time.perf_counter(); {statement}; " \
+           "print(time.perf_counter() - t)"
+    return min(float(subprocess.check_output([sys.executable, "-c", code])) for _ in range(repeat)) * 1e3
+
+
+def main():
+    numpy_ms = import_ms("import numpy")
+    module_ms = import_ms("import numpy, apc40mk2")
+
+    def construct():
+        apc40mk2.APC40MK2(apc40mk2.MockMidiOut(record=False))
+
+    midiout = apc40mk2.MockMidiOut(record=False)
+    apc40mk2.get(midiout)
+
+    def lookup():
+        apc40mk2.get(midiout)
+
+    construct_us = min(timeit.repeat(construct, number=200, repeat=5)) / 200 * 1e6
+    get_us = min(timeit.repeat(lookup, number=100000, repeat=5)) / 100000 * 1e6
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [apc40mk2.APC40MK2(apc40mk2.MockMidiOut(record=False)) for _ in range(100)]
+    per_instance = (tracemalloc.get_traced_memory()[0] - before) / len(instances)
+    tracemalloc.stop()
+
+    print(f"{'case':<36}{'value':>12}")
+    print(f"{'import apc40mk2 (excluding numpy)':<36}{module_ms - numpy_ms:>9.1f} ms")
+    print(f"{'APC40MK2(...)':<36}{construct_us:>9.1f} us")
+    print(f"{'apc40mk2.get(...) (existing)':<36}{get_us:>9.3f} us")
+    print(f"{'memory per APC40MK2':<36}{per_instance / 1024:>9.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,623 +1,5365 @@
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import heapq
+import io
+import json
+import math
+import os
+import struct
+import threading
+import time
+import types
+
+import numpy as np
+
+
+COLOR_MAP = types.MappingProxyType({
+    "black": 0, "dark gray": 1, "gray": 2, "white": 3, "red": 5,
+    "orange": 9, "yellow": 13, "green": 21, "cyan": 37, "blue": 45,
+    "purple": 49, "magenta": 53, "pink": 57
+})
+
+COLOR_CODES = (
+    (0, "#000000"), (1, "#1E1E1E"), (2, "#7F7F7F"), (3, "#FFFFFF"),
+    (4, "#FF4C4C"), (5, "#FF0000"), (6, "#590000"), (7, "#190000"),
+    (8, "#FFBD6C"), (9, "#FF5400"), (10, "#591D00"), (11, "#271B00"),
+    (12, "#FFFF4C"), (13, "#FFFF00"), (14, "#595900"), (15, "#191900"),
+    (16, "#88FF4C"), (17, "#54FF00"), (18, "#1D5900"), (19, "#142B00"),
+    (20, "#4CFF4C"), (21, "#00FF00"), (22, "#005900"), (23, "#001900"),
+    (24, "#4CFF5E"), (25, "#00FF19"), (26, "#00590D"), (27, "#001902"),
+    (28, "#4CFF88"), (29, "#00FF55"), (30, "#00591D"), (31, "#001F12"),
+    (32, "#4CFFB7"), (33, "#00FF99"), (34, "#005935"), (35, "#001912"),
+    (36, "#4CC3FF"), (37, "#00A9FF"), (38, "#004152"), (39, "#001019"),
+    (40, "#4C88FF"), (41, "#0055FF"), (42, "#001D59"), (43, "#000819"),
+    (44, "#4C4CFF"), (45, "#0000FF"), (46, "#000059"), (47, "#000019"),
+    (48, "#874CFF"), (49, "#5400FF"), (50, "#190064"), (51, "#0F0030"),
+    (52, "#FF4CFF"), (53, "#FF00FF"), (54, "#590059"), (55, "#190019"),
+    (56, "#FF4C87"), (57, "#FF0054"), (58, "#59001D"), (59, "#220013"),
+    (60, "#FF1500"), (61, "#993500"), (62, "#795100"), (63, "#436400"),
+    (64, "#033900"), (65, "#005735"), (66, "#00547F"), (67, "#0000FF"),
+    (68, "#00454F"), (69, "#2500CC"), (70, "#7F7F7F"), (71, "#202020"),
+    (72, "#FF0000"), (73, "#BDFF2D"), (74, "#AFED06"), (75, "#64FF09"),
+    (76, "#108B00"), (77, "#00FF87"), (78, "#00A9FF"), (79, "#002AFF"),
+    (80, "#3F00FF"), (81, "#7A00FF"), (82, "#B21A7D"), (83, "#402100"),
+    (84, "#FF4A00"), (85, "#88E106"), (86, "#72FF15"), (87, "#00FF00"),
+    (88, "#3BFF26"), (89, "#59FF71"), (90, "#38FFCC"), (91, "#5B8AFF"),
+    (92, "#3151C6"), (93, "#877FE9"), (94, "#D31DFF"), (95, "#FF005D"),
+    (96, "#FF7F00"), (97, "#B9B000"), (98, "#90FF00"), (99, "#835D07"),
+    (100, "#392b00"), (101, "#144C10"), (102, "#0D5038"), (103, "#15152A"),
+    (104, "#16205A"), (105, "#693C1C"), (106, "#A8000A"), (107, "#DE513D"),
+    (108, "#D86A1C"), (109, "#FFE126"), (110, "#9EE12F"), (111, "#67B50F"),
+    (112, "#1E1E30"), (113, "#DCFF6B"), (114, "#80FFBD"), (115, "#9A99FF"),
+    (116, "#8E66FF"), (117, "#404040"), (118, "#757575"), (119, "#E0FFFF"),
+    (120, "#A00000"), (121, "#350000"), (122, "#1AD000"), (123, "#074200"),
+    (124, "#B9B000"), (125, "#3F3100"), (126, "#B35F00"), (127, "#4B1502")
+)
+
+
+def _hex_to_rgb(hex_code):
+    hex_code = hex_code.lstrip("#")
+    return tuple(int(hex_code[i:i+2], 16) for i in (0, 2, 4))
+
+
+# Parsed once at import; every controller shares this table.
+PALETTE_RGB = tuple(_hex_to_rgb(code) for _, code in COLOR_CODES)
+
+
+@functools.lru_cache(maxsize=4096)
+def _find_closest_color(hex_color):
+    """
+    Find the closest palette index to the given hex color.
+
+    Results are memoized, so repeated hex colors cost a single dict lookup.
+
+    Args:
+        hex_color (str): The hex color code (e.g., "#FF0000").
+
+    Returns:
+        int: The index of the closest color (0-127).
+    """
+    r, g, b = _hex_to_rgb(hex_color)
+    closest_index = 0
+    closest_distance = 0x30000
+
+    for index, (pr, pg, pb) in enumerate(PALETTE_RGB):
+        distance = (r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2
+        if distance < closest_distance:
+            closest_distance = distance
+            closest_index = index
+
+    return closest_index
+
+
+def _resolve_color(color):
+    """
+    Resolve a color name, hex code, index or Color to a palette index.
+
+    Args:
+        color (str|int|Color): The color to resolve.
+
+    Returns:
+        int: The palette index (0-127).
+
+    Raises:
+        ValueError: If the color cannot be resolved to a valid index.
+    """
+    if isinstance(color, Color):
+        return color.index
+    if isinstance(color, str):
+        if color.startswith("#"):
+            return _find_closest_color(color)
+        index = COLOR_MAP.get(color.lower())
+        if index is None:
+            raise ValueError(
+                f"Unknown color name: {color}. Use a valid name like 'red' or a hex code like '#FF0000'."
+            )
+        return index
+    if not isinstance(color, int) or color not in range(128):
+        raise ValueError(
+            f"Invalid color: {color}. Must be an index (0-127), a hex code, or a valid color name."
+        )
+    return color
+
+
+class Color:
+    """
+    A palette color resolved once, for reuse in hot loops.
+
+    Passing a Color to a setter skips name lookup and hex parsing entirely.
+
+    Example:
+        red = Color("#FF0000")
+        apc.led.set_clip_launch(1, 1, red, 0)
+    """
+
+    __slots__ = ("index",)
+
+    def __init__(self, color):
+        """
+        Args:
+            color (str|int|Color): The color name, hex code, or index (0-127).
+
+        Raises:
+            ValueError: If the color cannot be resolved to a valid index.
+        """
+        self.index = _resolve_color(color)
+
+    def __int__(self):
+        return self.index
+
+    def __eq__(self, other):
+        if isinstance(other, Color):
+            return self.index == other.index
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __repr__(self):
+        return f"Color({self.index})"
+
+
+# Every addressable LED has a fixed slot. RGB pads (clip and scene launch) add
+# their LED type to the base channel; all other LEDs use the base channel as-is.
+CLIP_LAUNCH_SLOT = 0
+SCENE_LAUNCH_SLOT = 40
+TRACK_ROW_SLOTS = types.MappingProxyType({
+    "record": 45, "solo": 53, "number": 61, "select": 69,
+    "clip_stop": 77, "ab_assign": 85
+})
+DEVICE_CTRL_BUTTON_SLOT = 93
+BUTTON_SLOTS = types.MappingProxyType({
+    "master": 101, "pan": 102, "sends": 103, "user": 104, "metronome": 105,
+    "play": 106, "record": 107, "session": 108, "bank": 109
+})
+LED_COUNT = 110
+
+LED_CHANNEL = (
+    (1,) * 45
+    + tuple(track for _ in TRACK_ROW_SLOTS for track in range(1, 9))
+    + (1,) * 17
+)
+LED_NOTE = (
+    tuple((5 - row) * 8 + column for row in range(1, 6) for column in range(1, 9))
+    + tuple(0x52 + scene for scene in range(1, 6))
+    + tuple(note + 1 for note in (0x30, 0x31, 0x32, 0x33, 0x34, 0x42) for _ in range(8))
+    + tuple(0x3A + index for index in range(1, 9))
+    + tuple(note + 1 for note in (0x50, 0x57, 0x58, 0x59, 0x5A, 0x5B, 0x5D, 0x66, 0x67))
+)
+
+# Knob rings: 8 track knobs, then device knobs for channels 1-9 (8 each).
+TRACK_KNOB_SLOT = 0
+DEVICE_KNOB_SLOT = 8
+KNOB_COUNT = 80
+
+KNOB_CHANNEL = (1,) * 8 + tuple(channel for channel in range(1, 10) for _ in range(8))
+KNOB_VALUE_CC = tuple(0x30 + index for index in range(8)) + tuple(0x10 + index for index in range(8)) * 9
+KNOB_TYPE_CC = tuple(0x38 + index for index in range(8)) + tuple(0x18 + index for index in range(8)) * 9
+
+# Sentinel for "never set" / "device state unknown"; never a valid velocity or LED type.
+_UNKNOWN = 0xFF
+
+# Rows of 8 on/off or tri-state LEDs addressable in one call by set_track_row().
+LED_ROW_SLOTS = types.MappingProxyType(dict(TRACK_ROW_SLOTS, device_ctrl=DEVICE_CTRL_BUTTON_SLOT))
+_TRISTATE_ROWS = frozenset(("clip_stop", "ab_assign"))
+_TRISTATE_VALUES = frozenset((0, 1, 2))
+# Bitmask (bit 0 = track 1) -> 8 velocities, for on/off rows and for tri-state rows.
+_MASK_ON_OFF = tuple(tuple(127 if mask >> bit & 1 else 0 for bit in range(8)) for mask in range(256))
+_MASK_STATE = tuple(tuple(mask >> bit & 1 for bit in range(8)) for mask in range(256))
+_TRACK_RANGE = range(1, 9)
+
+
+
+def _readonly(array):
+    """Mark a module-level table read-only, since it is shared by every instance."""
+    array.flags.writeable = False
+    return array
+
+
+PALETTE_ARRAY = _readonly(np.array(PALETTE_RGB, dtype=np.uint8))
+# Nearest-neighbor terms in float32 so the distance product runs through BLAS;
+# every intermediate is an integer below 2**24, so the result stays exact.
+_PALETTE_NORM = _readonly((PALETTE_ARRAY.astype(np.float32) ** 2).sum(axis=1))
+_PALETTE_PRODUCT = _readonly(-2 * PALETTE_ARRAY.T.astype(np.float32))
+
+# Slot of each cell of the 5x9 grid: 8 clip launch columns plus the scene column.
+GRID_SLOTS = _readonly(np.array(
+    [[CLIP_LAUNCH_SLOT + row * 8 + column for column in range(8)] + [SCENE_LAUNCH_SLOT + row]
+     for row in range(5)],
+    dtype=np.intp
+))
+_GRID_SLOTS_8 = _readonly(GRID_SLOTS[:, :8].ravel())
+_GRID_SLOTS_9 = GRID_SLOTS.ravel()
+# Notes of the clip and scene pads, whose channel carries the LED type. Output queues
+# coalesce them by note alone, so a newer write replaces every channel variant of a pad.
+_PAD_NOTES = frozenset(LED_NOTE[:SCENE_LAUNCH_SLOT + 5])
+
+
+def quantize_rgb(rgb):
+    """
+    Map RGB colors to their nearest palette indices in one vectorized pass.
+
+    Ties resolve to the lowest index, matching the hex color lookup.
+
+    Args:
+        rgb (numpy.ndarray): Array of shape (..., 3). Integer arrays are read as 0-255,
+            float arrays as 0.0-1.0.
+
+    Returns:
+        numpy.ndarray: Palette indices (uint8) of shape rgb.shape[:-1].
+    """
+    rgb = np.asarray(rgb)
+    if rgb.shape[-1:] != (3,):
+        raise ValueError(f"Invalid RGB array shape: {rgb.shape}. The last axis must have size 3.")
+    if rgb.dtype.kind == "f":
+        rgb = np.rint(np.clip(rgb, 0.0, 1.0) * 255)
+    flat = rgb.reshape(-1, 3).astype(np.float32)
+    # |x - p|^2 = |x|^2 - 2 x.p + |p|^2; |x|^2 is constant per row.
+    distance = flat @ _PALETTE_PRODUCT
+    distance += _PALETTE_NORM
+    return distance.argmin(axis=1).astype(np.uint8).reshape(rgb.shape[:-1])
+
+
+# Outputs (backends) implement note_on(channel, note, velocity), control_change(channel,
+# control, value) and sysex(*data) with integer values (channels 1-16, data 0-127, SysEx
+# without F0/F7), plus tick() and flush(), which return the number of messages they sent.
+# Notes are numbered like the MIDI Out CHOP's sendNoteOn, i.e. MIDI note number + 1.
+# Anything else passed as midiout is treated as a MIDI Out CHOP and wrapped in DirectOutput.
+
+
+def _as_output(midiout):
+    return midiout if hasattr(midiout, "note_on") else DirectOutput(midiout)
+
+
+class DirectOutput:
+    """
+    Sends every message straight to a MIDI Out CHOP.
+
+    This is the default output of APC40MK2 in TouchDesigner. Velocities and values are
+    integers (0-127).
+    """
+
+    def __init__(self, midiout):
+        self.midiout = midiout
+
+    def note_on(self, channel, note, velocity):
+        self.midiout.sendNoteOn(channel, note, velocity / 127)
+
+    def control_change(self, channel, control, value):
+        self.midiout.send(0xB0 + channel - 1, control, value)
+
+    def sysex(self, *data):
+        self.midiout.sendExclusive(*data)
+
+    def tick(self):
+        return 0
+
+    def flush(self):
+        return 0
+
+
+class RawBytesOutput:
+    """
+    Encodes raw MIDI bytes into a reusable buffer and writes them to a sink, for use
+    outside TouchDesigner.
+
+    By default messages are collected until tick() or flush() and each frame goes to the
+    sink in a single write, with running status: a message on the same status byte as
+    the previous one omits it, so a grid repaint costs 2 bytes per pad. Each write
+    starts with a full status byte and SysEx cancels running status, so every write
+    stands on its own. A frame larger than the buffer is written in several parts.
+
+    File objects (io.IOBase, e.g. files and serial ports) receive a memoryview of the
+    reused buffer, which they consume before returning. Other sinks may keep what they
+    are given (an asyncio transport queues unsent data without copying it), so by
+    default they receive a bytes copy of each write.
+
+    Example:
+        port = serial.Serial("/dev/ttyUSB0", 31250)
+        apc = apc40mk2.APC40MK2(apc40mk2.RawBytesOutput(port))
+        ...
+        apc.tick()  # once per frame
+    """
+
+    def __init__(self, sink, batched=True, running_status=True, capacity=4096, copy=None):
+        """
+        Args:
+            sink: A file-like object with write(), or a callable taking a bytes-like object
+                (e.g. an asyncio transport's write).
+            batched (bool): Whether to write once per tick()/flush(). If False, every message
+                is written on its own, without running status (e.g. for rtmidi's send_message,
+                which takes exactly one message).
+            running_status (bool): Whether to omit repeated status bytes within a write.
+            capacity (int): Buffer size in bytes.
+            copy (bool|None): Whether the sink gets a bytes copy instead of a view of the
+                buffer. Defaults to False for io.IOBase sinks and True for anything else.
+
+        Raises:
+            ValueError: If capacity is too small for one message.
+        """
+        if capacity < 3:
+            raise ValueError(f"Invalid capacity: {capacity}. Must be at least 3.")
+        self.sink = sink
+        self.batched = batched
+        self.running_status = running_status and batched
+        self.capacity = capacity
+        self.copy = not isinstance(sink, io.IOBase) if copy is None else copy
+        self.writes = 0
+        self.bytes_written = 0
+        self._write = sink.write if hasattr(sink, "write") else sink
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        self._last = capacity - 3
+        self._status = 0
+
+    def _write_frame(self):
+        length = self._length
+        self._length = 0
+        self._status = 0
+        if length:
+            self._write(bytes(self._view[:length]) if self.copy else self._view[:length])
+            self.writes += 1
+            self.bytes_written += length
+        return length
+
+    def _put(self, status, data1, data2):
+        index = self._length
+        if index > self._last:
+            self._write_frame()
+            index = 0
+        buffer = self._buffer
+        if status != self._status:
+            buffer[index] = status
+            index += 1
+            self._status = status if self.running_status else 0
+        buffer[index] = data1
+        buffer[index + 1] = data2
+        self._length = index + 2
+        if not self.batched:
+            self._write_frame()
+
+    def note_on(self, channel, note, velocity):
+        self._put(0x8F + channel, note - 1, velocity)
+
+    def control_change(self, channel, control, value):
+        self._put(0xAF + channel, control, value)
+
+    def sysex(self, *data):
+        size = len(data) + 2
+        if self._length + size > self.capacity:
+            self._write_frame()
+            if size > self.capacity:
+                self._write(bytes((0xF0,) + data + (0xF7,)))
+                self.writes += 1
+                self.bytes_written += size
+                return
+        index = self._length
+        buffer = self._buffer
+        buffer[index] = 0xF0
+        buffer[index + 1:index + size - 1] = data
+        buffer[index + size - 1] = 0xF7
+        self._length = index + size
+        self._status = 0
+        if not self.batched:
+            self._write_frame()
+
+    def tick(self):
+        """
+        Write the frame collected so far.
+
+        Returns:
+            int: 0, since no queued messages are released.
+        """
+        self._write_frame()
+        return 0
+
+    def flush(self):
+        """
+        Write the frame collected so far and flush the sink if it supports it.
+
+        Returns:
+            int: 0, since no queued messages are released.
+        """
+        self._write_frame()
+        if hasattr(self.sink, "flush"):
+            self.sink.flush()
+        return 0
+
+
+class LoopbackOutput:
+    """
+    Keeps sent messages in memory as raw bytes, for tests and headless rigs.
+
+    Example:
+        loopback = apc40mk2.LoopbackOutput()
+        apc = apc40mk2.APC40MK2(loopback)
+        apc.led.set_play(True)
+        assert loopback.read() == [bytes((0x90, 0x5B, 0x7F))]
+    """
+
+    def __init__(self, receiver=None):
+        """
+        Args:
+            receiver (callable|None): Also called with each message's bytes, e.g. an
+                InputController's receive_bytes to feed output back as input.
+        """
+        self.receiver = receiver
+        self.messages = []
+
+    def _append(self, data):
+        self.messages.append(data)
+        if self.receiver is not None:
+            self.receiver(data)
+
+    def note_on(self, channel, note, velocity):
+        self._append(bytes((0x8F + channel, note - 1, velocity)))
+
+    def control_change(self, channel, control, value):
+        self._append(bytes((0xAF + channel, control, value)))
+
+    def sysex(self, *data):
+        self._append(bytes((0xF0,) + data + (0xF7,)))
+
+    def read(self):
+        """
+        Return and remove the messages sent so far.
+
+        Returns:
+            list: One bytes object per message, oldest first.
+        """
+        messages, self.messages = self.messages, []
+        return messages
+
+    def tick(self):
+        return 0
+
+    def flush(self):
+        return 0
+
+
+class OutputScheduler:
+    """
+    Rate-limited, coalescing output between the controllers and the MIDI Out CHOP.
+
+    Messages are queued and released by tick(), which should be called once per frame
+    (e.g. from an Execute DAT's onFrameStart). A message to a target (channel + note,
+    or channel + CC; clip and scene pads by note alone, since their channel is the LED
+    type) that is still queued is replaced in place by a newer one, so only the newest
+    value goes out. Messages over budget stay queued for the next tick.
+    SysEx messages are barriers: everything queued before one is sent before it, and
+    nothing queued after it is coalesced with anything before it.
+    """
+
+    def __init__(self, output, messages_per_tick=None, bytes_per_second=None, burst_bytes=None,
+                 clock=time.perf_counter):
+        """
+        Args:
+            output: The downstream output (e.g. DirectOutput(op('midiout1'))).
+            messages_per_tick (int|None): Maximum messages released per tick, or None for no limit.
+            bytes_per_second (float|None): Maximum sustained MIDI bytes per second, or None for no limit.
+            burst_bytes (int|None): Token bucket size for bytes_per_second. Defaults to 1/30 s of budget
+                (at least 64 bytes).
+            clock (callable): Time source in seconds.
+
+        Raises:
+            ValueError: If a budget is not positive.
+        """
+        if messages_per_tick is not None and messages_per_tick < 1:
+            raise ValueError(f"Invalid messages_per_tick: {messages_per_tick}. Must be at least 1.")
+        if bytes_per_second is not None and bytes_per_second <= 0:
+            raise ValueError(f"Invalid bytes_per_second: {bytes_per_second}. Must be positive.")
+        self.output = output
+        self.messages_per_tick = messages_per_tick
+        self.bytes_per_second = bytes_per_second
+        if burst_bytes is None and bytes_per_second is not None:
+            burst_bytes = max(64, int(bytes_per_second / 30))
+        self.burst_bytes = burst_bytes
+        self.clock = clock
+        self._tokens = burst_bytes
+        self._last_refill = None
+        # Each segment is either a dict {(target status, data1): (status, data2)} or a SysEx
+        # tuple. The target status of a pad note ignores its channel; see _PAD_NOTES.
+        self._segments = collections.deque()
+
+    def _open_segment(self):
+        if self._segments:
+            segment = self._segments[-1]
+            if isinstance(segment, dict):
+                return segment
+        segment = {}
+        self._segments.append(segment)
+        return segment
+
+    def note_on(self, channel, note, velocity):
+        status = 0x8F + channel
+        self._open_segment()[(0x90 if note in _PAD_NOTES else status, note)] = (status, velocity)
+
+    def control_change(self, channel, control, value):
+        status = 0xAF + channel
+        self._open_segment()[(status, control)] = (status, value)
+
+    def sysex(self, *data):
+        self._segments.append(data)
+
+    @property
+    def pending(self):
+        """int: The number of queued messages."""
+        return sum(len(segment) if isinstance(segment, dict) else 1 for segment in self._segments)
+
+    def _emit(self, status, data1, data2):
+        if status < 0xB0:
+            self.output.note_on(status - 0x8F, data1, data2)
+        else:
+            self.output.control_change(status - 0xAF, data1, data2)
+
+    def tick(self):
+        """
+        Release queued messages up to this tick's budget.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        limit = self.messages_per_tick
+        tokens = None
+        if self.bytes_per_second is not None:
+            now = self.clock()
+            if self._last_refill is not None:
+                self._tokens = min(
+                    self.burst_bytes, self._tokens + (now - self._last_refill) * self.bytes_per_second
+                )
+            self._last_refill = now
+            tokens = self._tokens
+
+        sent = 0
+        segments = self._segments
+        while segments and (limit is None or sent < limit):
+            segment = segments[0]
+            if isinstance(segment, dict):
+                while segment and (limit is None or sent < limit):
+                    if tokens is not None:
+                        if tokens < 3:
+                            break
+                        tokens -= 3
+                    key = next(iter(segment))
+                    status, data2 = segment.pop(key)
+                    self._emit(status, key[1], data2)
+                    sent += 1
+                if segment:
+                    break
+            else:
+                if tokens is not None:
+                    size = len(segment) + 2
+                    # A SysEx larger than the bucket still goes out once the bucket is full.
+                    if tokens < min(size, self.burst_bytes):
+                        break
+                    tokens -= size
+                self.output.sysex(*segment)
+                sent += 1
+            segments.popleft()
+
+        if tokens is not None:
+            self._tokens = tokens
+        return sent + self.output.tick()
+
+    def flush(self):
+        """
+        Send everything that is queued, ignoring the budget.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        sent = 0
+        while self._segments:
+            segment = self._segments.popleft()
+            if isinstance(segment, dict):
+                for (_, data1), (status, data2) in segment.items():
+                    self._emit(status, data1, data2)
+                sent += len(segment)
+            else:
+                self.output.sysex(*segment)
+                sent += 1
+        return sent + self.output.flush()
+
+
+BACKPRESSURE_POLICIES = ("drop_oldest", "coalesce", "block")
+
+
+# Queued in place of SysEx data to ask the ThreadedOutput worker to flush its output.
+_FLUSH = object()
+
+
+class ThreadedOutput:
+    """
+    Hands messages to a background thread that sends them, so a busy MIDI driver never
+    stalls the calling thread.
+
+    Messages go into a bounded ring preallocated at construction and leave it in order;
+    SysEx messages are barriers that are never dropped or reordered. When the ring is
+    full, the policy decides what happens:
+
+    - "drop_oldest": the oldest queued note/CC message is discarded (counted in dropped).
+    - "coalesce": a queued message to the same target (channel + note, or channel + CC;
+      a clip or scene pad whatever its LED type) since the last SysEx is updated in place (counted in coalesced), whether or not
+      the ring is full. A message to a new target waits for room.
+    - "block": the caller waits for room.
+
+    The downstream output is called from the worker thread only, so it must tolerate
+    being used off the main thread. flush() posts a marker that the worker answers by
+    flushing the output, so it is never touched from the caller's thread.
+
+    Example:
+        apc = apc40mk2.APC40MK2(op('midiout1'), threaded=True)
+        ...
+        apc.sender.close(timeout=1.0)
+    """
+
+    def __init__(self, output, capacity=1024, policy="coalesce", batch_size=64):
+        """
+        Args:
+            output: The downstream output, called from the worker thread (e.g. DirectOutput).
+            capacity (int): Maximum queued messages.
+            policy (str): Backpressure policy, one of BACKPRESSURE_POLICIES.
+            batch_size (int): Maximum messages the worker takes per lock acquisition.
+
+        Raises:
+            ValueError: If capacity or batch_size is not positive, or the policy is unknown.
+        """
+        if capacity < 1:
+            raise ValueError(f"Invalid capacity: {capacity}. Must be at least 1.")
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch_size: {batch_size}. Must be at least 1.")
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Invalid policy: {policy}. Must be one of {', '.join(BACKPRESSURE_POLICIES)}.")
+        self.output = output
+        self.capacity = capacity
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.coalesced = 0
+        self.error = None
+        # Status 0 marks a SysEx entry, whose data lives in _sysex; _FLUSH there marks a flush.
+        self._status = bytearray(capacity)
+        self._data1 = bytearray(capacity)
+        self._data2 = bytearray(capacity)
+        self._sysex = [None] * capacity
+        self._written = 0
+        self._read = 0
+        self._busy = False
+        self._closed = False
+        self._latest = {}
+        self._flushed = {}
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="ThreadedOutput", daemon=True)
+        self._thread.start()
+
+    def _wait_for_room(self):
+        while self._written - self._read >= self.capacity:
+            if self.policy == "drop_oldest" and self._status[self._read % self.capacity]:
+                self._read += 1
+                self.dropped += 1
+            else:
+                self._condition.wait()
+
+    def _put(self, status, data1, data2):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("ThreadedOutput is closed.")
+            if self.policy == "coalesce":
+                key = (0x90 if status < 0xA0 and data1 in _PAD_NOTES else status) << 8 | data1
+                seq = self._latest.get(key, -1)
+                if seq >= self._read:
+                    self._status[seq % self.capacity] = status
+                    self._data2[seq % self.capacity] = data2
+                    self.coalesced += 1
+                    return
+                self._wait_for_room()
+                self._latest[key] = self._written
+            else:
+                self._wait_for_room()
+            index = self._written % self.capacity
+            self._status[index] = status
+            self._data1[index] = data1
+            self._data2[index] = data2
+            self._written += 1
+            self._condition.notify_all()
+
+    def note_on(self, channel, note, velocity):
+        self._put(0x8F + channel, note, velocity)
+
+    def control_change(self, channel, control, value):
+        self._put(0xAF + channel, control, value)
+
+    def _put_barrier(self, data):
+        self._wait_for_room()
+        self._latest.clear()
+        index = self._written % self.capacity
+        self._status[index] = 0
+        self._sysex[index] = data
+        self._written += 1
+        self._condition.notify_all()
+        return self._written - 1
+
+    def sysex(self, *data):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("ThreadedOutput is closed.")
+            self._put_barrier(data)
+
+    @property
+    def pending(self):
+        """int: The number of messages queued or being sent."""
+        with self._condition:
+            return self._written - self._read + self._busy
+
+    def _run(self):
+        capacity = self.capacity
+        batch = []
+        while True:
+            with self._condition:
+                self._busy = False
+                while self._read == self._written:
+                    self._condition.notify_all()
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                self._busy = True
+                end = min(self._written, self._read + self.batch_size)
+                for seq in range(self._read, end):
+                    index = seq % capacity
+                    status = self._status[index]
+                    if status:
+                        batch.append((status, self._data1[index], self._data2[index]))
+                    else:
+                        batch.append((0, self._sysex[index], seq))
+                        self._sysex[index] = None
+                self._read = end
+                self._condition.notify_all()
+
+            output = self.output
+            flushed = None
+            for status, data1, data2 in batch:
+                try:
+                    if status >= 0xB0:
+                        output.control_change(status - 0xAF, data1, data2)
+                    elif status:
+                        output.note_on(status - 0x8F, data1, data2)
+                    elif data1 is _FLUSH:
+                        if flushed is None:
+                            flushed = {}
+                        flushed[data2] = 0  # Answer the caller even if the flush raises.
+                        flushed[data2] = output.flush()
+                    else:
+                        output.sysex(*data1)
+                except Exception as exc:  # Keep the worker alive; the caller can inspect error.
+                    self.error = exc
+            batch.clear()
+            if flushed:
+                with self._condition:
+                    for seq, sent in flushed.items():
+                        if seq in self._flushed:  # Skip flushes whose caller timed out.
+                            self._flushed[seq] = sent
+                    self._condition.notify_all()
+
+    def tick(self):
+        return 0
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued message has been sent and the worker has flushed the
+        downstream output.
+
+        Args:
+            timeout (float|None): Maximum seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            int: The number of messages that were still queued, plus those the downstream
+                flush sent.
+
+        Raises:
+            TimeoutError: If the queue did not drain within timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if self._closed:
+                return 0
+            pending = self._written - self._read + self._busy
+            seq = self._put_barrier(_FLUSH)
+            self._flushed[seq] = None
+            while self._flushed[seq] is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    del self._flushed[seq]
+                    raise TimeoutError(f"{self._written - self._read} messages still queued after {timeout} s.")
+                self._condition.wait(remaining)
+            return pending + self._flushed.pop(seq)
+
+    def close(self, timeout=None):
+        """
+        Send the remaining messages and stop the worker thread.
+
+        Args:
+            timeout (float|None): Maximum seconds to wait for the queue to drain.
+
+        Returns:
+            None
+
+        Raises:
+            TimeoutError: If the queue did not drain within timeout. The worker is stopped
+                anyway and the remaining messages are discarded.
+        """
+        try:
+            self.flush(timeout)
+        finally:
+            with self._condition:
+                self._closed = True
+                self._read = self._written
+                self._condition.notify_all()
+            self._thread.join()
+
+
+# One recorded MIDI message: seconds since start, byte count, up to 15 raw bytes.
+# Longer messages span several records; all but the last set the 0x80 bit of length.
+# Records are 24 bytes.
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("length", "u1"), ("data", "u1", (15,))])
+_RECORD = struct.Struct("<dB15s")
+_RECORD3 = struct.Struct("<dBBBB")
+_RECORD_MAGIC = b"APCMIDI1"
+
+
+class MidiRecorder:
+    """
+    Records everything sent to a MIDI Out CHOP into a compact binary file.
+
+    Use it in place of the CHOP; every call is forwarded unchanged and appended, with a
+    timestamp, to a preallocated ring buffer. A background thread writes the buffer to
+    disk, so recording costs one struct pack per message on the calling thread. If the
+    writer falls more than a full buffer behind, the oldest unwritten records are
+    dropped and counted in dropped.
+
+    Example:
+        recorder = apc40mk2.MidiRecorder(op('midiout1'), "show.apcmidi")
+        apc = apc40mk2.APC40MK2(recorder)
+        ...
+        recorder.close()
+    """
+
+    def __init__(self, midiout=None, path=None, capacity=1 << 16, flush_interval=0.5, clock=time.perf_counter):
+        """
+        Args:
+            midiout (MIDI Out CHOP|None): Where calls are forwarded, or None to only record.
+            path (str|None): File to write. If None, records only stay in the ring buffer.
+            capacity (int): Ring buffer size in records (24 bytes each).
+            flush_interval (float): Seconds between background writes.
+            clock (callable): Time source in seconds.
+        """
+        self.midiout = midiout
+        self.path = path
+        self.capacity = capacity
+        self.clock = clock
+        self.dropped = 0
+        self._buffer = bytearray(capacity * RECORD_DTYPE.itemsize)
+        self._records = np.frombuffer(self._buffer, dtype=RECORD_DTYPE)
+        self._written = 0
+        self._flushed = 0
+        self._start = clock()
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+        if path is not None:
+            self._file = open(path, "wb")
+            self._file.write(_RECORD_MAGIC)
+            self._thread = threading.Thread(
+                target=self._run, args=(flush_interval,), name="MidiRecorder", daemon=True
+            )
+            self._thread.start()
+
+    def _append3(self, status, data1, data2):
+        # Bytes past the third are left stale; length tells readers to ignore them.
+        _RECORD3.pack_into(self._buffer, (self._written % self.capacity) * 24,
+                           self.clock() - self._start, 3, status, data1, data2)
+        self._written += 1
+
+    def _append(self, data):
+        t = self.clock() - self._start
+        while len(data) > 15:
+            _RECORD.pack_into(self._buffer, (self._written % self.capacity) * 24, t, 0x80 | 15, data[:15])
+            self._written += 1
+            data = data[15:]
+        _RECORD.pack_into(self._buffer, (self._written % self.capacity) * 24, t, len(data), data)
+        self._written += 1
+
+    def sendNoteOn(self, channel, note, velocity=1.0):
+        if self.midiout is not None:
+            self.midiout.sendNoteOn(channel, note, velocity)
+        self._append3(0x8F + channel, note - 1, min(127, max(0, int(velocity * 127 + 0.5))))
+
+    def send(self, *data):
+        if self.midiout is not None:
+            self.midiout.send(*data)
+        if len(data) == 3:
+            self._append3(*data)
+        else:
+            self._append(bytes(data))
+
+    def sendExclusive(self, *data):
+        if self.midiout is not None:
+            self.midiout.sendExclusive(*data)
+        self._append(bytes((0xF0,) + data + (0xF7,)))
+
+    def records(self):
+        """
+        Return the records still held in the ring buffer, oldest first.
+
+        Returns:
+            numpy.ndarray: A copy, with dtype RECORD_DTYPE.
+        """
+        end = self._written
+        start = max(0, end - self.capacity)
+        index = np.arange(start, end) % self.capacity
+        return self._records[index]
+
+    def _write_pending(self):
+        end = self._written
+        start = max(self._flushed, end - self.capacity)
+        self.dropped += start - self._flushed
+        if start == end:
+            return
+        size = RECORD_DTYPE.itemsize
+        first = start % self.capacity
+        count = end - start
+        if first + count <= self.capacity:
+            chunk = bytes(self._buffer[first * size:(first + count) * size])
+        else:
+            chunk = bytes(self._buffer[first * size:]) + bytes(self._buffer[:(first + count - self.capacity) * size])
+        # Records overwritten while copying are no longer valid.
+        overrun = self._written - self.capacity - start
+        if overrun > 0:
+            self.dropped += overrun
+            chunk = chunk[overrun * size:]
+        self._file.write(chunk)
+        self._flushed = end
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self._write_pending()
+
+    def close(self):
+        """
+        Stop the background writer, write the remaining records, and close the file.
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._write_pending()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MidiReplayer:
+    """
+    Plays back a file written by MidiRecorder to a MIDI Out CHOP or any object with the
+    same methods.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The recording to load.
+
+        Raises:
+            ValueError: If the file is not a MidiRecorder recording.
+        """
+        with open(path, "rb") as f:
+            if f.read(len(_RECORD_MAGIC)) != _RECORD_MAGIC:
+                raise ValueError(f"Not a MidiRecorder file: {path}.")
+            self.records = np.fromfile(f, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def messages(self):
+        """
+        Iterate over the recorded messages.
+
+        Yields:
+            tuple: (time, data) with time in seconds since the recording started and data
+                the raw MIDI bytes.
+        """
+        pending = b""
+        for t, length, data in zip(self.records["time"].tolist(), self.records["length"].tolist(),
+                                   self.records["data"]):
+            pending += data[:length & 0x7F].tobytes()
+            if length & 0x80:
+                continue
+            yield t, pending
+            pending = b""
+
+    def play(self, midiout, realtime=True, speed=1.0):
+        """
+        Send the recording to midiout.
+
+        Args:
+            midiout: A MIDI Out CHOP, or any object with sendNoteOn, send and sendExclusive.
+            realtime (bool): Whether to reproduce the recorded timing. If False, messages are
+                sent as fast as possible.
+            speed (float): Playback speed multiplier for realtime playback.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        sent = 0
+        start = time.perf_counter()
+        for t, data in self.messages():
+            if realtime:
+                delay = t / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            status = data[0]
+            if status == 0xF0:
+                midiout.sendExclusive(*data[1:-1])
+            elif status & 0xF0 == 0x90:
+                midiout.sendNoteOn((status & 0x0F) + 1, data[1] + 1, data[2] / 127)
+            else:
+                midiout.send(*data)
+            sent += 1
+        return sent
+
+
+class MockMidiOut:
+    """
+    Pure-Python stand-in for a MIDI Out CHOP, for testing and profiling outside TouchDesigner.
+
+    Every call is appended to messages as ("note", channel, note, velocity),
+    ("send", *data) or ("sysex", *data). With record=False, calls are only counted.
+
+    Example:
+        midiout = apc40mk2.MockMidiOut()
+        apc = apc40mk2.APC40MK2(midiout)
+        apc.led.set_play(True)
+        assert midiout.messages == [("note", 1, 0x5C, 1.0)]
+    """
+
+    def __init__(self, record=True):
+        self.record = record
+        self.messages = []
+        self.count = 0
+
+    def sendNoteOn(self, channel, note, velocity=1.0):
+        self.count += 1
+        if self.record:
+            self.messages.append(("note", channel, note, velocity))
+
+    def send(self, *data):
+        self.count += 1
+        if self.record:
+            self.messages.append(("send",) + data)
+
+    def sendExclusive(self, *data):
+        self.count += 1
+        if self.record:
+            self.messages.append(("sysex",) + data)
+
+    def clear(self):
+        """
+        Forget all recorded messages and reset the count.
+
+        Returns:
+            None
+        """
+        self.messages.clear()
+        self.count = 0
+
+
+class VirtualClock:
+    """
+    A manually advanced time source, for the clock arguments of BlinkClock, KnobBindings,
+    SimulatedAPC40MK2 and others when testing or benchmarking without real time.
+
+    Example:
+        clock = apc40mk2.VirtualClock()
+        sim = apc40mk2.SimulatedAPC40MK2(clock=clock)
+        clock.advance(1 / 60)
+    """
+
+    __slots__ = ("now",)
+
+    def __init__(self, now=0.0):
+        """
+        Args:
+            now (float): The starting time in seconds.
+        """
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        """
+        Move the clock forward.
+
+        Args:
+            seconds (float): The time to add.
+
+        Returns:
+            float: The new time.
+        """
+        self.now += seconds
+        return self.now
+
+
+# Reverse address tables for SimulatedAPC40MK2. Clip and scene pads carry the LED type in
+# the channel, so they are found by raw note alone.
+_SIM_PAD_SLOT = types.MappingProxyType({LED_NOTE[slot] - 1: slot for slot in range(SCENE_LAUNCH_SLOT + 5)})
+_SIM_LED_SLOT = types.MappingProxyType(
+    {(LED_NOTE[slot] - 1, LED_CHANNEL[slot]): slot for slot in range(SCENE_LAUNCH_SLOT + 5, LED_COUNT)}
+)
+_SIM_KNOB_SLOT = types.MappingProxyType(dict(
+    [((KNOB_CHANNEL[slot], KNOB_VALUE_CC[slot]), (slot, False)) for slot in range(KNOB_COUNT)]
+    + [((KNOB_CHANNEL[slot], KNOB_TYPE_CC[slot]), (slot, True)) for slot in range(KNOB_COUNT)]
+))
+SIMULATED_OVERFLOW = ("drop", "delay")
+
+
+class SimulatedAPC40MK2:
+    """
+    A stand-in for the APC40 MK2 and its USB-MIDI link, for testing without hardware.
+
+    Use it wherever a MIDI Out CHOP is used. Each message occupies the modeled link for
+    its size over bytes_per_second plus a fixed per-message cost, and waits in a device
+    input buffer of buffer_bytes until processed. When the buffer is full, messages are
+    dropped ("drop") or queued anyway, growing the delay ("delay"). The device's LED and
+    knob ring state is tracked, press() feeds pad presses to an input callback, and the
+    time from a press to the pad's LED being processed is recorded as latency.
+
+    The default link parameters are rough guesses; calibrate them against a real device.
+
+    Example:
+        sim = apc40mk2.SimulatedAPC40MK2(on_input=lambda data: apc.input.receive_bytes(data))
+        apc = apc40mk2.APC40MK2(sim)
+        ...
+        lost = (sim.state().led_color != apc.snapshot().led_color).sum()
+    """
+
+    def __init__(self, bytes_per_second=40000.0, per_message_us=100.0, buffer_bytes=256, overflow="drop",
+                 input_latency_ms=1.0, on_input=None, clock=time.perf_counter):
+        """
+        Args:
+            bytes_per_second (float): Link and device throughput.
+            per_message_us (float): Fixed processing cost per message, in microseconds.
+            buffer_bytes (int): Device input buffer size.
+            overflow (str): "drop" or "delay", see above.
+            input_latency_ms (float): Delay from press() to the event reaching on_input.
+            on_input (callable|None): Called with the bytes of each input event by poll().
+            clock (callable): Time source in seconds; pass a virtual clock for reproducible runs.
+
+        Raises:
+            ValueError: If overflow is unknown or a link parameter is not positive.
+        """
+        if overflow not in SIMULATED_OVERFLOW:
+            raise ValueError(f"Invalid overflow: {overflow}. Must be one of {', '.join(SIMULATED_OVERFLOW)}.")
+        if bytes_per_second <= 0 or buffer_bytes < 3:
+            raise ValueError("Invalid link: bytes_per_second must be positive and buffer_bytes at least 3.")
+        self.bytes_per_second = bytes_per_second
+        self.per_message_us = per_message_us
+        self.buffer_bytes = buffer_bytes
+        self.overflow = overflow
+        self.input_latency_ms = input_latency_ms
+        self.on_input = on_input
+        self.clock = clock
+        self.led_color = np.full(LED_COUNT, _UNKNOWN, dtype=np.uint8)
+        self.led_type = np.full(LED_COUNT, _UNKNOWN, dtype=np.uint8)
+        self.knob_type = np.full(KNOB_COUNT, _UNKNOWN, dtype=np.uint8)
+        self.knob_value = np.full(KNOB_COUNT, _UNKNOWN, dtype=np.uint8)
+        self.latencies = []
+        self.reset_stats()
+        self._queue = collections.deque()
+        self._queued_bytes = 0
+        self._busy_until = 0.0
+        self._inputs = collections.deque()
+        self._pressed = {}
+
+    def reset_stats(self):
+        """
+        Zero the message counters, the maximum delay and the recorded latencies.
+
+        Returns:
+            None
+        """
+        self.received = dict.fromkeys(MESSAGE_METHODS, 0)
+        self.dropped = dict.fromkeys(MESSAGE_METHODS, 0)
+        self.max_delay = 0.0
+        self.latencies.clear()
+
+    def _accept(self, kind, size):
+        now = self.clock()
+        queue = self._queue
+        while queue and queue[0][0] <= now:
+            self._queued_bytes -= queue.popleft()[1]
+        if self.overflow == "drop" and self._queued_bytes + size > self.buffer_bytes:
+            self.dropped[kind] += 1
+            return None
+        done = max(now, self._busy_until) + size / self.bytes_per_second + self.per_message_us / 1e6
+        self._busy_until = done
+        queue.append((done, size))
+        self._queued_bytes += size
+        self.received[kind] += 1
+        self.max_delay = max(self.max_delay, done - now)
+        return done
+
+    def _note(self, channel, raw_note, value):
+        done = self._accept("note_on", 3)
+        if done is None:
+            return
+        slot = _SIM_PAD_SLOT.get(raw_note)
+        if slot is not None:
+            self.led_type[slot] = channel - 1
+        else:
+            slot = _SIM_LED_SLOT.get((raw_note, channel))
+            if slot is None:
+                return
+            self.led_type[slot] = 0
+        self.led_color[slot] = value
+        pressed = self._pressed.pop(slot, None)
+        if pressed is not None:
+            self.latencies.append(done - pressed)
+
+    def sendNoteOn(self, channel, note, velocity=1.0):
+        self._note(channel, note - 1, min(127, max(0, int(velocity * 127 + 0.5))))
+
+    def send(self, *data):
+        if len(data) == 3 and data[0] & 0xF0 == 0x90:
+            self._note((data[0] & 0x0F) + 1, data[1], data[2])
+            return
+        if len(data) != 3 or data[0] & 0xF0 != 0xB0:
+            self._accept("sysex" if data and data[0] == 0xF0 else "control_change", len(data))
+            return
+        if self._accept("control_change", 3) is None:
+            return
+        target = _SIM_KNOB_SLOT.get(((data[0] & 0x0F) + 1, data[1]))
+        if target is not None:
+            slot, is_type = target
+            (self.knob_type if is_type else self.knob_value)[slot] = data[2]
+
+    def sendExclusive(self, *data):
+        self._accept("sysex", len(data) + 2)
+
+    @property
+    def pending_bytes(self):
+        """int: Bytes accepted but not yet processed by the modeled device."""
+        now = self.clock()
+        return sum(size for done, size in self._queue if done > now)
+
+    def press(self, row, column, velocity=127):
+        """
+        Press a clip launch pad. The Note On reaches on_input at the next poll() after
+        input_latency_ms, and the next message lighting that pad's LED ends the latency
+        measurement.
+
+        Args:
+            row (int): The row index (1-5).
+            column (int): The column index (1-8).
+            velocity (int): The Note On velocity (1-127).
+
+        Returns:
+            None
+        """
+        now = self.clock()
+        self._pressed[(row - 1) * 8 + column - 1] = now
+        note = (5 - row) * 8 + column - 1
+        self._inputs.append((now + self.input_latency_ms / 1000, bytes((0x90, note, velocity))))
+        self._inputs.append((now + self.input_latency_ms / 1000, bytes((0x80, note, 0))))
+
+    def poll(self):
+        """
+        Deliver input events that are due to on_input.
+
+        Returns:
+            int: The number of events delivered.
+        """
+        now = self.clock()
+        delivered = 0
+        while self._inputs and self._inputs[0][0] <= now:
+            data = self._inputs.popleft()[1]
+            if self.on_input is not None:
+                self.on_input(data)
+            delivered += 1
+        return delivered
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Args:
+            percentiles (tuple): The percentiles to report.
+
+        Returns:
+            dict: Percentile -> press-to-LED latency in milliseconds (empty if nothing was measured).
+        """
+        if not self.latencies:
+            return {}
+        values = np.percentile(np.array(self.latencies) * 1000, percentiles)
+        return dict(zip(percentiles, values.tolist()))
+
+    def state(self):
+        """
+        Returns:
+            SurfaceState: What the modeled device is showing.
+        """
+        return SurfaceState(self.led_color, self.led_type, self.knob_type, self.knob_value)
+
+
 class LEDController:
-    """Class to manage all LED functionalities of APC40MK2."""
+    """
+    Class to manage all LED functionalities of APC40MK2.
+
+    The controller keeps a shadow copy of every LED. A setter only sends MIDI when
+    the LED's color or LED type actually changes. Between begin() and commit(),
+    writes are only recorded, and commit() sends the net difference in one pass.
+    """
+
+    # The palette tables are shared module constants, not per-instance copies.
+    color_map = COLOR_MAP
+    color_codes = COLOR_CODES
+
+    __slots__ = (
+        "midiout", "output", "_color", "_led_type", "_sent_color", "_sent_led_type", "_color_view",
+        "_led_type_view", "_sent_color_view", "_sent_led_type_view", "_batch_depth",
+    )
+
+    def __init__(self, midiout, output=None):
+        self.midiout = midiout
+        self.output = output if output is not None else _as_output(midiout)
+        self._color = bytearray([_UNKNOWN]) * LED_COUNT
+        self._led_type = bytearray([_UNKNOWN]) * LED_COUNT
+        self._sent_color = bytearray([_UNKNOWN]) * LED_COUNT
+        self._sent_led_type = bytearray([_UNKNOWN]) * LED_COUNT
+        self._color_view = np.frombuffer(self._color, dtype=np.uint8)
+        self._led_type_view = np.frombuffer(self._led_type, dtype=np.uint8)
+        self._sent_color_view = np.frombuffer(self._sent_color, dtype=np.uint8)
+        self._sent_led_type_view = np.frombuffer(self._sent_led_type, dtype=np.uint8)
+        self._batch_depth = 0
+
+    def _write(self, slot, color, led_type=0):
+        self._color[slot] = color
+        self._led_type[slot] = led_type
+        if self._batch_depth:
+            return
+        if self._sent_color[slot] != color or self._sent_led_type[slot] != led_type:
+            self._send(slot)
+
+    def _send(self, slot):
+        color = self._color[slot]
+        led_type = self._led_type[slot]
+        self.output.note_on(LED_CHANNEL[slot] + led_type, LED_NOTE[slot], color)
+        self._sent_color[slot] = color
+        self._sent_led_type[slot] = led_type
+
+    def begin(self):
+        """
+        Start a batch. Writes are recorded but not sent until the matching commit().
+
+        Batches may be nested; only the outermost commit() sends.
+
+        Returns:
+            None
+        """
+        self._batch_depth += 1
+
+    def commit(self):
+        """
+        End a batch and send every LED whose color or LED type changed since the last flush.
+
+        Returns:
+            int: The number of messages sent.
+
+        Raises:
+            RuntimeError: If no batch is open.
+        """
+        if not self._batch_depth:
+            raise RuntimeError("commit() called without a matching begin().")
+        self._batch_depth -= 1
+        if self._batch_depth:
+            return 0
+        return self.flush()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager form of begin()/commit().
+
+        Example:
+            with apc.led.batch():
+                for column in range(1, 9):
+                    apc.led.set_clip_launch(1, column, "red", 0)
+        """
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def flush(self):
+        """
+        Send every LED whose color or LED type differs from what was last sent.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        changed = np.flatnonzero(
+            (self._color_view != self._sent_color_view)
+            | (self._led_type_view != self._sent_led_type_view)
+        )
+        for slot in changed.tolist():
+            self._send(slot)
+        return len(changed)
+
+    def force_resync(self):
+        """
+        Forget what the device is showing and resend every LED that has been set.
+
+        Call this after the APC40 MK2 has been reconnected or reset. Inside a batch,
+        the resend happens at commit().
+
+        Returns:
+            int: The number of messages sent.
+        """
+        self._sent_color_view.fill(_UNKNOWN)
+        self._sent_led_type_view.fill(_UNKNOWN)
+        if self._batch_depth:
+            return 0
+        return self.flush()
+    
+    _resolve_color = staticmethod(_resolve_color)
+
+    def _find_closest_color(self, hex_color):
+        """
+        Find the closest color value to the given hex color.
+
+        Args:
+            hex_color (str): The hex color code (e.g., "#FF0000").
+
+        Returns:
+            int: The index of the closest color (0-127).
+        """
+        return _find_closest_color(hex_color)
+
+    def set_clip_launch(self, row, column, color, led_type):
+        """
+        Set the color of a clip launch button.
+
+        Args:
+            row (int): The row index of the clip launch button (1-5).
+            column (int): The column index of the clip launch button (1-8).
+            color (str|int|Color): The color name, hex code, index (0-127), or Color.
+                - Color names available: black, dark gray, gray, white, red, orange,
+                  yellow, green, cyan, blue, purple, magenta, pink.
+                - Hex codes: Any valid hexadecimal color code (e.g., "#FF0000").
+                - Index: Integer values between 0-127.
+                - Color: A pre-resolved Color, skipping color parsing.
+            led_type (int): LED Type (0-15).
+                - 0: Primary Color
+                - 1: Secondary Color (Oneshot 1/24)
+                - 2: Secondary Color (Oneshot 1/16)
+                - 3: Secondary Color (Oneshot 1/8)
+                - 4: Secondary Color (Oneshot 1/4)
+                - 5: Secondary Color (Oneshot 1/2)
+                - 6: Secondary Color (Pulsing 1/24)
+                - 7: Secondary Color (Pulsing 1/16)
+                - 8: Secondary Color (Pulsing 1/8)
+                - 9: Secondary Color (Pulsing 1/4)
+                - 10: Secondary Color (Pulsing 1/2)
+                - 11: Secondary Color (Blinking 1/24)
+                - 12: Secondary Color (Blinking 1/16)
+                - 13: Secondary Color (Blinking 1/8)
+                - 14: Secondary Color (Blinking 1/4)
+                - 15: Secondary Color (Blinking 1/2)
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the channel, row, column, or color values are out of their valid ranges.
+        """
+        if led_type not in range(16):
+            raise ValueError(f"Invalid channel: {led_type}. Must be 0-15.")
+        if row not in range(1, 6):
+            raise ValueError(f"Invalid row: {row}. Must be 1-5.")
+        if column not in range(1, 9):
+            raise ValueError(f"Invalid column: {column}. Must be 1-8.")
+
+        color = self._resolve_color(color)
+
+        self._write(CLIP_LAUNCH_SLOT + (row - 1) * 8 + column - 1, color, led_type)
+
+    def set_clip_grid(self, colors, led_type=0):
+        """
+        Set the whole clip launch grid, optionally including the scene launch column, in one call.
+
+        Row 0 of the array is the top row (row 1). Only pads whose color or LED type
+        changed are sent.
+
+        Args:
+            colors (numpy.ndarray): Palette indices of shape (5, 8) or (5, 9), or RGB
+                colors of shape (5, 8, 3) or (5, 9, 3). Column 9 is the scene launch column.
+                Integer RGB is read as 0-255, float RGB as 0.0-1.0.
+            led_type (int|numpy.ndarray): LED Type (0-15) for every pad, or an array
+                with the grid's (rows, columns) shape.
+
+        Returns:
+            int: The number of messages sent.
+
+        Raises:
+            ValueError: If the array shape, color indices, or LED types are out of their valid ranges.
+        """
+        colors = np.asarray(colors)
+        if colors.ndim == 3:
+            colors = quantize_rgb(colors)
+        if colors.ndim != 2 or colors.shape not in ((5, 8), (5, 9)):
+            raise ValueError(f"Invalid grid shape: {colors.shape}. Must be (5, 8) or (5, 9), with an optional RGB axis.")
+        if colors.size and (colors.min() < 0 or colors.max() > 127):
+            raise ValueError("Invalid color: grid indices must be in the range 0-127.")
+
+        if isinstance(led_type, int):
+            if led_type not in range(16):
+                raise ValueError(f"Invalid channel: {led_type}. Must be 0-15.")
+            led_types = np.uint8(led_type)
+        else:
+            led_types = np.asarray(led_type)
+            if led_types.ndim and led_types.shape != colors.shape:
+                raise ValueError(f"Invalid led_type shape: {led_types.shape}. Must match the grid shape {colors.shape}.")
+            if led_types.min() < 0 or led_types.max() > 15:
+                raise ValueError("Invalid channel: led_type must be in the range 0-15.")
+            led_types = led_types.astype(np.uint8).ravel() if led_types.ndim else led_types.astype(np.uint8)
+
+        slots = _GRID_SLOTS_8 if colors.shape[1] == 8 else _GRID_SLOTS_9
+        colors = colors.ravel().astype(np.uint8)
+        self._color_view[slots] = colors
+        self._led_type_view[slots] = led_types
+        if self._batch_depth:
+            return 0
+
+        changed = slots[
+            (colors != self._sent_color_view[slots]) | (self._led_type_view[slots] != self._sent_led_type_view[slots])
+        ]
+        for slot in changed.tolist():
+            self._send(slot)
+        return len(changed)
+
+    def set_clip_grid_from_top(self, top, led_type=0, include_scene=False):
+        """
+        Show a TOP on the clip launch grid, treating the pads as a low-resolution display.
+
+        The TOP should already be downsampled to 8x5 (or 9x5 with include_scene), e.g.
+        with a Resolution TOP; other sizes are point-sampled. Alpha is ignored.
+
+        Args:
+            top (TOP): The TouchDesigner TOP to read.
+            led_type (int|numpy.ndarray): LED Type (0-15), see set_clip_grid.
+            include_scene (bool): Whether the rightmost column drives the scene launch buttons.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        pixels = top.numpyArray()
+        height, width = pixels.shape[:2]
+        columns = 9 if include_scene else 8
+        if (height, width) != (5, columns):
+            rows = (np.arange(5) * height) // 5
+            cols = (np.arange(columns) * width) // columns
+            pixels = pixels[rows[:, None], cols]
+        # numpyArray() starts at the bottom row.
+        return self.set_clip_grid(pixels[::-1, :, :3], led_type)
+
+    def set_track_row(self, kind, values, unchecked=False):
+        """
+        Set a whole row of 8 track LEDs (or the 8 device control buttons) in one call.
+
+        Example:
+            apc.led.set_track_row("solo", 0b10110001)  # tracks 1, 5, 6 and 8 on
+            apc.led.set_track_row("clip_stop", [0, 1, 2, 0, 0, 0, 0, 1])
+
+        Args:
+            kind (str): The row.
+                - "record", "solo", "number", "select", "device_ctrl": On/off LEDs.
+                - "clip_stop": 0 Off, 1 On, 2 Blink.
+                - "ab_assign": 0 Off, 1 A, 2 B.
+            values (int|sequence|numpy.ndarray): Either a bitmask (bit 0 = track 1; a set bit
+                means On, or state 1 for tri-state rows), or 8 values: bools for on/off rows,
+                states 0-2 for tri-state rows.
+            unchecked (bool): Skip validating values, for hot loops whose input is already
+                known to be valid. Invalid values then produce undefined LED output.
+
+        Returns:
+            int: The number of messages sent.
+
+        Raises:
+            ValueError: If the kind is unknown, or (unless unchecked) values are invalid.
+        """
+        base = LED_ROW_SLOTS.get(kind)
+        if base is None:
+            raise ValueError(f"Invalid kind: {kind}. Must be one of {', '.join(LED_ROW_SLOTS)}.")
+        tristate = kind in _TRISTATE_ROWS
+
+        if isinstance(values, (int, np.integer)):
+            if not unchecked and values not in range(256):
+                raise ValueError(f"Invalid bitmask: {values}. Must be in the range 0-255.")
+            velocities = (_MASK_STATE if tristate else _MASK_ON_OFF)[values]
+        else:
+            if isinstance(values, np.ndarray):
+                values = values.tolist()
+            if not unchecked:
+                if len(values) != 8:
+                    raise ValueError(f"Invalid values: expected 8 values, got {len(values)}.")
+                if tristate:
+                    if not _TRISTATE_VALUES.issuperset(values):
+                        raise ValueError(f"Invalid state in {values}. States must be 0-2.")
+                    # Integral floats such as 2.0 pass the check but cannot go into the framebuffer.
+                    values = [int(value) for value in values]
+            velocities = values if tristate else [127 if value else 0 for value in values]
+
+        color = self._color
+        led_type = self._led_type
+        sent_color = self._sent_color
+        sent_led_type = self._sent_led_type
+        batching = self._batch_depth
+        sent = 0
+        for slot, value in enumerate(velocities, base):
+            color[slot] = value
+            led_type[slot] = 0
+            if not batching and (sent_color[slot] != value or sent_led_type[slot]):
+                self._send(slot)
+                sent += 1
+        return sent
+
+    def set_track_record(self, track, state):
+        """
+        Set the state of the record arm LED.
+
+        Args:
+            track (int): The track index (1-8).
+            state (bool): The state of the record arm LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the track index is not in the range 1-8.
+        """
+        if track not in _TRACK_RANGE:
+            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
+        
+        self._write(TRACK_ROW_SLOTS["record"] + track - 1, 127 if state else 0)
+
+    def set_track_solo(self, track, state):
+        """
+        Set the state of the solo LED.
+
+        Args:
+            track (int): The track index (1-8).
+            state (bool): The state of the solo LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the track index is not in the range 1-8.
+        """
+        if track not in _TRACK_RANGE:
+            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
+        
+        self._write(TRACK_ROW_SLOTS["solo"] + track - 1, 127 if state else 0)
+    
+    def set_track_number(self, track, state):
+        """
+        Set the state of the activator LED.
+
+        Args:
+            track (int): The track index (1-8).
+            state (bool): The state of the activator LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the track index is not in the range 1-8.
+        """
+        if track not in _TRACK_RANGE:
+            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
+        
+        self._write(TRACK_ROW_SLOTS["number"] + track - 1, 127 if state else 0)
+    
+    def set_track_select(self, track, state):
+        """
+        Set the state of the track select LED.
+
+        Args:
+            track (int): The track index (1-8).
+            state (bool): The state of the track select LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the track index is not in the range 1-8.
+        """
+        if track not in _TRACK_RANGE:
+            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
+        
+        self._write(TRACK_ROW_SLOTS["select"] + track - 1, 127 if state else 0)
+    
+    def set_track_clip_stop(self, track, state):
+        """
+        Set the state of the track stop LED.
+
+        Args:
+            track (int): The track index (1-8).
+            state (int): The state of the track stop LED.
+                - 0: Off
+                - 1: On
+                - 2: Blink (sync to tempo at 1/8 rate)
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the track index is not in the range 1-8.
+            ValueError: If the state is not in the range 0-2.
+        """
+        if track not in _TRACK_RANGE:
+            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
+        
+        if state not in range(3):
+            raise ValueError(f"Invalid state: {state}. Must be 0-2.")
+
+        self._write(TRACK_ROW_SLOTS["clip_stop"] + track - 1, state)
+    
+    def set_device_ctrl_button(self, index, state):
+        """
+        Set the state of the device control button LED.
+
+        Args:
+            index (int): The index of the device control button (1-8).
+            state (bool): The state of the device control button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the index is not in the range 1-8.
+        """
+        if index not in _TRACK_RANGE:
+            raise ValueError(f"Invalid index: {index}. Must be 1-8.")
+        
+        self._write(DEVICE_CTRL_BUTTON_SLOT + index - 1, 127 if state else 0)
+        
+    def set_track_ab_assign(self, track, state):
+        """
+        Set the state of the crossfader assign LED.
+        
+        Args:
+            track (int): The track index (1-8).
+            state (int): The state of the crossfader assign LED (0-2).
+                - 0: Off
+                - 1: A
+                - 2: B
+        
+        Returns:
+            None
+        
+        Raises:
+            ValueError: If the track index is not in the range 1-8.
+            ValueError: If the state is not in the range 0-2.
+        """
+        if track not in _TRACK_RANGE:
+            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
+        if state not in range(3):
+            raise ValueError(f"Invalid state: {state}. Must be 0-2.")
+
+        self._write(TRACK_ROW_SLOTS["ab_assign"] + track - 1, state)
+    
+    def set_master_track(self, state):
+        """
+        Set the state of the master track LED.
+
+        Args:
+            state (bool): The state of the master track LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["master"], 127 if state else 0)
+    
+    def set_scene_launch(self, scene, color, led_type):
+        """
+        Set the LED of a track scene launch button.
+        
+        Args:
+            scene (int): Scene index (1-5).
+            color (str|int|Color): The color name, hex code, index (0-127), or Color.
+                - Color names available: black, dark gray, gray, white, red, orange,
+                  yellow, green, cyan, blue, purple, magenta, pink.
+                - Hex codes: Any valid hexadecimal color code (e.g., "#FF0000").
+                - Index: Integer values between 0-127.
+                - Color: A pre-resolved Color, skipping color parsing.
+            led_type (int): LED Type (0-15).
+                - 0: Primary Color
+                - 1: Secondary Color (Oneshot 1/24)
+                - 2: Secondary Color (Oneshot 1/16)
+                - 3: Secondary Color (Oneshot 1/8)
+                - 4: Secondary Color (Oneshot 1/4)
+                - 5: Secondary Color (Oneshot 1/2)
+                - 6: Secondary Color (Pulsing 1/24)
+                - 7: Secondary Color (Pulsing 1/16)
+                - 8: Secondary Color (Pulsing 1/8)
+                - 9: Secondary Color (Pulsing 1/4)
+                - 10: Secondary Color (Pulsing 1/2)
+                - 11: Secondary Color (Blinking 1/24)
+                - 12: Secondary Color (Blinking 1/16)
+                - 13: Secondary Color (Blinking 1/8)
+                - 14: Secondary Color (Blinking 1/4)
+                - 15: Secondary Color (Blinking 1/2)
+                
+        Returns:
+            None
+        
+        Raises:
+            ValueError: If the scene or color values are out of their valid ranges.
+        """
+        if led_type not in range(16):
+            raise ValueError(f"Invalid channel: {led_type}. Must be 0-15.")
+        if scene not in range(1, 6):
+            raise ValueError(f"Invalid scene: {scene}. Must be 1-5.")
+
+        color = self._resolve_color(color)
+
+        self._write(SCENE_LAUNCH_SLOT + scene - 1, color, led_type)
+
+    def set_pan(self, state):
+        """
+        Set the state of the pan button LED.
+
+        Args:
+            state (bool): The state of the pan button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["pan"], 127 if state else 0)
+
+    def set_sends(self, state):
+        """
+        Set the state of the sends button LED.
+
+        Args:
+            state (bool): The state of the sends button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["sends"], 127 if state else 0)
+    
+    def set_user(self, state):
+        """
+        Set the state of the user button LED.
+
+        Args:
+            state (bool): The state of the user button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["user"], 127 if state else 0)
+    
+    def set_metronome(self, state):
+        """
+        Set the state of the metronome button LED.
+
+        Args:
+            state (bool): The state of the metronome button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["metronome"], 127 if state else 0)
+    
+    def set_play(self, state):
+        """
+        Set the state of the play button LED.
+
+        Args:
+            state (bool): The state of the play button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["play"], 127 if state else 0)
+    
+    def set_record(self, state):
+        """
+        Set the state of the record button LED.
+
+        Args:
+            state (bool): The state of the record button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["record"], 127 if state else 0)
+    
+    def set_session(self, state):
+        """
+        Set the state of the session button LED.
+        
+        Args:
+            state (bool): The state of the session button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["session"], 127 if state else 0)
+        
+    def set_bank(self, state):
+        """
+        Set the state of the bank button LED.
+        
+        Args:
+            state (bool): The state of the bank button LED.
+                - True: On
+                - False: Off
+
+        Returns:
+            None
+        """
+        self._write(BUTTON_SLOTS["bank"], 127 if state else 0)
+
+
+# Cell coordinates of the 5x9 grid (row 0 at the top, column 8 is the scene column).
+GRID_ROW, GRID_COLUMN = (_readonly(grid) for grid in np.mgrid[0:5, 0:9])
+# Effect output value for cells a layer does not paint.
+TRANSPARENT = -1
+
+
+# 5-pixel-high bitmap font. Each glyph lists its rows from the top, "#" for lit pixels.
+# Lowercase letters are drawn as uppercase; characters without a glyph are drawn as "?".
+FONT_5PX = types.MappingProxyType({
+    "0": "### #.# #.# #.# ###", "1": ".#. ##. .#. .#. ###", "2": "### ..# ### #.. ###",
+    "3": "### ..# .## ..# ###", "4": "#.# #.# ### ..# ..#", "5": "### #.. ### ..# ###",
+    "6": "### #.. ### #.# ###", "7": "### ..# ..# .#. .#.", "8": "### #.# ### #.# ###",
+    "9": "### #.# ### ..# ###",
+    "A": ".#. #.# ### #.# #.#", "B": "##. #.# ##. #.# ##.", "C": ".## #.. #.. #.. .##",
+    "D": "##. #.# #.# #.# ##.", "E": "### #.. ##. #.. ###", "F": "### #.. ##. #.. #..",
+    "G": ".## #.. #.# #.# .##", "H": "#.# #.# ### #.# #.#", "I": "### .#. .#. .#. ###",
+    "J": "..# ..# ..# #.# .#.", "K": "#.# #.# ##. #.# #.#", "L": "#.. #.. #.. #.. ###",
+    "M": "#...# ##.## #.#.# #...# #...#", "N": "#..# ##.# #.## #..# #..#",
+    "O": ".#. #.# #.# #.# .#.", "P": "##. #.# ##. #.. #..", "Q": ".#. #.# #.# ##. .##",
+    "R": "##. #.# ##. #.# #.#", "S": ".## #.. .#. ..# ##.", "T": "### .#. .#. .#. .#.",
+    "U": "#.# #.# #.# #.# ###", "V": "#.# #.# #.# #.# .#.",
+    "W": "#...# #...# #.#.# ##.## #...#", "X": "#.# #.# .#. #.# #.#",
+    "Y": "#.# #.# .#. .#. .#.", "Z": "### ..# .#. #.. ###",
+    " ": ".. .. .. .. ..", ".": ". . . . #", ",": ". . . # #", ":": ". # . # .",
+    "!": "# # # . #", "'": "# # . . .", "?": "##. ..# .#. ... .#.", "-": "... ... ### ... ...",
+    "+": "... .#. ### .#. ...", "=": "... ### ... ### ...", "/": "..# ..# .#. #.. #..",
+    "%": "#.# ..# .#. #.. #.#", "(": ".# #. #. #. .#", ")": "#. .# .# .# #.",
+})
+_GLYPHS = types.MappingProxyType({
+    char: _readonly(np.array([[pixel == "#" for pixel in row] for row in rows.split()], dtype=bool))
+    for char, rows in FONT_5PX.items()
+})
+# Upper bound on the memory held by cached text strips, in bytes.
+STRIP_CACHE_BYTES = 256 * 1024
+_STRIP_CACHE = collections.OrderedDict()
+
+
+def _text_strip(text, gap, spacing):
+    """
+    Render text once into a looped strip of pixel columns: gap blank columns, then the
+    text, then the first 9 columns again so any 9-column window is a plain slice.
+
+    Strips are cached, least recently used first out, within STRIP_CACHE_BYTES.
+
+    Returns:
+        tuple: (strip, period) where strip is a read-only (5, period + 9) bool array.
+    """
+    key = (text, gap, spacing)
+    strip = _STRIP_CACHE.get(key)
+    if strip is not None:
+        _STRIP_CACHE.move_to_end(key)
+        return strip, strip.shape[1] - 9
+
+    blank = np.zeros((5, spacing), dtype=bool)
+    columns = [np.zeros((5, gap), dtype=bool)]
+    for i, char in enumerate(text):
+        if i:
+            columns.append(blank)
+        columns.append(_GLYPHS.get(char.upper(), _GLYPHS["?"]))
+    unit = np.concatenate(columns, axis=1)
+    period = unit.shape[1]
+    strip = np.concatenate([unit] * (9 // period + 2), axis=1)[:, :period + 9]
+    strip.flags.writeable = False
+
+    _STRIP_CACHE[key] = strip
+    size = sum(cached.nbytes for cached in _STRIP_CACHE.values())
+    while size > STRIP_CACHE_BYTES and len(_STRIP_CACHE) > 1:
+        size -= _STRIP_CACHE.popitem(last=False)[1].nbytes
+    return strip, period
+
+
+class GridEffects:
+    """
+    Layered effects engine for the clip launch grid and scene column.
+
+    An effect is a function of time, effect(t), returning palette indices for the 5x9 grid
+    (or anything that broadcasts to it), with TRANSPARENT (-1) for cells it leaves alone.
+    Effects are computed with NumPy, never per cell. Layers are drawn from lowest to highest
+    priority, each painting over the ones below. tick(t) renders one frame and sends only
+    the pads that changed.
+
+    Example:
+        fx = apc.effects
+        fx.add("background", fx.wave(fx.gradient("black", "blue"), period=2.0))
+        fx.add("chase", fx.chase("white", period=0.5), priority=1)
+
+        # In an Execute DAT
+        def onFrameStart(frame):
+            apc.effects.tick(absTime.seconds)
+    """
+
+    __slots__ = ("led", "include_scene", "background", "_layers", "_order", "_frame")
+
+    def __init__(self, led, include_scene=True, background="black"):
+        """
+        Args:
+            led (LEDController): Where frames are sent.
+            include_scene (bool): Whether column 9 drives the scene launch buttons.
+            background (str|int|Color): Color of cells no layer paints.
+        """
+        self.led = led
+        self.include_scene = include_scene
+        self.background = _resolve_color(background)
+        self._layers = []
+        self._order = 0
+        self._frame = np.empty((5, 9), dtype=np.int16)
+
+    def add(self, name, effect, priority=0):
+        """
+        Add a layer, replacing any layer with the same name.
+
+        Args:
+            name (str): The layer name.
+            effect (callable): effect(t) -> palette indices for the 5x9 grid, TRANSPARENT for unpainted cells.
+            priority (int): Higher priorities are drawn on top; equal priorities keep insertion order.
+
+        Returns:
+            callable: The effect.
+        """
+        self.remove(name, missing_ok=True)
+        self._layers.append((priority, self._order, name, effect))
+        self._order += 1
+        self._layers.sort(key=lambda layer: layer[:2])
+        return effect
+
+    def remove(self, name, missing_ok=False):
+        """
+        Remove a layer.
+
+        Args:
+            name (str): The layer name.
+            missing_ok (bool): Whether a missing layer is ignored.
+
+        Returns:
+            None
+
+        Raises:
+            KeyError: If the layer does not exist and missing_ok is False.
+        """
+        for i, layer in enumerate(self._layers):
+            if layer[2] == name:
+                del self._layers[i]
+                return
+        if not missing_ok:
+            raise KeyError(name)
+
+    def clear(self):
+        """
+        Remove all layers.
+
+        Returns:
+            None
+        """
+        self._layers.clear()
+
+    @property
+    def layers(self):
+        """list: Layer names from bottom to top."""
+        return [layer[2] for layer in self._layers]
+
+    def render(self, t):
+        """
+        Composite all layers at time t.
+
+        Args:
+            t (float): Time in seconds.
+
+        Returns:
+            numpy.ndarray: The 5x9 frame of palette indices (a buffer reused by the next call).
+        """
+        frame = self._frame
+        frame.fill(self.background)
+        for _, _, _, effect in self._layers:
+            layer = np.asarray(effect(t))
+            np.copyto(frame, layer, where=layer >= 0, casting="unsafe")
+        return frame
+
+    def tick(self, t):
+        """
+        Render the frame at time t and send the pads that changed.
+
+        Args:
+            t (float): Time in seconds, e.g. absTime.seconds.
+
+        Returns:
+            int: The number of messages sent.
+        """
+        frame = self.render(t)
+        return self.led.set_clip_grid(frame if self.include_scene else frame[:, :8])
+
+    @staticmethod
+    def gradient(start, end, steps=8):
+        """
+        Build a ramp of palette indices from one color to another.
+
+        Args:
+            start (str|int|Color): The first color.
+            end (str|int|Color): The last color.
+            steps (int): The number of entries.
+
+        Returns:
+            numpy.ndarray: Palette indices, nearest to an even RGB blend.
+        """
+        a = PALETTE_ARRAY[_resolve_color(start)].astype(np.float64)
+        b = PALETTE_ARRAY[_resolve_color(end)].astype(np.float64)
+        blend = np.linspace(0.0, 1.0, steps)[:, None]
+        return quantize_rgb(np.rint(a + (b - a) * blend).astype(np.int32)).astype(np.int16)
+
+    @staticmethod
+    def _ramp(colors):
+        if isinstance(colors, np.ndarray):
+            return colors.astype(np.int16)
+        return np.array([_resolve_color(color) for color in colors], dtype=np.int16)
+
+    @staticmethod
+    def solid(color):
+        """
+        Paint every cell one color.
+
+        Args:
+            color (str|int|Color): The color.
+
+        Returns:
+            callable: The effect.
+        """
+        index = np.int16(_resolve_color(color))
+        return lambda t: index
+
+    @staticmethod
+    def chase(color, period=1.0, width=1.0, columns=9, reverse=False):
+        """
+        A vertical bar sweeping across the grid.
+
+        Args:
+            color (str|int|Color): The bar color.
+            period (float): Seconds per sweep.
+            width (float): Bar width in columns.
+            columns (int): Columns swept (9 includes the scene column).
+            reverse (bool): Sweep right to left.
+
+        Returns:
+            callable: The effect.
+        """
+        index = np.int16(_resolve_color(color))
+        column = GRID_COLUMN[:1] if not reverse else columns - 1 - GRID_COLUMN[:1]
+        active = GRID_COLUMN[:1] < columns
+
+        def effect(t):
+            head = (t / period) % 1.0 * columns
+            lit = ((column - head) % columns < width) & active
+            return np.where(lit, index, np.int16(TRANSPARENT))
+
+        return effect
+
+    @staticmethod
+    def wave(colors, period=1.0, wavelength=9.0, vertical=False):
+        """
+        A sine wave travelling across the grid, mapped onto a color ramp.
+
+        Args:
+            colors (sequence|numpy.ndarray): Ramp from trough to crest, e.g. from gradient().
+            period (float): Seconds per cycle.
+            wavelength (float): Cells per cycle.
+            vertical (bool): Travel down the rows instead of across the columns.
+
+        Returns:
+            callable: The effect.
+        """
+        ramp = GridEffects._ramp(colors)
+        position = (GRID_ROW[:, :1] if vertical else GRID_COLUMN[:1]) * (2 * np.pi / wavelength)
+        scale = len(ramp) - 1
+
+        def effect(t):
+            level = np.sin(position - t * (2 * np.pi / period))
+            return ramp[np.rint((level + 1.0) * (scale / 2)).astype(np.intp)]
+
+        return effect
+
+    @staticmethod
+    def radial(colors, period=1.0, wavelength=4.0, center=(2.0, 4.0)):
+        """
+        Rings rippling outward from a center cell, mapped onto a color ramp.
+
+        Args:
+            colors (sequence|numpy.ndarray): Ramp from trough to crest.
+            period (float): Seconds per cycle.
+            wavelength (float): Cells between rings.
+            center (tuple): (row, column) of the center, 0-based; may be fractional.
+
+        Returns:
+            callable: The effect.
+        """
+        ramp = GridEffects._ramp(colors)
+        distance = np.hypot(GRID_ROW - center[0], GRID_COLUMN - center[1]) * (2 * np.pi / wavelength)
+        scale = len(ramp) - 1
+
+        def effect(t):
+            level = np.sin(distance - t * (2 * np.pi / period))
+            return ramp[np.rint((level + 1.0) * (scale / 2)).astype(np.intp)]
+
+        return effect
+
+    @staticmethod
+    def strobe(color, rate=8.0, duty=0.5):
+        """
+        Flash the whole grid.
+
+        Args:
+            color (str|int|Color): The flash color.
+            rate (float): Flashes per second.
+            duty (float): Fraction of each flash that is lit (0.0-1.0).
+
+        Returns:
+            callable: The effect.
+        """
+        index = np.int16(_resolve_color(color))
+        transparent = np.int16(TRANSPARENT)
+        return lambda t: index if (t * rate) % 1.0 < duty else transparent
+
+    @staticmethod
+    def fade(start, end, duration=1.0, start_time=0.0, steps=32):
+        """
+        Fade the whole grid from one color to another, then hold.
+
+        The palette colors along the fade are quantized once, when the effect is created.
+
+        Args:
+            start (str|int|Color): The starting color.
+            end (str|int|Color): The final color.
+            duration (float): Fade length in seconds.
+            start_time (float): Time the fade starts.
+            steps (int): Color steps along the fade.
+
+        Returns:
+            callable: The effect.
+        """
+        table = GridEffects.gradient(start, end, steps)
+        last = steps - 1
+
+        def effect(t):
+            progress = min(max((t - start_time) / duration, 0.0), 1.0) if duration > 0 else 1.0
+            return table[int(progress * last + 0.5)]
+
+        return effect
+
+    @staticmethod
+    def text(text, color="white", speed=8.0, start_time=0.0, loop=True, gap=8, spacing=1, columns=8):
+        """
+        Scroll text right to left in the built-in 5-pixel font (FONT_5PX).
+
+        The text is rendered into a cached strip of pixel columns once; each frame is a
+        slice of that strip, and nothing is recomputed until the scroll moves a column.
+
+        Args:
+            text (str): The text.
+            color (str|int|Color): The text color. Unlit pixels are transparent.
+            speed (float): Columns per second; 0 holds the start of the text.
+            start_time (float): Time the scroll starts.
+            loop (bool): Repeat the text, gap columns apart. Without loop, it scrolls in
+                from the right once and leaves the grid empty after it has scrolled off.
+            gap (int): Blank columns before each pass of the text.
+            spacing (int): Blank columns between characters.
+            columns (int): Columns used (9 includes the scene column).
+
+        Returns:
+            callable: The effect.
+
+        Raises:
+            ValueError: If columns, gap or spacing are out of range, or looping text is empty and gap is 0.
+        """
+        if columns not in (8, 9):
+            raise ValueError(f"Invalid columns: {columns}. Must be 8 or 9.")
+        if gap < 0 or spacing < 0:
+            raise ValueError("Invalid gap or spacing: must be 0 or more.")
+        if not loop:
+            gap = max(gap, columns)
+        elif not text and gap < 1:
+            raise ValueError("Invalid gap: looping empty text needs a gap of at least 1.")
+        strip, period = _text_strip(text, gap, spacing)
+        lit = np.int16(_resolve_color(color) + 1)
+        frame = np.full((5, 9), TRANSPARENT, dtype=np.int16)
+        window = frame[:, :columns]
+        state = [None]
+
+        def effect(t):
+            position = math.floor((t - start_time) * speed)
+            if position == state[0]:
+                return frame
+            state[0] = position
+            if not loop and (position < 0 or position >= period):
+                window.fill(TRANSPARENT)
+                return frame
+            position %= period
+            # Lit pixels become color + 1 - 1, unlit ones 0 - 1 (TRANSPARENT).
+            np.multiply(strip[:, position:position + columns], lit, out=window)
+            np.subtract(window, 1, out=window)
+            return frame
+
+        return effect
+
+    @staticmethod
+    def sprite(image, color="white", position=(0, 0), velocity=(0.0, 0.0), start_time=0.0, wrap=True):
+        """
+        Move a small image across the grid.
+
+        Args:
+            image (numpy.ndarray): A 2D bool mask of lit pixels, drawn in color, or palette
+                indices with TRANSPARENT for unpainted pixels. At most 5x9.
+            color (str|int|Color): The color of a mask image; ignored for palette images.
+            position (tuple): (row, column) of the image's top-left cell at start_time, 0-based.
+            velocity (tuple): (rows, columns) moved per second.
+            start_time (float): Time the motion starts.
+            wrap (bool): Wrap around the 5x9 grid edges instead of moving off them.
+
+        Returns:
+            callable: The effect.
+
+        Raises:
+            ValueError: If the image is not 2D or larger than the grid.
+        """
+        image = np.asarray(image)
+        if image.ndim != 2 or image.shape[0] > 5 or image.shape[1] > 9:
+            raise ValueError(f"Invalid sprite shape: {image.shape}. Must be 2D and at most (5, 9).")
+        if image.dtype == bool:
+            image = np.where(image, np.int16(_resolve_color(color)), np.int16(TRANSPARENT))
+        height, width = image.shape
+        canvas = np.full((5, 9), TRANSPARENT, dtype=np.int16)
+        canvas[:height, :width] = image
+        frame = np.full((5, 9), TRANSPARENT, dtype=np.int16)
+        state = [None]
+
+        def effect(t):
+            elapsed = t - start_time
+            offset = (math.floor(position[0] + velocity[0] * elapsed), math.floor(position[1] + velocity[1] * elapsed))
+            if offset == state[0]:
+                return frame
+            state[0] = offset
+            row, column = offset
+            if wrap:
+                frame[:] = np.roll(canvas, (row, column), axis=(0, 1))
+                return frame
+            frame.fill(TRANSPARENT)
+            top, left = max(row, 0), max(column, 0)
+            bottom, right = min(row + height, 5), min(column + width, 9)
+            if top < bottom and left < right:
+                frame[top:bottom, left:right] = image[top - row:bottom - row, left - column:right - column]
+            return frame
+
+        return effect
+
+
+KNOB_EASINGS = types.MappingProxyType({"linear": 1, "exponential": 2, "damped": 3})
+
+
+class KnobController:
+    """
+    Class to manage all knob functionalities of APC40MK2.
+
+    Besides the direct setters, ring values can be animated: animate_*() sets a float
+    target per ring and tick() moves every ring toward its target at frame rate, sending
+    a CC only when a ring's quantized 0-127 value changes. Ring state lives in flat
+    NumPy arrays indexed by knob slot.
+    """
+
+    __slots__ = (
+        "midiout", "output", "clock", "_value", "_value_view", "_type", "_type_view", "_current", "_target",
+        "_velocity", "_duration", "_easing", "_last_tick",
+    )
+    
+    def __init__(self, midiout, output=None, clock=time.perf_counter):
+        self.midiout = midiout
+        self.output = output if output is not None else _as_output(midiout)
+        self.clock = clock
+        self._value = bytearray([_UNKNOWN]) * KNOB_COUNT
+        self._value_view = np.frombuffer(self._value, dtype=np.uint8)
+        self._type = bytearray([_UNKNOWN]) * KNOB_COUNT
+        self._type_view = np.frombuffer(self._type, dtype=np.uint8)
+        self._current = np.zeros(KNOB_COUNT)
+        self._target = np.zeros(KNOB_COUNT)
+        self._velocity = np.zeros(KNOB_COUNT)
+        self._duration = np.zeros(KNOB_COUNT)
+        self._easing = np.zeros(KNOB_COUNT, dtype=np.uint8)
+        self._last_tick = None
+
+    def _send_type(self, slot, knob_type):
+        self.output.control_change(KNOB_CHANNEL[slot], KNOB_TYPE_CC[slot], knob_type)
+        self._type[slot] = knob_type
+
+    def _send_value(self, slot, value):
+        self.output.control_change(KNOB_CHANNEL[slot], KNOB_VALUE_CC[slot], value)
+        self._value[slot] = value
+        self._current[slot] = value / 127
+        self._velocity[slot] = 0.0
+        self._easing[slot] = 0
+
+    def _animate(self, slots, target, easing, duration):
+        if easing not in KNOB_EASINGS:
+            raise ValueError(f"Invalid easing: {easing}. Must be one of {', '.join(KNOB_EASINGS)}.")
+        if duration < 0:
+            raise ValueError(f"Invalid duration: {duration}. Must be 0 or greater.")
+        target = np.clip(target, 0.0, 1.0)
+        # Rings that have never been set start from their target instead of sweeping from 0.
+        fresh = self._value_view[slots] == _UNKNOWN
+        if fresh.any():
+            start = np.where(fresh, target, self._current[slots])
+            self._current[slots] = start
+        self._target[slots] = target
+        self._duration[slots] = duration
+        self._easing[slots] = KNOB_EASINGS[easing]
+
+    def animate_track_knob(self, index, target, easing="exponential", duration=0.1):
+        """
+        Move a track knob ring toward a float target over the next frames.
+
+        Args:
+            index (int): The index of the track knob (1-8).
+            target (float): The target value (0.0-1.0).
+            easing (str): How the ring approaches its target.
+                - "linear": Constant speed; a full 0-1 sweep takes duration seconds.
+                - "exponential": Covers ~63% of the remaining distance every duration seconds.
+                - "damped": Critically damped spring with a smoothing time of duration seconds.
+            duration (float): Time constant in seconds. 0 jumps on the next tick.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the index is not in the range 1-8, or easing or duration is invalid.
+        """
+        if index not in range(1, 9):
+            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
+        self._animate(TRACK_KNOB_SLOT + index - 1, target, easing, duration)
+
+    def animate_track_knobs(self, targets, easing="exponential", duration=0.1):
+        """
+        Move all 8 track knob rings toward float targets over the next frames.
+
+        Args:
+            targets (sequence|numpy.ndarray): 8 target values (0.0-1.0).
+            easing (str): See animate_track_knob.
+            duration (float): See animate_track_knob.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If targets does not have 8 values, or easing or duration is invalid.
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        if targets.shape != (8,):
+            raise ValueError(f"Invalid targets shape: {targets.shape}. Must be (8,).")
+        self._animate(slice(TRACK_KNOB_SLOT, TRACK_KNOB_SLOT + 8), targets, easing, duration)
+
+    def animate_device_ctrl_knob(self, channel, index, target, easing="exponential", duration=0.1):
+        """
+        Move a device knob ring toward a float target over the next frames.
+
+        Args:
+            channel (int): MIDI channel (1-9).
+                - 1-8: Tracks 1-8
+                - 9: Master
+            index (int): Knob index (1-8).
+            target (float): The target value (0.0-1.0).
+            easing (str): See animate_track_knob.
+            duration (float): See animate_track_knob.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the channel is not in the range 1-9, index is not in the range 1-8,
+                or easing or duration is invalid.
+        """
+        if channel not in range(1, 10):
+            raise ValueError(f"Invalid channel: {channel}. The channel must be in the range 1-9.")
+        if index not in range(1, 9):
+            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
+        self._animate(DEVICE_KNOB_SLOT + (channel - 1) * 8 + index - 1, target, easing, duration)
+
+    def tick(self, dt=None):
+        """
+        Advance all animated rings by one frame and send the rings whose quantized value changed.
+
+        Args:
+            dt (float|None): Seconds since the previous tick. If None, measured with the clock.
+
+        Returns:
+            int: The number of CCs sent.
+        """
+        now = self.clock()
+        if dt is None:
+            dt = 0.0 if self._last_tick is None else now - self._last_tick
+        self._last_tick = now
+
+        active = np.flatnonzero(self._easing)
+        if not len(active):
+            return 0
+
+        current = self._current[active]
+        target = self._target[active]
+        velocity = self._velocity[active]
+        duration = self._duration[active]
+        easing = self._easing[active]
+        instant = duration <= 0.0
+        safe_duration = np.where(instant, 1.0, duration)
+
+        linear = easing == KNOB_EASINGS["linear"]
+        step = dt / safe_duration
+        moved_linear = current + np.clip(target - current, -step, step)
+
+        moved_exponential = target + (current - target) * np.exp(-dt / safe_duration)
+
+        # Critically damped spring (closed-form step approximation, stable for any dt).
+        omega = 2.0 / safe_duration
+        x = omega * dt
+        decay = 1.0 / (1.0 + x + 0.48 * x * x + 0.235 * x * x * x)
+        change = current - target
+        temp = (velocity + omega * change) * dt
+        damped_velocity = (velocity - omega * temp) * decay
+        moved_damped = target + (change + temp) * decay
+
+        damped = easing == KNOB_EASINGS["damped"]
+        current = np.where(linear, moved_linear, np.where(damped, moved_damped, moved_exponential))
+        velocity = np.where(damped, damped_velocity, 0.0)
+        settled = instant | ((np.abs(target - current) < 0.5 / 127 / 16) & (np.abs(velocity) < 1e-3))
+        current = np.where(settled, target, current)
+
+        self._current[active] = current
+        self._velocity[active] = np.where(settled, 0.0, velocity)
+        self._easing[active[settled]] = 0
+
+        quantized = np.rint(current * 127).astype(np.uint8)
+        changed = quantized != self._value_view[active]
+        slots = active[changed].tolist()
+        for slot, value in zip(slots, quantized[changed].tolist()):
+            self.output.control_change(KNOB_CHANNEL[slot], KNOB_VALUE_CC[slot], value)
+            self._value[slot] = value
+        return len(slots)
+    
+    def set_track_knob_type(self, index, type):
+        """
+        Set the type of the track knob.
+
+        Args:
+            index (int): The index of the track knob (1-8).
+            type (int): The type of the track knob.
+                - 0: Off
+                - 1: Single
+                - 2: Volume style
+                - 3: Pan style
+                - 4-127: Custom values (treated as Single)
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the index is not in the range 1-8 or type is not in the range 0-127.
+        """
+        
+        if index not in range(1, 9):
+            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
+        
+        if type not in range(128):
+            raise ValueError(f"Invalid type: {type}. The type must be in the range 0-127.")
+        
+        self._send_type(TRACK_KNOB_SLOT + index - 1, type)
+        
+    def set_track_knob_value(self, index, value):
+        """
+        Set the value of a track knob.
+
+        Args:
+            index (int): The index of the track knob (1-8).
+            value (int): The value of the track knob (0-127).
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the index is not in the range 1-8 or value is not in the range 0-127.
+        """
+        if index not in range(1, 9):
+            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
+        
+        if value not in range(128):
+            raise ValueError(f"Invalid value: {value}. The value must be in the range 0-127.")
+        
+        self._send_value(TRACK_KNOB_SLOT + index - 1, value)
+
+    def set_device_ctrl_knob_type(self, channel, index, knob_type):
+        """
+        Configure the LED ring type for a device knob.
+
+        Args:
+            channel (int): MIDI channel (1-9).
+                - 1-8: Tracks 1-8
+                - 9: Master
+                - Note: Set to 1 for modes 1 (Ableton Live Mode) and 2 (Alternate Ableton Live Mode).
+            index (int): Knob index (1-8).
+            knob_type (int): LED ring style.
+                - 0: Off
+                - 1: Single
+                - 2: Volume Style
+                - 3: Pan Style
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the channel is not in the range 1-9, index is not in the range 1-8, or knob_type is not in the range 0-127.
+        """
+        if channel not in range(1, 10):
+            raise ValueError(f"Invalid channel: {channel}. The channel must be in the range 1-9.")
+        
+        if index not in range(1, 9):
+            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
+        
+        if knob_type not in range(4):
+            raise ValueError(f"Invalid knob_type: {knob_type}. The knob_type must be in the range 0-3.")
+        
+        self._send_type(DEVICE_KNOB_SLOT + (channel - 1) * 8 + index - 1, knob_type)
+    
+    def set_device_ctrl_knob_value(self, channel, index, value):
+        """
+        Set the value of a device knob.
+
+        Args:
+            channel (int): MIDI channel (1-9).
+                - 1-8: Tracks 1-8
+                - 9: Master
+                - Note: Set to 1 for modes 1 (Ableton Live Mode) and 2 (Alternate Ableton Live Mode).
+            index (int): Knob index (1-8).
+            value (int): The value of the device knob (0-127).
+            
+        Returns:
+            None
+        
+        Raises:
+            ValueError: If the channel is not in the range 1-9, index is not in the range 1-8, or value is not in the range 0-127.
+        """
+        if channel not in range(1, 10):
+            raise ValueError(f"Invalid channel: {channel}. The channel must be in the range 1-9.")
+        
+        if index not in range(1, 9):
+            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
+        
+        if value not in range(128):
+            raise ValueError(f"Invalid value: {value}. The value must be in the range 0-127.")
+        
+        self._send_value(DEVICE_KNOB_SLOT + (channel - 1) * 8 + index - 1, value)
+
+
+# Knob binding curves: exponents applied to the normalized ring position (0-1).
+KNOB_CURVES = types.MappingProxyType({"linear": 1.0, "quadratic": 2.0, "cubic": 3.0, "sqrt": 0.5})
+_RING_STEPS = _readonly(np.arange(128, dtype=np.float64))
+
+
+class KnobBindings:
+    """
+    Two-way bindings between knob rings and values such as TouchDesigner parameters.
+
+    Bound values are pushed to their ring only when they move past the next 0-127 step
+    by more than the hysteresis, so float noise never makes a ring flicker. Turning a
+    bound knob writes the value back, and pushes to that ring are suppressed until the
+    knob has been left alone for hold_ms, so the write does not echo back. Range and
+    curve are folded into a 128-entry table per ring when binding, and tick() only
+    does work for bindings whose value changed.
+
+    Feed changes from a Parameter Execute DAT with push(), or let tick() poll sources
+    that cannot notify (poll=True).
+
+    Example:
+        apc.bindings.bind("track_knob 1", op('level1').par.opacity)
+        apc.bindings.bind("device_knob 1 3", op('blur1').par.size, high=64, curve="quadratic")
+
+        # Parameter Execute DAT watching those parameters
+        def onValueChange(par, prev):
+            apc.bindings.push(par)
+    """
+
+    __slots__ = ("knob", "input", "clock", "_getters", "_setters", "_polled", "_sources", "_low", "_high",
+                 "_hysteresis", "_hold", "_tables", "_touched_until", "_last", "_pending", "_listening")
+
+    def __init__(self, knob, input, clock=time.perf_counter):
+        """
+        Args:
+            knob (KnobController): Where ring values are sent.
+            input (InputController): Where knob moves are received.
+            clock (callable): Time source in seconds.
+        """
+        self.knob = knob
+        self.input = input
+        self.clock = clock
+        self._getters = {}
+        self._setters = {}
+        self._polled = []
+        self._sources = {}
+        self._low = np.zeros(KNOB_COUNT)
+        self._high = np.ones(KNOB_COUNT)
+        self._hysteresis = np.zeros(KNOB_COUNT)
+        self._hold = np.zeros(KNOB_COUNT)
+        self._tables = np.zeros((KNOB_COUNT, 128))
+        self._touched_until = np.zeros(KNOB_COUNT)
+        self._last = [None] * KNOB_COUNT
+        self._pending = {}
+        self._listening = False
+
+    @staticmethod
+    def _source_key(par):
+        # TouchDesigner may return a new Par object on every access, so key by owner and name.
+        owner = getattr(par, "owner", None)
+        return (owner.path, par.name) if owner is not None else id(par)
+
+    @staticmethod
+    def _slot(key):
+        kind, slots = _preset_slots(key)
+        if kind != "knob_value" or np.ndim(slots):
+            raise ValueError(f"Invalid knob: {key}. Must be one ring, e.g. \"track_knob 1\" or \"device_knob 2 3\".")
+        return int(slots)
+
+    def bind(self, key, source, setter=None, low=0.0, high=1.0, curve="linear", hysteresis=0.25, hold_ms=250.0,
+             poll=False):
+        """
+        Bind a knob ring to a value. Rebinding a ring replaces its binding.
+
+        Args:
+            key (str): The ring, "track_knob <index>" or "device_knob <channel> <index>".
+            source: A TouchDesigner Par (read with eval(), written through val), or a
+                callable returning the value.
+            setter (callable|None): Called with the new value when the knob is turned.
+                Defaults to writing the Par; for a callable source, knob moves are ignored.
+            low (float): The value at ring position 0.
+            high (float): The value at ring position 127.
+            curve (str|callable): A KNOB_CURVES name, or a function mapping 0-1 to 0-1
+                (increasing) applied to the ring position.
+            hysteresis (float): Extra ring steps a value must move past the rounding point
+                before the ring follows.
+            hold_ms (float): How long after a knob move pushes to its ring are suppressed.
+            poll (bool): Whether tick() reads the source every frame.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the key, curve or a range is invalid.
+        """
+        slot = self._slot(key)
+        if low == high:
+            raise ValueError(f"Invalid range: {low}-{high}. low and high must differ.")
+        if hysteresis < 0 or hold_ms < 0:
+            raise ValueError("Invalid hysteresis or hold_ms: must be 0 or greater.")
+        if callable(curve):
+            table = np.asarray(curve(_RING_STEPS / 127), dtype=np.float64)
+        elif curve in KNOB_CURVES:
+            table = (_RING_STEPS / 127) ** KNOB_CURVES[curve]
+        else:
+            raise ValueError(f"Invalid curve: {curve}. Must be one of {', '.join(KNOB_CURVES)} or a function.")
+        if table.shape != (128,) or np.any(np.diff(table) < 0):
+            raise ValueError("Invalid curve: it must map 0-1 to increasing values.")
+
+        if callable(source):
+            getter = source
+        else:
+            getter = source.eval
+            if setter is None:
+                def setter(value, par=source):
+                    par.val = value
+        self.unbind(key)
+        self._getters[slot] = getter
+        if setter is not None:
+            self._setters[slot] = setter
+        if poll:
+            self._polled.append(slot)
+        if not callable(source):
+            self._sources[self._source_key(source)] = slot
+        self._low[slot] = low
+        self._high[slot] = high
+        self._hysteresis[slot] = hysteresis
+        self._hold[slot] = hold_ms / 1000
+        self._tables[slot] = table
+        self._pending[slot] = getter()
+        if not self._listening:
+            self.input.on("track_knob", self._on_input)
+            self.input.on("device_knob", self._on_input)
+            self._listening = True
+
+    def unbind(self, key):
+        """
+        Remove the binding of a ring, if any.
+
+        Args:
+            key (str): The ring, as passed to bind().
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the key is invalid.
+        """
+        slot = self._slot(key)
+        if self._getters.pop(slot, None) is None:
+            return
+        self._setters.pop(slot, None)
+        if slot in self._polled:
+            self._polled.remove(slot)
+        for source, bound in list(self._sources.items()):
+            if bound == slot:
+                del self._sources[source]
+        self._pending.pop(slot, None)
+        self._last[slot] = None
+
+    def push(self, key_or_par, value=None):
+        """
+        Report that a bound value changed; the ring is updated at the next tick().
+
+        Args:
+            key_or_par (str|Par): The ring key, or the Par that was bound.
+            value (float|None): The new value. Defaults to reading the source.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If nothing is bound there.
+        """
+        if isinstance(key_or_par, str):
+            slot = self._slot(key_or_par)
+        else:
+            slot = self._sources.get(self._source_key(key_or_par), -1)
+        if slot not in self._getters:
+            raise ValueError(f"Nothing is bound to {key_or_par}.")
+        self._pending[slot] = self._getters[slot]() if value is None else value
+
+    def _on_input(self, control, value):
+        if control[0] == "track_knob":
+            slot = TRACK_KNOB_SLOT + control[1] - 1
+        else:
+            slot = DEVICE_KNOB_SLOT + (control[1] - 1) * 8 + control[2] - 1
+        setter = self._setters.get(slot)
+        if setter is None:
+            return
+        self._touched_until[slot] = self.clock() + self._hold[slot]
+        knob = self.knob
+        knob._value[slot] = value
+        knob._current[slot] = value / 127
+        result = self._low[slot] + (self._high[slot] - self._low[slot]) * self._tables[slot, value]
+        self._last[slot] = result
+        self._pending.pop(slot, None)
+        setter(float(result))
+
+    def tick(self):
+        """
+        Push the rings of bindings whose value changed. Called by apc.tick().
+
+        Returns:
+            int: The number of rings sent.
+        """
+        pending = self._pending
+        for slot in self._polled:
+            value = self._getters[slot]()
+            if value != self._last[slot]:
+                pending[slot] = value
+        if not pending:
+            return 0
+        self._pending = {}
+        now = self.clock()
+        knob = self.knob
+        sent = 0
+        for slot, value in pending.items():
+            if now < self._touched_until[slot]:
+                # The knob is being turned: retry after the hold.
+                self._pending.setdefault(slot, value)
+                continue
+            self._last[slot] = value
+            low = self._low[slot]
+            position = np.interp((value - low) / (self._high[slot] - low), self._tables[slot], _RING_STEPS)
+            current = knob._value[slot]
+            if current != _UNKNOWN and abs(position - current) <= 0.5 + self._hysteresis[slot]:
+                continue
+            step = int(position + 0.5)
+            if step != current:
+                knob._send_value(slot, step)
+                sent += 1
+        return sent
+
+
+# Raw MIDI input map (channels 1-16 as 0-15, note/CC numbers 0-127).
+# Each control is a tuple: its group name followed by its 1-based indices.
+TRACK_BUTTON_NOTES = types.MappingProxyType({
+    "record": 0x30, "solo": 0x31, "number": 0x32, "select": 0x33,
+    "clip_stop": 0x34, "ab_assign": 0x42
+})
+BUTTON_NOTES = types.MappingProxyType({
+    "master": 0x50, "stop_all_clips": 0x51, "pan": 0x57, "sends": 0x58, "user": 0x59,
+    "metronome": 0x5A, "play": 0x5B, "record": 0x5D, "up": 0x5E, "down": 0x5F,
+    "right": 0x60, "left": 0x61, "shift": 0x62, "tap_tempo": 0x63,
+    "nudge_minus": 0x64, "nudge_plus": 0x65, "session": 0x66, "bank": 0x67
+})
+INPUT_GROUPS = (
+    "clip", "scene", "track_button", "device_button", "button", "fader",
+    "crossfader", "cue_level", "tempo", "track_knob", "device_knob"
+)
+# Relative encoders send signed increments instead of absolute positions.
+RELATIVE_GROUPS = ("cue_level", "tempo")
+
+
+def _build_input_tables():
+    controls = []
+    note_table = [-1] * (16 * 128)
+    cc_table = [-1] * (16 * 128)
+
+    def add(table, channel, number, control):
+        table[(channel - 1) * 128 + number] = len(controls)
+        controls.append(control)
+
+    for row in range(1, 6):
+        for column in range(1, 9):
+            add(note_table, 1, (5 - row) * 8 + column - 1, ("clip", row, column))
+    for scene in range(1, 6):
+        add(note_table, 1, 0x52 + scene - 1, ("scene", scene))
+    for kind, note in TRACK_BUTTON_NOTES.items():
+        for track in range(1, 9):
+            add(note_table, track, note, ("track_button", kind, track))
+    for index in range(1, 9):
+        add(note_table, 1, 0x3A + index - 1, ("device_button", index))
+    for name, note in BUTTON_NOTES.items():
+        add(note_table, 1, note, ("button", name))
+
+    for track in range(1, 9):
+        add(cc_table, track, 0x07, ("fader", track))
+    add(cc_table, 1, 0x0E, ("fader", 9))
+    add(cc_table, 1, 0x0F, ("crossfader",))
+    add(cc_table, 1, 0x2F, ("cue_level",))
+    add(cc_table, 1, 0x0D, ("tempo",))
+    for index in range(1, 9):
+        add(cc_table, 1, 0x30 + index - 1, ("track_knob", index))
+    for channel in range(1, 10):
+        for index in range(1, 9):
+            add(cc_table, channel, 0x10 + index - 1, ("device_knob", channel, index))
+
+    return tuple(controls), tuple(note_table), tuple(cc_table)
+
+
+INPUT_CONTROLS, _NOTE_CONTROL, _CC_CONTROL = _build_input_tables()
+_CONTROL_ID = types.MappingProxyType({control: control_id for control_id, control in enumerate(INPUT_CONTROLS)})
+_RELATIVE_CONTROL = tuple(control[0] in RELATIVE_GROUPS for control in INPUT_CONTROLS)
+
+
+# Controls that send CCs, in INPUT_CONTROLS order; they follow every note control.
+_FIRST_CC_CONTROL = min(control_id for control_id in _CC_CONTROL if control_id >= 0)
+CAPTURE_CONTROLS = INPUT_CONTROLS[_FIRST_CC_CONTROL:]
+_CAPTURE_ROW = types.MappingProxyType({control: row for row, control in enumerate(CAPTURE_CONTROLS)})
+
+
+class InputCapture:
+    """
+    Keeps every incoming fader, knob and encoder value with its timestamp.
+
+    Each control in CAPTURE_CONTROLS has a fixed-size ring of (time, value) samples,
+    preallocated at construction, so memory stays bounded however long the show runs.
+    Every sample is stored twice, which lets the last N samples always be returned as a
+    contiguous NumPy view instead of a copy. A view stays valid until the control has
+    received capacity further samples. Relative encoders (cue level, tempo) store the
+    signed increment.
+
+    Example:
+        capture = apc40mk2.InputCapture(apc.input)
+        times, values = capture.since(("fader", 1), ms=200)
+        speed = capture.velocity(("crossfader",), ms=50)  # units per second
+    """
+
+    __slots__ = ("capacity", "clock", "_times", "_values", "_time_buffer", "_value_buffer", "_counts")
+
+    def __init__(self, input=None, capacity=2048, clock=time.perf_counter):
+        """
+        Args:
+            input (InputController|None): If given, capture everything it receives.
+            capacity (int): Samples kept per control.
+            clock (callable): Time source in seconds.
+
+        Raises:
+            ValueError: If capacity is less than 1.
+        """
+        if capacity < 1:
+            raise ValueError(f"Invalid capacity: {capacity}. Must be at least 1.")
+        self.capacity = capacity
+        self.clock = clock
+        rows = len(CAPTURE_CONTROLS)
+        self._times = np.zeros((rows, 2 * capacity))
+        self._values = np.zeros((rows, 2 * capacity), dtype=np.float32)
+        # Flat memoryviews of the same memory; item writes through them are cheaper than NumPy's.
+        self._time_buffer = memoryview(self._times.reshape(-1))
+        self._value_buffer = memoryview(self._values.reshape(-1))
+        self._counts = [0] * rows
+        if input is not None:
+            input.capture = self
+
+    def _append(self, row, value):
+        count = self._counts[row]
+        capacity = self.capacity
+        index = 2 * capacity * row + count % capacity
+        t = self.clock()
+        self._time_buffer[index] = self._time_buffer[index + capacity] = t
+        self._value_buffer[index] = self._value_buffer[index + capacity] = value
+        self._counts[row] = count + 1
+
+    def _row(self, control):
+        row = _CAPTURE_ROW.get(tuple(control))
+        if row is None:
+            raise ValueError(f"Unknown control: {control}. Must be one of CAPTURE_CONTROLS.")
+        return row
+
+    def count(self, control):
+        """
+        Args:
+            control (tuple): The control, e.g. ("fader", 1).
+
+        Returns:
+            int: The number of samples received since construction or clear().
+
+        Raises:
+            ValueError: If the control does not send CCs.
+        """
+        return self._counts[self._row(control)]
+
+    def last(self, control, n=None):
+        """
+        Return the most recent samples of a control, oldest first.
+
+        Args:
+            control (tuple): The control, e.g. ("fader", 1) or ("device_knob", 2, 5).
+            n (int|None): The number of samples, or None for every sample held.
+
+        Returns:
+            tuple: (times, values) as NumPy views; times are clock() seconds. Fewer than n
+                samples are returned if fewer are held.
+
+        Raises:
+            ValueError: If the control does not send CCs.
+        """
+        row = self._row(control)
+        count = self._counts[row]
+        held = min(count, self.capacity)
+        n = held if n is None else max(0, min(n, held))
+        end = count % self.capacity + self.capacity
+        return self._times[row, end - n:end], self._values[row, end - n:end]
+
+    def since(self, control, ms, now=None):
+        """
+        Return the samples of a control from the last ms milliseconds, oldest first.
+
+        Args:
+            control (tuple): The control.
+            ms (float): The window length in milliseconds.
+            now (float|None): The end of the window in clock() seconds. Defaults to clock().
+
+        Returns:
+            tuple: (times, values) as NumPy views.
+
+        Raises:
+            ValueError: If the control does not send CCs.
+        """
+        times, values = self.last(control)
+        if now is None:
+            now = self.clock()
+        start = np.searchsorted(times, now - ms / 1000)
+        return times[start:], values[start:]
+
+    def velocity(self, control, ms=50.0, now=None):
+        """
+        Estimate how fast a control is moving, as the least-squares slope of its
+        samples from the last ms milliseconds.
+
+        Args:
+            control (tuple): The control.
+            ms (float): The window length in milliseconds.
+            now (float|None): The end of the window in clock() seconds. Defaults to clock().
+
+        Returns:
+            float: Value units (0-127 scale) per second, or 0.0 with fewer than 2 samples.
+
+        Raises:
+            ValueError: If the control does not send CCs.
+        """
+        times, values = self.since(control, ms, now)
+        if len(times) < 2:
+            return 0.0
+        t = times - times.mean()
+        denominator = float(t @ t)
+        if denominator == 0.0:
+            return 0.0
+        return float(t @ (values - values.mean())) / denominator
+
+    def sample(self, control, t):
+        """
+        Linearly interpolate a control's value at one or more times, e.g. sub-frame times.
+
+        Args:
+            control (tuple): The control.
+            t (float|numpy.ndarray): Times in clock() seconds. Times outside the held samples
+                take the first or last value.
+
+        Returns:
+            float|numpy.ndarray: The interpolated values (0.0 if no sample is held).
+
+        Raises:
+            ValueError: If the control does not send CCs.
+        """
+        times, values = self.last(control)
+        if not len(times):
+            return np.zeros_like(t, dtype=float) if np.ndim(t) else 0.0
+        return np.interp(t, times, values)
+
+    @staticmethod
+    def derivative(times, values):
+        """
+        Rate of change between consecutive samples.
+
+        Args:
+            times (numpy.ndarray): Sample times in seconds.
+            values (numpy.ndarray): Sample values.
+
+        Returns:
+            numpy.ndarray: len(values) - 1 rates in units per second; 0 where two samples
+                share a timestamp.
+        """
+        dt = np.diff(times)
+        dv = np.diff(values).astype(float)
+        return np.divide(dv, dt, out=np.zeros_like(dv), where=dt > 0)
+
+    @staticmethod
+    def smooth(values, window):
+        """
+        Moving average over a window of samples.
+
+        Args:
+            values (numpy.ndarray): Sample values.
+            window (int): Samples per average.
+
+        Returns:
+            numpy.ndarray: len(values) - window + 1 averages (empty if there are fewer
+                samples than window).
+
+        Raises:
+            ValueError: If window is less than 1.
+        """
+        if window < 1:
+            raise ValueError(f"Invalid window: {window}. Must be at least 1.")
+        total = np.concatenate(([0.0], np.cumsum(values, dtype=float)))
+        return (total[window:] - total[:-window]) / window
+
+    def clear(self):
+        """
+        Forget every sample.
+
+        Returns:
+            None
+        """
+        self._counts = [0] * len(CAPTURE_CONTROLS)
+
+
+class InputController:
+    """
+    Decodes MIDI input from the APC40 MK2 and dispatches it to callbacks.
+
+    Incoming notes and CCs are decoded with two 16x128 lookup tables, so decoding
+    costs the same for every control. Controls are tuples such as ("clip", row, column),
+    ("scene", scene), ("track_button", "solo", track), ("device_button", index),
+    ("button", "play"), ("fader", track) (9 is the master fader), ("crossfader",),
+    ("cue_level",), ("tempo",), ("track_knob", index) and ("device_knob", channel, index).
+
+    Buttons are dispatched immediately. CCs are coalesced per control until tick(), so a
+    burst of fader or knob movement runs each callback at most once per frame. Relative
+    encoders (cue level, tempo) report the summed signed increment instead of the last value.
+    """
+
+    __slots__ = ("coalesce", "values", "capture", "_control_callbacks", "_group_callbacks", "_handlers", "_pending")
+
+    def __init__(self, coalesce=True):
+        """
+        Args:
+            coalesce (bool): Whether CCs are held until tick(). If False, every CC is dispatched
+                as it arrives.
+        """
+        self.coalesce = coalesce
+        self.values = [0] * len(INPUT_CONTROLS)
+        self._control_callbacks = {}
+        self._group_callbacks = {}
+        self._handlers = [()] * len(INPUT_CONTROLS)
+        self._pending = {}
+        self.capture = None
+
+    def _control_ids(self, target):
+        if isinstance(target, str):
+            if target not in INPUT_GROUPS:
+                raise ValueError(f"Unknown group: {target}. Valid groups are {', '.join(INPUT_GROUPS)}.")
+            return [i for i, control in enumerate(INPUT_CONTROLS) if control[0] == target]
+        control_id = _CONTROL_ID.get(tuple(target))
+        if control_id is None:
+            raise ValueError(f"Unknown control: {target}.")
+        return [control_id]
+
+    def _rebuild(self, control_ids):
+        for control_id in control_ids:
+            control = INPUT_CONTROLS[control_id]
+            self._handlers[control_id] = tuple(
+                self._control_callbacks.get(control_id, [])
+                + self._group_callbacks.get(control[0], [])
+            )
+
+    def on(self, target, callback):
+        """
+        Register a callback for a control or a whole group.
+
+        Args:
+            target (str|tuple): A group name (e.g. "clip") or a control (e.g. ("clip", 1, 3)).
+            callback (callable): Called as callback(control, value). value is the velocity
+                (0 on release) for buttons, 0-127 for absolute CCs, and a signed increment
+                for relative encoders.
+
+        Returns:
+            callable: The callback, unchanged.
+
+        Raises:
+            ValueError: If the group or control does not exist.
+        """
+        control_ids = self._control_ids(target)
+        if isinstance(target, str):
+            self._group_callbacks.setdefault(target, []).append(callback)
+        else:
+            self._control_callbacks.setdefault(control_ids[0], []).append(callback)
+        self._rebuild(control_ids)
+        return callback
+
+    def off(self, target, callback):
+        """
+        Remove a callback registered with on().
+
+        Args:
+            target (str|tuple): The group or control it was registered for.
+            callback (callable): The callback to remove.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the callback is not registered for the target.
+        """
+        control_ids = self._control_ids(target)
+        if isinstance(target, str):
+            callbacks = self._group_callbacks.get(target, [])
+        else:
+            callbacks = self._control_callbacks.get(control_ids[0], [])
+        if callback not in callbacks:
+            raise ValueError(f"Callback is not registered for {target}.")
+        callbacks.remove(callback)
+        self._rebuild(control_ids)
+
+    def receive(self, status, data1, data2):
+        """
+        Decode one raw MIDI message.
+
+        Args:
+            status (int): The status byte (e.g. 0x90 for Note On, channel 1).
+            data1 (int): The note or CC number (0-127).
+            data2 (int): The velocity or CC value (0-127).
+
+        Returns:
+            tuple|None: The decoded control, or None if the message is not mapped.
+        """
+        kind = status & 0xF0
+        if kind == 0x90 or kind == 0x80:
+            control_id = _NOTE_CONTROL[((status & 0x0F) << 7) | data1]
+            if control_id < 0:
+                return None
+            value = data2 if kind == 0x90 else 0
+            self.values[control_id] = value
+            control = INPUT_CONTROLS[control_id]
+            for callback in self._handlers[control_id]:
+                callback(control, value)
+            return control
+        if kind == 0xB0:
+            control_id = _CC_CONTROL[((status & 0x0F) << 7) | data1]
+            if control_id < 0:
+                return None
+            self.values[control_id] = data2
+            value = data2
+            if _RELATIVE_CONTROL[control_id]:
+                value = data2 - 128 if data2 & 0x40 else data2
+            if self.capture is not None:
+                self.capture._append(control_id - _FIRST_CC_CONTROL, value)
+            handlers = self._handlers[control_id]
+            if handlers:
+                if not self.coalesce:
+                    control = INPUT_CONTROLS[control_id]
+                    for callback in handlers:
+                        callback(control, value)
+                elif _RELATIVE_CONTROL[control_id]:
+                    self._pending[control_id] = self._pending.get(control_id, 0) + value
+                else:
+                    self._pending[control_id] = value
+            return INPUT_CONTROLS[control_id]
+        return None
+
+    def receive_bytes(self, data):
+        """
+        Decode a raw MIDI message, e.g. the bytes argument of a MIDI In DAT callback.
+
+        Example:
+            def onReceiveMIDI(dat, rowIndex, message, channel, index, value, input, bytes):
+                apc.input.receive_bytes(bytes)
+
+        Args:
+            data (bytes|list): The message bytes. Only 3-byte channel messages are decoded.
+
+        Returns:
+            tuple|None: The decoded control, or None if the message is not mapped.
+        """
+        if len(data) != 3:
+            return None
+        return self.receive(data[0], data[1], data[2])
+
+    def tick(self):
+        """
+        Dispatch CCs coalesced since the last tick.
+
+        Returns:
+            int: The number of controls dispatched.
+        """
+        if not self._pending:
+            return 0
+        pending = self._pending
+        self._pending = {}
+        for control_id, value in pending.items():
+            control = INPUT_CONTROLS[control_id]
+            for callback in self._handlers[control_id]:
+                callback(control, value)
+        return len(pending)
+
+
+class DeviceModeController:
+    """Handles device mode settings for APC40MK2."""
+
+    __slots__ = ("midiout", "output")
+    
+    def __init__(self, midiout, output=None):
+        self.midiout = midiout
+        self.output = output if output is not None else _as_output(midiout)
+    
+    def set_device_mode(self, mode):
+        """
+        Set the device mode.
+
+        Args:
+            mode (int): The device mode.
+                - 0: Generic Mode
+                - 1: Ableton Live Mode
+                - 2: Alternate Ableton Live Mode
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the mode is not 0, 1, or 2.
+        """
+        if mode not in [0, 1, 2]:
+            raise ValueError(f"Invalid mode: {mode}. Valid modes are 0 (Generic Mode), 1 (Ableton Live Mode), and 2 (Alternate Ableton Live Mode).")
+        
+        self.output.sysex(0x47, 0x7F, 0x29, 0x60, 0x00, 0x04, 0x40 + mode, 0x01, 0x00, 0x00)
+
+# Upper bounds (microseconds) of the latency histogram buckets; the last bucket is unbounded.
+LATENCY_BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+MESSAGE_METHODS = types.MappingProxyType({"note_on": 3, "control_change": 3, "sysex": None})
+
+
+class Instrumentation:
+    """
+    Call counters and latency histograms for an APC40MK2 and its sub-controllers.
+
+    Created by APC40MK2.enable_instrumentation(). While enabled, every public method of
+    the controllers runs through a timing wrapper. Messages reaching the MIDI output are
+    counted per type with their byte size, and time spent resolving colors is measured
+    separately from time spent sending. When disabled, the original classes are restored,
+    so there is no overhead.
+    """
+
+    def __init__(self):
+        self._records = {}
+
+    def _record(self, name):
+        # [count, bytes, total_us, bucket counts...]
+        record = self._records.get(name)
+        if record is None:
+            record = self._records[name] = [0, 0, 0.0] + [0] * (len(LATENCY_BUCKETS_US) + 1)
+        return record
+
+    def _wrap(self, func, name, size=0):
+        record = self._record(name)
+        clock = time.perf_counter
+        buckets = LATENCY_BUCKETS_US
+
+        if size is None:
+            def wrapper(self, *args):
+                start = clock()
+                try:
+                    return func(self, *args)
+                finally:
+                    elapsed = (clock() - start) * 1e6
+                    record[0] += 1
+                    record[1] += len(args) + 2
+                    record[2] += elapsed
+                    record[3 + bisect.bisect_left(buckets, elapsed)] += 1
+        else:
+            def wrapper(self, *args, **kwargs):
+                start = clock()
+                try:
+                    return func(self, *args, **kwargs)
+                finally:
+                    elapsed = (clock() - start) * 1e6
+                    record[0] += 1
+                    record[1] += size
+                    record[2] += elapsed
+                    record[3 + bisect.bisect_left(buckets, elapsed)] += 1
+
+        return functools.wraps(func)(wrapper)
+
+    def _instrumented_class(self, cls, prefix, terminal=False):
+        namespace = {"__slots__": ()}
+        for name in dir(cls):
+            attr = getattr(cls, name)
+            if terminal and name in MESSAGE_METHODS:
+                namespace[name] = self._wrap(attr, "message." + name, MESSAGE_METHODS[name])
+            elif name == "_resolve_color":
+                namespace[name] = self._wrap(lambda _, color, resolve=attr: resolve(color), "color_resolution")
+            elif not name.startswith("_") and isinstance(attr, types.FunctionType):
+                namespace[name] = self._wrap(attr, prefix + name)
+        return type(cls.__name__, (cls,), namespace)
+
+    def reset(self):
+        """
+        Zero all counters and histograms.
+
+        Returns:
+            None
+        """
+        for record in self._records.values():
+            record[:] = [0, 0, 0.0] + [0] * (len(LATENCY_BUCKETS_US) + 1)
+
+    def snapshot(self):
+        """
+        Return all counters as a dict.
+
+        Returns:
+            dict: With keys
+                - "methods": {name: {"calls", "total_us", "mean_us", "histogram"}} per public method.
+                - "messages": {"note_on"|"control_change"|"sysex": {"count", "bytes", "total_us", "histogram"}}.
+                - "color_resolution_us": Total time spent resolving colors.
+                - "send_us": Total time spent in the MIDI output.
+                - "histogram_buckets_us": Upper bounds of the histogram buckets (the last bucket is unbounded).
+        """
+        methods = {}
+        messages = {}
+        for name, record in sorted(self._records.items()):
+            count, size, total = record[:3]
+            entry = {"total_us": total, "mean_us": total / count if count else 0.0, "histogram": record[3:]}
+            if name.startswith("message."):
+                messages[name[8:]] = dict(count=count, bytes=size, **entry)
+            elif name != "color_resolution":
+                methods[name] = dict(calls=count, **entry)
+        return {
+            "methods": methods,
+            "messages": messages,
+            "color_resolution_us": self._records.get("color_resolution", [0, 0, 0.0])[2],
+            "send_us": sum(entry["total_us"] for entry in messages.values()),
+            "histogram_buckets_us": list(LATENCY_BUCKETS_US),
+        }
+
+    def table_rows(self):
+        """
+        Return all counters as rows for a Table DAT, header row first.
+
+        Example:
+            table = op('apc_stats')
+            table.clear()
+            table.appendRows(apc.instrumentation.table_rows())
+
+        Returns:
+            list: Rows of [name, count, bytes, total_us, mean_us, <bucket counts>...].
+        """
+        header = ["name", "count", "bytes", "total_us", "mean_us"]
+        header += [f"<={bound}us" for bound in LATENCY_BUCKETS_US] + [f">{LATENCY_BUCKETS_US[-1]}us"]
+        rows = [header]
+        for name, record in sorted(self._records.items()):
+            count, size, total = record[:3]
+            rows.append([name, count, size, round(total, 3), round(total / count, 3) if count else 0.0] + record[3:])
+        return rows
+
+
+# State of the surface after power-on or a device mode change: LEDs off, rings off at 0.
+POWER_ON_LED_COLOR = 0
+POWER_ON_LED_TYPE = 0
+POWER_ON_KNOB_TYPE = 0
+POWER_ON_KNOB_VALUE = 0
+_SNAPSHOT_MAGIC = b"APCSNAP1"
+
+
+class SurfaceState:
+    """
+    A snapshot of every LED, knob ring type and knob ring value.
+
+    Entries that were never set hold 255. Serialized, a snapshot is 388 bytes.
+    """
+
+    def __init__(self, led_color, led_type, knob_type, knob_value):
+        """
+        Args:
+            led_color (numpy.ndarray): Color (velocity) per LED slot, LED_COUNT entries.
+            led_type (numpy.ndarray): LED type per LED slot, LED_COUNT entries.
+            knob_type (numpy.ndarray): Ring type per knob slot, KNOB_COUNT entries.
+            knob_value (numpy.ndarray): Ring value per knob slot, KNOB_COUNT entries.
+        """
+        self.led_color = np.array(led_color, dtype=np.uint8)
+        self.led_type = np.array(led_type, dtype=np.uint8)
+        self.knob_type = np.array(knob_type, dtype=np.uint8)
+        self.knob_value = np.array(knob_value, dtype=np.uint8)
+        if self.led_color.shape != (LED_COUNT,) or self.led_type.shape != (LED_COUNT,):
+            raise ValueError(f"Invalid LED state: expected {LED_COUNT} entries.")
+        if self.knob_type.shape != (KNOB_COUNT,) or self.knob_value.shape != (KNOB_COUNT,):
+            raise ValueError(f"Invalid knob state: expected {KNOB_COUNT} entries.")
+
+    def __eq__(self, other):
+        if not isinstance(other, SurfaceState):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    def to_bytes(self):
+        """
+        Returns:
+            bytes: The compact binary form.
+        """
+        return b"".join((_SNAPSHOT_MAGIC, self.led_color.tobytes(), self.led_type.tobytes(),
+                         self.knob_type.tobytes(), self.knob_value.tobytes()))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Args:
+            data (bytes): Output of to_bytes().
+
+        Returns:
+            SurfaceState: The decoded snapshot.
+
+        Raises:
+            ValueError: If data is not a serialized snapshot.
+        """
+        size = len(_SNAPSHOT_MAGIC) + 2 * LED_COUNT + 2 * KNOB_COUNT
+        if len(data) != size or not data.startswith(_SNAPSHOT_MAGIC):
+            raise ValueError("Not a serialized SurfaceState.")
+        array = np.frombuffer(data, dtype=np.uint8, offset=len(_SNAPSHOT_MAGIC))
+        return cls(*np.split(array, np.cumsum((LED_COUNT, LED_COUNT, KNOB_COUNT))))
+
+    def save(self, path):
+        """
+        Write the snapshot to a file.
+
+        Args:
+            path (str): The file to write.
+
+        Returns:
+            None
+        """
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a snapshot written by save().
+
+        Args:
+            path (str): The file to read.
+
+        Returns:
+            SurfaceState: The snapshot.
+        """
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+# Fixed layout of the shared-memory block written by SharedSurface. The sequence counter
+# is odd while a write is in progress; input_value holds the latest raw value (0-127) of
+# each control, in INPUT_CONTROLS order.
+SHARED_LAYOUT = np.dtype([
+    ("magic", "S8"),
+    ("sequence", "<u8"),
+    ("time", "<f8"),
+    ("led_color", "u1", (LED_COUNT,)),
+    ("led_type", "u1", (LED_COUNT,)),
+    ("knob_type", "u1", (KNOB_COUNT,)),
+    ("knob_value", "u1", (KNOB_COUNT,)),
+    ("input_value", "u1", (len(INPUT_CONTROLS),)),
+])
+_SHARED_MAGIC = b"APCSHM01"
+# Names of the blocks created by SharedSurface in this process.
+_SHARED_CREATED = set()
+_SHARED_HEADER = SHARED_LAYOUT.fields["led_color"][1]
+# Byte ranges of the state fields, relative to the end of the header.
+_SHARED_FIELDS = types.MappingProxyType({
+    name: slice(SHARED_LAYOUT.fields[name][1] - _SHARED_HEADER,
+                SHARED_LAYOUT.fields[name][1] - _SHARED_HEADER + SHARED_LAYOUT.fields[name][0].itemsize)
+    for name in ("led_color", "led_type", "knob_type", "knob_value", "input_value")
+})
+
+
+class SharedSurface:
+    """
+    Publishes the surface state of an APC40MK2 into a multiprocessing.shared_memory block.
+
+    The block has the fixed SHARED_LAYOUT: LED colors and types, knob ring types and
+    values, and the latest value of every input control. Writes are guarded by a sequence
+    counter (a seqlock), so readers never block the writer and detect torn reads
+    themselves; publish() only writes when something changed. Read it from other
+    processes with SharedSurfaceReader.
+
+    Usually created with apc.share(), published by apc.tick() and stopped with apc.unshare().
+
+    Example:
+        shared = apc.share("apc40")
+        # ... in another process
+        reader = apc40mk2.SharedSurfaceReader("apc40")
+    """
+
+    __slots__ = ("apc", "clock", "_shm", "_record", "_staged", "_payload")
+
+    def __init__(self, apc, name=None, clock=time.time):
+        """
+        Args:
+            apc (APC40MK2): The controller whose state is published.
+            name (str|None): The shared memory name. Defaults to a generated name, see name.
+            clock (callable): Time source for the publish time, in seconds.
+
+        Raises:
+            FileExistsError: If a block with that name already exists.
+        """
+        from multiprocessing import shared_memory
+
+        self.apc = apc
+        self.clock = clock
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=SHARED_LAYOUT.itemsize)
+        _SHARED_CREATED.add(self._shm.name)
+        self._record = np.ndarray((), SHARED_LAYOUT, buffer=self._shm.buf)
+        # The state is assembled in a local buffer and copied in with one memcpy.
+        self._staged = bytearray(SHARED_LAYOUT.itemsize - _SHARED_HEADER)
+        self._payload = self._shm.buf[_SHARED_HEADER:SHARED_LAYOUT.itemsize]
+        self._record["magic"] = _SHARED_MAGIC
+        self.publish(force=True)
+
+    @property
+    def name(self):
+        """str: The shared memory name to pass to SharedSurfaceReader."""
+        return self._shm.name
+
+    @property
+    def sequence(self):
+        """int: The sequence counter, incremented by 2 per publish."""
+        return int(self._record["sequence"])
+
+    @property
+    def closed(self):
+        """bool: Whether close() was called."""
+        return self._record is None
+
+    def publish(self, force=False):
+        """
+        Write the current state into the block if it changed. Does nothing once closed.
+
+        Args:
+            force (bool): Write even if nothing changed.
+
+        Returns:
+            bool: Whether the block was written.
+        """
+        if self._record is None:
+            return False
+        apc = self.apc
+        staged = self._staged
+        fields = _SHARED_FIELDS
+        staged[fields["led_color"]] = apc.led._color
+        staged[fields["led_type"]] = apc.led._led_type
+        staged[fields["knob_type"]] = apc.knob._type
+        staged[fields["knob_value"]] = apc.knob._value
+        staged[fields["input_value"]] = bytes(apc.input.values)
+        payload = self._payload
+        if not force and payload.tobytes() == staged:
+            return False
+        record = self._record
+        sequence = int(record["sequence"])
+        record["sequence"] = sequence + 1
+        payload[:] = staged
+        record["time"] = self.clock()
+        record["sequence"] = sequence + 2
+        return True
+
+    def close(self, unlink=True):
+        """
+        Stop publishing. Closing again does nothing.
+
+        Args:
+            unlink (bool): Also remove the block. Readers that are attached keep their mapping.
+
+        Returns:
+            None
+        """
+        if self._record is None:
+            return
+        self._record = None
+        self._payload.release()
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+            _SHARED_CREATED.discard(self._shm.name)
+
+
+class SharedSurfaceReader:
+    """
+    Maps a block published by SharedSurface into NumPy arrays, without copying.
+
+    led_color, led_type, knob_type, knob_value and input_value are live views of the
+    shared memory. They can change while being read; for a consistent copy, use read(),
+    which retries while the writer is mid-update. Readers never write to the block, so
+    any number of them cost the publisher nothing.
+
+    Example:
+        reader = apc40mk2.SharedSurfaceReader("apc40")
+        if reader.changed:
+            state = reader.read()
+            grid = state["led_color"][apc40mk2.GRID_SLOTS]
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): The name of the block (SharedSurface.name).
+
+        Raises:
+            FileNotFoundError: If no block with that name exists.
+            ValueError: If the block was not written by SharedSurface.
+        """
+        from multiprocessing import shared_memory
+
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13, attaching registers the block for removal when this process
+            # exits. Undo that, unless the block is published from this process.
+            from multiprocessing import resource_tracker
+
+            self._shm = shared_memory.SharedMemory(name=name)
+            if self._shm.name not in _SHARED_CREATED:
+                resource_tracker.unregister(self._shm._name, "shared_memory")
+        if self._shm.size < SHARED_LAYOUT.itemsize:
+            self._shm.close()
+            raise ValueError(f"Invalid shared surface: {name} is too small.")
+        self._record = np.ndarray((), SHARED_LAYOUT, buffer=self._shm.buf)
+        if self._record["magic"] != _SHARED_MAGIC:
+            self._record = None
+            self._shm.close()
+            raise ValueError(f"Invalid shared surface: {name} was not written by SharedSurface.")
+        self.led_color = self._record["led_color"]
+        self.led_type = self._record["led_type"]
+        self.knob_type = self._record["knob_type"]
+        self.knob_value = self._record["knob_value"]
+        self.input_value = self._record["input_value"]
+        self._last_sequence = None
+
+    @property
+    def sequence(self):
+        """int: The writer's sequence counter; odd while a write is in progress."""
+        return int(self._record["sequence"])
+
+    @property
+    def changed(self):
+        """bool: Whether the block was written since the last read()."""
+        return self.sequence != self._last_sequence
+
+    def read(self, out=None, retries=1000):
+        """
+        Copy a consistent state out of the block.
+
+        Args:
+            out (numpy.ndarray|None): A zero-dimensional SHARED_LAYOUT array to copy into,
+                e.g. from a previous call.
+            retries (int): Attempts, yielding the CPU between them, before giving up on a
+                writer that keeps writing.
+
+        Returns:
+            numpy.ndarray: The copy, a zero-dimensional SHARED_LAYOUT array; fields are
+                accessed as state["led_color"] etc.
+
+        Raises:
+            TimeoutError: If no consistent copy was made within retries attempts.
+        """
+        if out is None:
+            out = np.empty((), SHARED_LAYOUT)
+        record = self._record
+        for _ in range(retries):
+            before = int(record["sequence"])
+            if not before & 1:
+                out[()] = record
+                if int(record["sequence"]) == before:
+                    self._last_sequence = before
+                    return out
+            # Let a preempted writer finish.
+            time.sleep(0)
+        raise TimeoutError("The shared surface was being written during every read attempt.")
+
+    def state(self):
+        """
+        Returns:
+            SurfaceState: A consistent copy of the LED and knob state.
+        """
+        copy = self.read()
+        return SurfaceState(copy["led_color"], copy["led_type"], copy["knob_type"], copy["knob_value"])
+
+    def close(self):
+        """
+        Detach from the block. Drop any references to the views first; they must not be
+        used afterwards.
+
+        Returns:
+            None
+        """
+        self._record = self.led_color = self.led_type = None
+        self.knob_type = self.knob_value = self.input_value = None
+        self._shm.close()
+
+
+# Preset groups: key -> (kind, first slot, index shape). LED groups use LED slots, knob
+# groups knob slots.
+PRESET_GROUPS = types.MappingProxyType(dict(
+    [("clip", ("color", CLIP_LAUNCH_SLOT, (5, 8))), ("scene", ("color", SCENE_LAUNCH_SLOT, (5,)))]
+    + [(kind if kind == "device_ctrl" else "track_" + kind,
+        ("tristate" if kind in _TRISTATE_ROWS else "on_off", base, (8,)))
+       for kind, base in LED_ROW_SLOTS.items()]
+    + [(name, ("on_off", slot, ())) for name, slot in BUTTON_SLOTS.items()]
+    + [("track_knob", ("knob_value", TRACK_KNOB_SLOT, (8,))),
+       ("track_knob_type", ("knob_type", TRACK_KNOB_SLOT, (8,))),
+       ("device_knob", ("knob_value", DEVICE_KNOB_SLOT, (9, 8))),
+       ("device_knob_type", ("knob_type", DEVICE_KNOB_SLOT, (9, 8)))]
+))
+_PRESET_CACHE_MAGIC = b"APCPRST1"
+# Crossfades blend the clip and scene pads (slots below this), the only LEDs whose
+# values are palette colors rather than on/off states.
+_FADE_SLOTS = SCENE_LAUNCH_SLOT + 5
+
+
+_PRESET_BOOLEANS = types.MappingProxyType({"true": True, "on": True, "false": False, "off": False})
+
+
+def _parse_preset_value(text):
+    # Table cells are strings: booleans and numbers are decoded, anything else is a color name.
+    word = text.strip().lower()
+    if word in _PRESET_BOOLEANS:
+        return _PRESET_BOOLEANS[word]
+    try:
+        return int(word, 0) if word[1:2] in ("x", "b", "o") else int(word, 10)
+    except ValueError:
+        return text
+
+
+def _preset_slots(key):
+    group, *indices = str(key).split()
+    if group not in PRESET_GROUPS:
+        raise ValueError(f"Invalid preset key: {key}. Must start with one of {', '.join(PRESET_GROUPS)}.")
+    kind, base, shape = PRESET_GROUPS[group]
+    if len(indices) > len(shape):
+        raise ValueError(f"Invalid preset key: {key}. {group} takes at most {len(shape)} indices.")
+    slots = base + np.arange(int(np.prod(shape)), dtype=np.intp).reshape(shape)
+    for index, size in zip(indices, shape):
+        if not index.isdigit() or int(index) not in range(1, size + 1):
+            raise ValueError(f"Invalid preset key: {key}. Index {index} must be 1-{size}.")
+        slots = slots[int(index) - 1]
+    return kind, slots
+
+
+def _compile_entry(key, kind, slots, value, arrays):
+    led_color, led_type, knob_type, knob_value = arrays
+    if slots.ndim and isinstance(value, (list, tuple, np.ndarray)) and len(value) == len(slots):
+        for sub_slots, sub_value in zip(slots, value):
+            _compile_entry(key, kind, sub_slots, sub_value, arrays)
+        return
+    if kind in ("on_off", "tristate") and slots.ndim == 1 and isinstance(value, (int, np.integer)) \
+            and not isinstance(value, bool):
+        if value not in range(256):
+            raise ValueError(f"Invalid bitmask for {key}: {value}. Must be in the range 0-255.")
+        led_color[slots] = (_MASK_STATE if kind == "tristate" else _MASK_ON_OFF)[value]
+        led_type[slots] = 0
+        return
+    if kind == "color":
+        color, type_ = value if isinstance(value, (list, tuple)) and len(value) == 2 else (value, 0)
+        if type_ not in range(16):
+            raise ValueError(f"Invalid LED type for {key}: {type_}. Must be 0-15.")
+        led_color[slots] = _resolve_color(color)
+        led_type[slots] = type_
+    elif kind == "on_off":
+        led_color[slots] = 127 if value else 0
+        led_type[slots] = 0
+    elif kind == "tristate":
+        if value not in range(3):
+            raise ValueError(f"Invalid state for {key}: {value}. Must be 0-2.")
+        led_color[slots] = value
+        led_type[slots] = 0
+    else:
+        if value not in range(128):
+            raise ValueError(f"Invalid value for {key}: {value}. Must be 0-127.")
+        (knob_type if kind == "knob_type" else knob_value)[slots] = value
+
+
+def compile_preset(preset):
+    """
+    Compile a preset declaration into a SurfaceState.
+
+    Keys name a group from PRESET_GROUPS, optionally followed by 1-based indices
+    ("clip 2 3", "scene 1", "track_solo 4", "device_knob 3 1"). A key with fewer
+    indices than its group takes a nested list over the rest, or one value for all of
+    them; track rows also take a bitmask (bit 0 = track 1), like set_track_row().
+
+    - Colors: a name, hex code, palette index or Color, or [color, led_type].
+    - Track rows and buttons: bools, or states 0-2 for track_clip_stop/track_ab_assign.
+    - Knob rings: values and types 0-127.
+
+    Example:
+        apc40mk2.compile_preset({
+            "clip": [["red"] * 8, ["blue"] * 8, "black", "black", ["white", 2]],
+            "scene 1": ["green", 9],
+            "track_solo": 0b00001111,
+            "play": True,
+            "track_knob": [64] * 8,
+            "device_knob_type 1": 2,
+        })
+
+    Args:
+        preset (dict): Mapping of keys to values.
+
+    Returns:
+        SurfaceState: The state the preset describes; entries it leaves unset hold 255.
+
+    Raises:
+        ValueError: If a key or value is invalid.
+    """
+    arrays = (np.full(LED_COUNT, _UNKNOWN, dtype=np.uint8), np.full(LED_COUNT, _UNKNOWN, dtype=np.uint8),
+              np.full(KNOB_COUNT, _UNKNOWN, dtype=np.uint8), np.full(KNOB_COUNT, _UNKNOWN, dtype=np.uint8))
+    for key, value in preset.items():
+        kind, slots = _preset_slots(key)
+        _compile_entry(key, kind, slots, value, arrays)
+    return SurfaceState(*arrays)
+
+
+class PresetBank:
+    """
+    Named surface presets, compiled once and switched by sending only the difference.
+
+    Available as apc.presets. Presets are declared as dicts (see compile_preset), in a
+    JSON file mapping names to such dicts, or in a Table DAT with the columns
+    name, key, value and an optional led_type.
+
+    Example:
+        apc.presets.load(op('presets'), cache="presets.apcpreset")
+        apc.presets.apply("verse")
+        apc.presets.crossfade("chorus", frames=30)  # advanced by apc.tick()
+    """
+
+    __slots__ = ("apc", "states", "_fade")
+
+    def __init__(self, apc):
+        """
+        Args:
+            apc (APC40MK2): The surface the presets are applied to.
+        """
+        self.apc = apc
+        self.states = {}
+        self._fade = None
+
+    def add(self, name, preset):
+        """
+        Compile and add a preset.
+
+        Args:
+            name (str): The preset name. An existing preset of that name is replaced.
+            preset (dict|SurfaceState): The declaration, or an already compiled state
+                (e.g. apc.snapshot()).
+
+        Returns:
+            SurfaceState: The compiled preset.
+
+        Raises:
+            ValueError: If the declaration is invalid.
+        """
+        state = preset if isinstance(preset, SurfaceState) else compile_preset(preset)
+        self.states[name] = state
+        return state
+
+    @staticmethod
+    def _read_source(source):
+        if isinstance(source, dict):
+            return source
+        if isinstance(source, str):
+            with open(source) as f:
+                return json.load(f)
+        presets = {}
+        for row in source.rows():
+            cells = [cell.val if hasattr(cell, "val") else str(cell) for cell in row]
+            if len(cells) < 3 or not cells[0] or cells[:3] == ["name", "key", "value"]:
+                continue
+            value = _parse_preset_value(cells[2])
+            if len(cells) > 3 and cells[3] != "":
+                value = [value, _parse_preset_value(cells[3])]
+            presets.setdefault(cells[0], {})[cells[1]] = value
+        return presets
+
+    def load(self, source, cache=None):
+        """
+        Compile and add a bank of presets.
+
+        Args:
+            source (dict|str|Table DAT): A dict of name -> declaration, the path of a
+                JSON file holding one, or a Table DAT with rows of name, key, value
+                [, led_type] (a header row of name, key, value is skipped).
+            cache (str|None): A file for the compiled bank. If it was compiled from the
+                same declarations, it is read instead of compiling; otherwise, or if it
+                is unreadable, it is rewritten.
+
+        Returns:
+            list: The names of the loaded presets.
+
+        Raises:
+            ValueError: If a declaration is invalid.
+        """
+        presets = self._read_source(source)
+        digest = hashlib.sha1(
+            _PRESET_CACHE_MAGIC + json.dumps(presets, sort_keys=True, default=repr).encode()
+        ).digest()
+        states = None
+        if cache is not None and os.path.exists(cache):
+            with open(cache, "rb") as f:
+                data = f.read()
+            if data[:len(_PRESET_CACHE_MAGIC) + 20] == _PRESET_CACHE_MAGIC + digest:
+                try:
+                    states = self._decode_cache(data[len(_PRESET_CACHE_MAGIC) + 20:])
+                except (struct.error, UnicodeDecodeError, ValueError):
+                    # A truncated or corrupt cache is recompiled and rewritten.
+                    states = None
+        if states is None:
+            states = {name: compile_preset(preset) for name, preset in presets.items()}
+            if cache is not None:
+                chunks = [_PRESET_CACHE_MAGIC, digest]
+                for name, state in states.items():
+                    encoded = name.encode()
+                    chunks += [struct.pack("<H", len(encoded)), encoded, state.to_bytes()]
+                with open(cache, "wb") as f:
+                    f.write(b"".join(chunks))
+        self.states.update(states)
+        return list(states)
+
+    @staticmethod
+    def _decode_cache(data):
+        size = len(_SNAPSHOT_MAGIC) + 2 * LED_COUNT + 2 * KNOB_COUNT
+        states = {}
+        offset = 0
+        while offset < len(data):
+            (length,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            name = data[offset:offset + length].decode()
+            offset += length
+            states[name] = SurfaceState.from_bytes(data[offset:offset + size])
+            offset += size
+        return states
+
+    def _state(self, name):
+        state = self.states.get(name)
+        if state is None:
+            raise ValueError(f"Unknown preset: {name}.")
+        return state
+
+    def _apply(self, state):
+        led = self.apc.led
+        known = state.led_color != _UNKNOWN
+        led._color_view[known] = state.led_color[known]
+        led._led_type_view[known] = state.led_type[known]
+        sent = 0 if led._batch_depth else led.flush()
+
+        knob = self.apc.knob
+        for values, current, send in ((state.knob_type, knob._type_view, knob._send_type),
+                                      (state.knob_value, knob._value_view, knob._send_value)):
+            for slot in np.flatnonzero((values != _UNKNOWN) & (values != current)).tolist():
+                send(slot, int(values[slot]))
+                sent += 1
+        return sent
 
-    def __init__(self, midiout):
-        self.midiout = midiout
-        self.color_map = {
-            "black": 0, "dark gray": 1, "gray": 2, "white": 3, "red": 5, 
-            "orange": 9, "yellow": 13, "green": 21, "cyan": 37, "blue": 45, 
-            "purple": 49, "magenta": 53, "pink": 57
-        }
-        self.color_codes = [
-            (0, "#000000"), (1, "#1E1E1E"), (2, "#7F7F7F"), (3, "#FFFFFF"),
-            (4, "#FF4C4C"), (5, "#FF0000"), (6, "#590000"), (7, "#190000"),
-            (8, "#FFBD6C"), (9, "#FF5400"), (10, "#591D00"), (11, "#271B00"),
-            (12, "#FFFF4C"), (13, "#FFFF00"), (14, "#595900"), (15, "#191900"),
-            (16, "#88FF4C"), (17, "#54FF00"), (18, "#1D5900"), (19, "#142B00"),
-            (20, "#4CFF4C"), (21, "#00FF00"), (22, "#005900"), (23, "#001900"),
-            (24, "#4CFF5E"), (25, "#00FF19"), (26, "#00590D"), (27, "#001902"),
-            (28, "#4CFF88"), (29, "#00FF55"), (30, "#00591D"), (31, "#001F12"),
-            (32, "#4CFFB7"), (33, "#00FF99"), (34, "#005935"), (35, "#001912"),
-            (36, "#4CC3FF"), (37, "#00A9FF"), (38, "#004152"), (39, "#001019"),
-            (40, "#4C88FF"), (41, "#0055FF"), (42, "#001D59"), (43, "#000819"),
-            (44, "#4C4CFF"), (45, "#0000FF"), (46, "#000059"), (47, "#000019"),
-            (48, "#874CFF"), (49, "#5400FF"), (50, "#190064"), (51, "#0F0030"),
-            (52, "#FF4CFF"), (53, "#FF00FF"), (54, "#590059"), (55, "#190019"),
-            (56, "#FF4C87"), (57, "#FF0054"), (58, "#59001D"), (59, "#220013"),
-            (60, "#FF1500"), (61, "#993500"), (62, "#795100"), (63, "#436400"),
-            (64, "#033900"), (65, "#005735"), (66, "#00547F"), (67, "#0000FF"),
-            (68, "#00454F"), (69, "#2500CC"), (70, "#7F7F7F"), (71, "#202020"),
-            (72, "#FF0000"), (73, "#BDFF2D"), (74, "#AFED06"), (75, "#64FF09"),
-            (76, "#108B00"), (77, "#00FF87"), (78, "#00A9FF"), (79, "#002AFF"),
-            (80, "#3F00FF"), (81, "#7A00FF"), (82, "#B21A7D"), (83, "#402100"),
-            (84, "#FF4A00"), (85, "#88E106"), (86, "#72FF15"), (87, "#00FF00"),
-            (88, "#3BFF26"), (89, "#59FF71"), (90, "#38FFCC"), (91, "#5B8AFF"),
-            (92, "#3151C6"), (93, "#877FE9"), (94, "#D31DFF"), (95, "#FF005D"),
-            (96, "#FF7F00"), (97, "#B9B000"), (98, "#90FF00"), (99, "#835D07"),
-            (100, "#392b00"), (101, "#144C10"), (102, "#0D5038"), (103, "#15152A"),
-            (104, "#16205A"), (105, "#693C1C"), (106, "#A8000A"), (107, "#DE513D"),
-            (108, "#D86A1C"), (109, "#FFE126"), (110, "#9EE12F"), (111, "#67B50F"),
-            (112, "#1E1E30"), (113, "#DCFF6B"), (114, "#80FFBD"), (115, "#9A99FF"),
-            (116, "#8E66FF"), (117, "#404040"), (118, "#757575"), (119, "#E0FFFF"),
-            (120, "#A00000"), (121, "#350000"), (122, "#1AD000"), (123, "#074200"),
-            (124, "#B9B000"), (125, "#3F3100"), (126, "#B35F00"), (127, "#4B1502")
-        ]
-    
-    def _find_closest_color(self, hex_color):
+    def apply(self, name):
         """
-        Find the closest color value to the given hex color.
+        Switch to a preset, sending only the LEDs and knob rings that differ from the
+        current state. Cancels a running crossfade.
 
         Args:
-            hex_color (str): The hex color code (e.g., "#FF0000").
+            name (str): The preset name.
 
         Returns:
-            int: The index of the closest color (0-127).
+            int: The number of messages sent.
+
+        Raises:
+            ValueError: If the preset is unknown.
         """
-        def hex_to_rgb(hex_code):
-            hex_code = hex_code.lstrip("#")
-            return [int(hex_code[i:i+2], 16) for i in (0, 2, 4)]
-        
-        target_rgb = hex_to_rgb(hex_color)
-        closest_index = None
-        closest_distance = float("inf")
-
-        for index, code in self.color_codes:
-            current_rgb = hex_to_rgb(code)
-            distance = sum((t - c) ** 2 for t, c in zip(target_rgb, current_rgb))
-            if distance < closest_distance:
-                closest_distance = distance
-                closest_index = index
-        
-        return closest_index
+        state = self._state(name)
+        self._fade = None
+        return self._apply(state)
 
-    def set_clip_launch(self, row, column, color, led_type):
+    def crossfade(self, name, frames, start=None):
         """
-        Set the color of a clip launch button.
+        Fade to a preset over several tick() calls.
+
+        Clip and scene LED colors are blended in RGB and matched to the palette, keeping
+        each pad's current LED type, and knob ring values move linearly; everything else
+        (LED types, track rows, buttons, knob ring types) switches on the last frame. All frames are computed here, so each
+        tick() only sends the LEDs and rings that change.
 
         Args:
-            row (int): The row index of the clip launch button (1-5).
-            column (int): The column index of the clip launch button (1-8).
-            color (str|int): The color name, hex code, or index (0-127).
-                - Color names available: black, dark gray, gray, white, red, orange,
-                  yellow, green, cyan, blue, purple, magenta, pink.
-                - Hex codes: Any valid hexadecimal color code (e.g., "#FF0000").
-                - Index: Integer values between 0-127.
-            led_type (int): LED Type (0-15).
-                - 0: Primary Color
-                - 1: Secondary Color (Oneshot 1/24)
-                - 2: Secondary Color (Oneshot 1/16)
-                - 3: Secondary Color (Oneshot 1/8)
-                - 4: Secondary Color (Oneshot 1/4)
-                - 5: Secondary Color (Oneshot 1/2)
-                - 6: Secondary Color (Pulsing 1/24)
-                - 7: Secondary Color (Pulsing 1/16)
-                - 8: Secondary Color (Pulsing 1/8)
-                - 9: Secondary Color (Pulsing 1/4)
-                - 10: Secondary Color (Pulsing 1/2)
-                - 11: Secondary Color (Blinking 1/24)
-                - 12: Secondary Color (Blinking 1/16)
-                - 13: Secondary Color (Blinking 1/8)
-                - 14: Secondary Color (Blinking 1/4)
-                - 15: Secondary Color (Blinking 1/2)
+            name (str): The preset to fade to.
+            frames (int): The number of frames the fade takes.
+            start (str|None): A preset to apply first and fade from, or None to fade from
+                the current state.
 
         Returns:
             None
 
         Raises:
-            ValueError: If the channel, row, column, or color values are out of their valid ranges.
+            ValueError: If a preset is unknown or frames is less than 1.
         """
-        if led_type not in range(16):
-            raise ValueError(f"Invalid channel: {led_type}. Must be 0-15.")
-        if row not in range(1, 6):
-            raise ValueError(f"Invalid row: {row}. Must be 1-5.")
-        if column not in range(1, 9):
-            raise ValueError(f"Invalid column: {column}. Must be 1-8.")
-        
-        if isinstance(color, str):
-            if color.startswith("#"):
-                color = self._find_closest_color(color)
-            else:
-                color = self.color_map.get(color.lower())
-                if color is None:
-                    raise ValueError(
-                        f"Unknown color name: {color}. Use a valid name like 'red' or a hex code like '#FF0000'."
-                    )
-        if not isinstance(color, int) or color not in range(128):
-            raise ValueError(
-                f"Invalid color: {color}. Must be an index (0-127), a hex code, or a valid color name."
-            )
+        target = self._state(name)
+        if frames < 1:
+            raise ValueError(f"Invalid frames: {frames}. Must be at least 1.")
+        if start is not None:
+            self.apply(start)
+        current = self.apc.snapshot()
+        t = np.arange(1, frames, dtype=np.float32) / frames
 
-        self.midiout.sendNoteOn(led_type + 1, (5 - row) * 8 + column, color / 127)
-    
-    def set_track_record(self, track, state):
-        """
-        Set the state of the record arm LED.
+        end = target.led_color[:_FADE_SLOTS]
+        color_slots = np.flatnonzero(end != _UNKNOWN)
+        end = end[color_slots]
+        begin = current.led_color[color_slots]
+        begin = np.where(begin == _UNKNOWN, end, begin)
+        led_types = current.led_type[color_slots]
+        led_types = np.where(led_types == _UNKNOWN, target.led_type[color_slots], led_types)
+        begin_rgb = PALETTE_ARRAY[begin].astype(np.float32)
+        end_rgb = PALETTE_ARRAY[end].astype(np.float32)
+        colors = quantize_rgb(np.rint(begin_rgb + (end_rgb - begin_rgb) * t[:, None, None]).astype(np.int32))
 
-        Args:
-            track (int): The track index (1-8).
-            state (bool): The state of the record arm LED.
-                - True: On
-                - False: Off
+        end = target.knob_value
+        knob_slots = np.flatnonzero(end != _UNKNOWN)
+        end = end[knob_slots].astype(np.float32)
+        begin = current.knob_value[knob_slots]
+        begin = np.where(begin == _UNKNOWN, end, begin).astype(np.float32)
+        values = np.rint(begin + (end - begin) * t[:, None]).astype(np.uint8)
+
+        self._fade = [target, 0, color_slots, led_types, colors, knob_slots, values]
+
+    def tick(self):
+        """
+        Advance a running crossfade by one frame. Called by apc.tick().
 
         Returns:
-            None
+            int: The number of messages sent.
+        """
+        fade = self._fade
+        if fade is None:
+            return 0
+        target, frame, color_slots, led_types, colors, knob_slots, values = fade
+        if frame == len(colors):
+            self._fade = None
+            return self._apply(target)
+        fade[1] = frame + 1
+
+        led = self.apc.led
+        led._color_view[color_slots] = colors[frame]
+        led._led_type_view[color_slots] = led_types
+        sent = 0 if led._batch_depth else led.flush()
+
+        knob = self.apc.knob
+        changed = values[frame] != knob._value_view[knob_slots]
+        for slot, value in zip(knob_slots[changed].tolist(), values[frame][changed].tolist()):
+            knob._send_value(slot, value)
+            sent += 1
+        return sent
+
+
+class BlinkClock:
+    """
+    Tempo-synced software blinking for the on/off LEDs.
+
+    Track, transport and device control buttons have no hardware blink (clip stop has
+    one fixed rate). The clock blinks any of them in time with a BPM or an external
+    beat position. The next toggle edge of every blinking LED is kept in a heap, so
+    tick() only touches LEDs whose edge falls in that frame: a button blinking once per
+    beat costs two messages per beat, whatever the frame rate.
+
+    Available as apc.blink and advanced by apc.tick(). Targets use the preset key syntax
+    (see compile_preset), e.g. "play", "track_select 3" or a whole row, "track_solo".
+
+    Example:
+        apc.blink.set_bpm(128)
+        apc.blink.start("play")                               # on for half of every beat
+        apc.blink.start("track_select", period=0.5, duty=0.25)
+        apc.blink.start("track_solo 3", period=2, offset=1)
+    """
+
+    __slots__ = ("led", "clock", "_bpm", "_anchor_time", "_anchor_beat", "_external_beat", "_last_beat",
+                 "_blinks", "_heap", "_generation")
+
+    def __init__(self, led, bpm=120.0, clock=time.perf_counter):
+        """
+        Args:
+            led (LEDController): Where the LEDs are written.
+            bpm (float): Initial tempo.
+            clock (callable): Time source in seconds.
 
         Raises:
-            ValueError: If the track index is not in the range 1-8.
+            ValueError: If bpm is not positive.
         """
-        if track not in range(1, 9):
-            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
-        
-        self.midiout.sendNoteOn(track, 0x30 + 1, 1 if state else 0)
+        if bpm <= 0:
+            raise ValueError(f"Invalid bpm: {bpm}. Must be positive.")
+        self.led = led
+        self.clock = clock
+        self._bpm = bpm
+        self._anchor_time = clock()
+        self._anchor_beat = 0.0
+        self._external_beat = None
+        self._last_beat = 0.0
+        # slot -> (period, duty, offset, on value, generation); heap of (edge beat, generation, slot).
+        self._blinks = {}
+        self._heap = []
+        self._generation = 0
 
-    def set_track_solo(self, track, state):
+    @property
+    def bpm(self):
+        """float: The tempo used while no external beat is set."""
+        return self._bpm
+
+    @property
+    def beat(self):
+        """float: The current beat position."""
+        if self._external_beat is not None:
+            return self._external_beat
+        return self._anchor_beat + (self.clock() - self._anchor_time) * self._bpm / 60
+
+    def set_bpm(self, bpm):
         """
-        Set the state of the solo LED.
+        Run from the internal clock at a tempo, continuing from the current beat.
 
         Args:
-            track (int): The track index (1-8).
-            state (bool): The state of the solo LED.
-                - True: On
-                - False: Off
+            bpm (float): Beats per minute.
 
         Returns:
             None
 
         Raises:
-            ValueError: If the track index is not in the range 1-8.
+            ValueError: If bpm is not positive.
         """
-        if track not in range(1, 9):
-            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
-        
-        self.midiout.sendNoteOn(track, 0x31 + 1, 1 if state else 0)
-    
-    def set_track_number(self, track, state):
+        if bpm <= 0:
+            raise ValueError(f"Invalid bpm: {bpm}. Must be positive.")
+        self._anchor_beat = self.beat
+        self._anchor_time = self.clock()
+        self._external_beat = None
+        self._bpm = bpm
+
+    def set_beat(self, beat):
         """
-        Set the state of the activator LED.
+        Follow an external beat position (e.g. from a Beat CHOP or Ableton Link) instead
+        of the internal clock, until set_bpm() is called.
 
         Args:
-            track (int): The track index (1-8).
-            state (bool): The state of the activator LED.
-                - True: On
-                - False: Off
+            beat (float): The current position in beats. A CHOP channel is read with float().
 
         Returns:
             None
+        """
+        self._external_beat = float(beat)
+
+    def _schedule(self, slot, beat):
+        period, duty, offset, on, generation = self._blinks[slot]
+        position = (beat - offset) / period
+        cycle = math.floor(position)
+        lit = position - cycle < duty
+        edge = offset + (cycle + (duty if lit else 1)) * period
+        # Rounding can put the edge at or before beat; step past it so tick() always makes progress.
+        while edge <= beat:
+            if lit:
+                lit = False
+                edge = offset + (cycle + 1) * period
+            else:
+                cycle += 1
+                lit = True
+                edge = offset + (cycle + duty) * period
+        heapq.heappush(self._heap, (edge, generation, slot))
+        value = on if lit else 0
+        if self.led._color[slot] == value:
+            return 0
+        self.led._write(slot, value)
+        return 1
+
+    def start(self, key, period=1.0, duty=0.5, offset=0.0):
+        """
+        Start blinking one LED or a group of them. Restarting a blinking LED replaces its pattern.
+
+        Args:
+            key (str): The target, an on/off LED key such as "play", "track_select 3",
+                "device_ctrl" or "track_clip_stop 2".
+            period (float): Beats per on/off cycle.
+            duty (float): Fraction of the cycle the LED is on (0-1, exclusive).
+            offset (float): Beat at which a cycle starts.
+
+        Returns:
+            int: The number of LEDs that changed.
 
         Raises:
-            ValueError: If the track index is not in the range 1-8.
+            ValueError: If the key is not an on/off LED, or period or duty is out of range.
         """
-        if track not in range(1, 9):
-            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
-        
-        self.midiout.sendNoteOn(track, 0x32 + 1, 1 if state else 0)
-    
-    def set_track_select(self, track, state):
+        kind, slots = _preset_slots(key)
+        if kind not in ("on_off", "tristate"):
+            raise ValueError(f"Invalid blink target: {key}. Must be an on/off LED.")
+        if period <= 0:
+            raise ValueError(f"Invalid period: {period}. Must be positive.")
+        if not 0 < duty < 1:
+            raise ValueError(f"Invalid duty: {duty}. Must be between 0 and 1.")
+        on = 127 if kind == "on_off" else 1
+        beat = self._last_beat = self.beat
+        changed = 0
+        for slot in np.ravel(slots).tolist():
+            self._generation += 1
+            self._blinks[slot] = (period, duty, offset, on, self._generation)
+            changed += self._schedule(slot, beat)
+        return changed
+
+    def stop(self, key=None, state=False):
         """
-        Set the state of the track select LED.
+        Stop blinking and leave the LEDs steady.
 
         Args:
-            track (int): The track index (1-8).
-            state (bool): The state of the track select LED.
-                - True: On
-                - False: Off
+            key (str|None): The target passed to start(), or None for every blinking LED.
+            state (bool): Whether the LEDs are left on.
 
         Returns:
             None
 
         Raises:
-            ValueError: If the track index is not in the range 1-8.
+            ValueError: If the key is invalid.
         """
-        if track not in range(1, 9):
-            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
-        
-        self.midiout.sendNoteOn(track, 0x33 + 1, 1 if state else 0)
-    
-    def set_track_clip_stop(self, track, state):
+        slots = list(self._blinks) if key is None else np.ravel(_preset_slots(key)[1]).tolist()
+        for slot in slots:
+            blink = self._blinks.pop(slot, None)
+            if blink is not None:
+                self.led._write(slot, blink[3] if state else 0)
+
+    def tick(self, beat=None):
         """
-        Set the state of the track stop LED.
+        Send the LEDs whose toggle edge has passed. Called by apc.tick().
 
         Args:
-            track (int): The track index (1-8).
-            state (int): The state of the track stop LED.
-                - 0: Off
-                - 1: On
-                - 2: Blink (sync to tempo at 1/8 rate)
+            beat (float|None): An external beat position; see set_beat().
 
         Returns:
-            None
+            int: The number of LEDs that changed.
+        """
+        if beat is not None:
+            self._external_beat = beat
+        heap = self._heap
+        if not heap:
+            return 0
+        beat = self.beat
+        blinks = self._blinks
+        changed = 0
+        if beat < self._last_beat:
+            # The beat jumped back (e.g. the transport restarted): recompute every edge.
+            heap.clear()
+            for slot in blinks:
+                changed += self._schedule(slot, beat)
+        self._last_beat = beat
+        while heap and heap[0][0] <= beat:
+            _, generation, slot = heapq.heappop(heap)
+            blink = blinks.get(slot)
+            if blink is not None and blink[4] == generation:
+                changed += self._schedule(slot, beat)
+        return changed
+
+
+class StepSequencer:
+    """
+    Step sequencer mode for the clip launch grid.
+
+    The pattern is a (5, steps) uint8 array: one row per pad row, one column per step,
+    non-zero for active cells. The grid shows one page of 8 steps, following the playhead
+    by default. Pressing a pad toggles its cell. The playhead advances with the beat of a
+    transport (a BlinkClock, apc.blink by default in examples) or with an external beat
+    position passed to tick(); on each step only the two playhead columns are redrawn,
+    plus any edited cells, and only pads whose color changed are sent. A page flip
+    redraws the grid, still sending only what differs.
+
+    Every step records its lateness against the ideal step time, the interval since the
+    previous step, the time spent drawing it and the messages it sent; see metrics().
+
+    Call tick() every frame before apc.tick(), so its writes go out the same frame.
+
+    Example:
+        def play(step, rows):
+            for row in np.flatnonzero(rows):
+                op('midiout_synth').sendNoteOn(1, 36 + row)
+
+        seq = apc40mk2.StepSequencer(apc.led, apc.input, apc.blink, steps=16, on_step=play)
+        apc.blink.set_bpm(174)
+
+        # In an Execute DAT
+        def onFrameStart(frame):
+            seq.tick()
+            apc.tick()
+    """
+
+    __slots__ = ("led", "input", "transport", "pattern", "steps_per_beat", "follow", "on_step", "clock",
+                 "_colors", "_page", "_step", "_beat", "_sample", "_history", "_skipped")
+
+    def __init__(self, led, input=None, transport=None, steps=16, steps_per_beat=4, on_step=None, follow=True,
+                 colors=("black", "blue", "white", "red"), history=1024, clock=time.perf_counter):
+        """
+        Args:
+            led (LEDController): Where the grid is drawn.
+            input (InputController|None): If given, pad presses toggle cells.
+            transport (BlinkClock|None): The beat source. Without one, pass the beat to tick().
+            steps (int): Pattern length, a multiple of 8.
+            steps_per_beat (int): Steps per beat, e.g. 4 for 16th notes.
+            on_step (callable|None): Called as on_step(step, rows) for every step reached,
+                step being 1-based and rows the pattern column (a view).
+            follow (bool): Whether the page follows the playhead.
+            colors (tuple): Colors of an inactive cell, an active cell, the playhead over an
+                inactive cell and the playhead over an active cell.
+            history (int): Steps kept for metrics().
+            clock (callable): Time source in seconds for the timing metrics.
 
         Raises:
-            ValueError: If the track index is not in the range 1-8.
-            ValueError: If the state is not in the range 0-2.
+            ValueError: If steps or steps_per_beat is out of range.
         """
-        if track not in range(1, 9):
-            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
-        
-        if state not in range(3):
-            raise ValueError(f"Invalid state: {state}. Must be 0-2.")
+        if steps <= 0 or steps % 8:
+            raise ValueError(f"Invalid steps: {steps}. Must be a positive multiple of 8.")
+        if steps_per_beat <= 0:
+            raise ValueError(f"Invalid steps_per_beat: {steps_per_beat}. Must be positive.")
+        self.led = led
+        self.input = input
+        self.transport = transport
+        self.pattern = np.zeros((5, steps), dtype=np.uint8)
+        self.steps_per_beat = steps_per_beat
+        self.follow = follow
+        self.on_step = on_step
+        self.clock = clock
+        # Indexed by playhead * 2 + active.
+        self._colors = tuple(_resolve_color(color) for color in colors)
+        self._page = 0
+        self._step = None
+        self._beat = None
+        # (time, beat) of the previous step, to measure the tempo of an external beat.
+        self._sample = None
+        # (time, lateness in seconds, draw cost in seconds, messages sent) per step.
+        self._history = collections.deque(maxlen=history)
+        self._skipped = 0
+        if input is not None:
+            input.on("clip", self._on_pad)
+        self.draw()
 
-        self.midiout.sendNoteOn(track, 0x34 + 1, state / 127)
-    
-    def set_device_ctrl_button(self, index, state):
+    @property
+    def steps(self):
+        """int: The pattern length."""
+        return self.pattern.shape[1]
+
+    @property
+    def step(self):
+        """int|None: The 1-based playhead step, or None before the first tick()."""
+        return None if self._step is None else self._step + 1
+
+    @property
+    def page(self):
+        """int: The 1-based page of 8 steps shown on the grid."""
+        return self._page + 1
+
+    def close(self):
         """
-        Set the state of the device control button LED.
+        Stop receiving pad presses. The grid is left as it is.
+
+        Returns:
+            None
+        """
+        if self.input is not None:
+            self.input.off("clip", self._on_pad)
+            self.input = None
+
+    def _draw_cell(self, row, column):
+        step = self._page * 8 + column
+        color = self._colors[(step == self._step) * 2 + (self.pattern[row, step] != 0)]
+        slot = row * 8 + column
+        led = self.led
+        if led._color[slot] == color and led._led_type[slot] == 0:
+            return 0
+        led._write(slot, color)
+        return 1
+
+    def _draw_column(self, column):
+        return sum(self._draw_cell(row, column) for row in range(5))
+
+    def draw(self):
+        """
+        Draw the whole visible page.
+
+        Returns:
+            int: The number of pads that changed.
+        """
+        return sum(self._draw_column(column) for column in range(8))
+
+    def show_page(self, page):
+        """
+        Show a page of 8 steps. With follow, the playhead moves the page again at its next page change.
 
         Args:
-            index (int): The index of the device control button (1-8).
-            state (bool): The state of the device control button LED.
-                - True: On
-                - False: Off
+            page (int): The page index (1 to steps / 8).
 
         Returns:
-            None
+            int: The number of pads that changed.
 
         Raises:
-            ValueError: If the index is not in the range 1-8.
+            ValueError: If the page is out of range.
         """
-        if index not in range(1, 9):
-            raise ValueError(f"Invalid index: {index}. Must be 1-8.")
-        
-        self.midiout.sendNoteOn(1, 0x3A + index, 1 if state else 0)
-        
-    def set_track_ab_assign(self, track, state):
+        if page not in range(1, self.steps // 8 + 1):
+            raise ValueError(f"Invalid page: {page}. Must be 1-{self.steps // 8}.")
+        self._page = page - 1
+        return self.draw()
+
+    def set_step(self, row, step, value=1):
         """
-        Set the state of the crossfader assign LED.
-        
+        Set one cell of the pattern.
+
         Args:
-            track (int): The track index (1-8).
-            state (int): The state of the crossfader assign LED (0-2).
-                - 0: Off
-                - 1: A
-                - 2: B
-        
+            row (int): The row index (1-5).
+            step (int): The step index (1 to steps).
+            value (int): 0 for inactive, or any value up to 255 for active (e.g. a velocity).
+
         Returns:
-            None
-        
+            int: The number of pads that changed (0 if the step is not on the visible page).
+
         Raises:
-            ValueError: If the track index is not in the range 1-8.
-            ValueError: If the state is not in the range 0-2.
+            ValueError: If row, step or value is out of range.
         """
-        if track not in range(1, 9):
-            raise ValueError(f"Invalid track: {track}. Must be 1-8.")
-        if state not in range(3):
-            raise ValueError(f"Invalid state: {state}. Must be 0-2.")
+        if row not in range(1, 6):
+            raise ValueError(f"Invalid row: {row}. Must be 1-5.")
+        if step not in range(1, self.steps + 1):
+            raise ValueError(f"Invalid step: {step}. Must be 1-{self.steps}.")
+        if value not in range(256):
+            raise ValueError(f"Invalid value: {value}. Must be 0-255.")
+        self.pattern[row - 1, step - 1] = value
+        if (step - 1) // 8 != self._page:
+            return 0
+        return self._draw_cell(row - 1, (step - 1) % 8)
 
-        self.midiout.sendNoteOn(track, 0x42 + 1, state / 127)
-    
-    def set_master_track(self, state):
+    def load(self, pattern):
         """
-        Set the state of the master track LED.
+        Replace the whole pattern and redraw.
 
         Args:
-            state (bool): The state of the master track LED.
-                - True: On
-                - False: Off
+            pattern (numpy.ndarray): Values of shape (5, steps).
 
         Returns:
-            None
+            int: The number of pads that changed.
+
+        Raises:
+            ValueError: If the shape does not match.
         """
-        self.midiout.sendNoteOn(1, 0x50 + 1, 1 if state else 0)
-    
-    def set_scene_launch(self, scene, color, led_type):
+        pattern = np.asarray(pattern)
+        if pattern.shape != self.pattern.shape:
+            raise ValueError(f"Invalid pattern shape: {pattern.shape}. Must be {self.pattern.shape}.")
+        self.pattern[:] = pattern
+        return self.draw()
+
+    def _on_pad(self, control, value):
+        if not value:
+            return
+        _, row, column = control
+        step = self._page * 8 + column - 1
+        self.pattern[row - 1, step] = 0 if self.pattern[row - 1, step] else 1
+        self._draw_cell(row - 1, column - 1)
+
+    def tick(self, beat=None):
         """
-        Set the LED of a track scene launch button.
-        
+        Advance the playhead to the current beat and draw the change.
+
         Args:
-            scene (int): Scene index (1-5).
-            color (str|int): The color name, hex code, or index (0-127).
-                - Color names available: black, dark gray, gray, white, red, orange,
-                  yellow, green, cyan, blue, purple, magenta, pink.
-                - Hex codes: Any valid hexadecimal color code (e.g., "#FF0000").
-                - Index: Integer values between 0-127.
-            led_type (int): LED Type (0-15).
-                - 0: Primary Color
-                - 1: Secondary Color (Oneshot 1/24)
-                - 2: Secondary Color (Oneshot 1/16)
-                - 3: Secondary Color (Oneshot 1/8)
-                - 4: Secondary Color (Oneshot 1/4)
-                - 5: Secondary Color (Oneshot 1/2)
-                - 6: Secondary Color (Pulsing 1/24)
-                - 7: Secondary Color (Pulsing 1/16)
-                - 8: Secondary Color (Pulsing 1/8)
-                - 9: Secondary Color (Pulsing 1/4)
-                - 10: Secondary Color (Pulsing 1/2)
-                - 11: Secondary Color (Blinking 1/24)
-                - 12: Secondary Color (Blinking 1/16)
-                - 13: Secondary Color (Blinking 1/8)
-                - 14: Secondary Color (Blinking 1/4)
-                - 15: Secondary Color (Blinking 1/2)
-                
+            beat (float|None): An external beat position. Defaults to the transport's beat.
+
         Returns:
-            None
-        
+            int: The number of pads that changed.
+
         Raises:
-            ValueError: If the scene or color values are out of their valid ranges.
+            ValueError: If neither a beat nor a transport is available.
         """
-        if led_type not in range(16):
-            raise ValueError(f"Invalid channel: {led_type}. Must be 0-15.")
-        if scene not in range(1, 6):
-            raise ValueError(f"Invalid scene: {scene}. Must be 1-5.")
-        
-        if isinstance(color, str):
-            if color.startswith("#"):
-                color = self._find_closest_color(color)
-            else:
-                color = self.color_map.get(color.lower())
-                if color is None:
-                    raise ValueError(
-                        f"Unknown color name: {color}. Use a valid name like 'red' or a hex code like '#FF0000'."
-                    )
-        if not isinstance(color, int) or color not in range(128):
-            raise ValueError(
-                f"Invalid color: {color}. Must be an index (0-127), a hex code, or a valid color name."
-            )
+        external = beat is not None
+        if not external:
+            if self.transport is None:
+                raise ValueError("No beat: pass a beat or construct the sequencer with a transport.")
+            beat = self.transport.beat
+        position = beat * self.steps_per_beat
+        tick = math.floor(position)
+        if self._beat is not None and tick == self._beat:
+            return 0
+        now = self.clock()
+        started = time.perf_counter()
+        steps = self.steps
+        previous, step = self._step, tick % steps
+        if self.on_step is not None:
+            # Steps passed over within one frame are still reported, in order.
+            count = min(tick - self._beat, steps) if self._beat is not None and tick > self._beat else 1
+            for passed in range(tick - count + 1, tick + 1):
+                self.on_step(passed % steps + 1, self.pattern[:, passed % steps])
+        if self._beat is not None and tick > self._beat + 1:
+            self._skipped += tick - self._beat - 1
+        self._beat = tick
+        self._step = step
+
+        page = step // 8
+        if self.follow and page != self._page:
+            self._page = page
+            sent = self.draw()
+        else:
+            sent = 0
+            if previous is not None and previous // 8 == self._page:
+                sent += self._draw_column(previous % 8)
+            if page == self._page:
+                sent += self._draw_column(step % 8)
+
+        if not external and getattr(self.transport, "_external_beat", None) is None:
+            beats_per_second = self.transport.bpm / 60
+        elif self._sample is not None and now > self._sample[0] and beat > self._sample[1]:
+            # An external beat has no reliable BPM; use the tempo observed since the previous step.
+            beats_per_second = (beat - self._sample[1]) / (now - self._sample[0])
+        else:
+            beats_per_second = None
+        self._sample = (now, beat)
+        lateness = (position - tick) / self.steps_per_beat / beats_per_second if beats_per_second else math.nan
+        self._history.append((now, lateness, time.perf_counter() - started, sent))
+        return sent
+
+    def metrics(self):
+        """
+        Timing and cost of the recorded steps.
 
-        self.midiout.sendNoteOn(led_type + 1, 0x52 + scene, color / 127)
+        Lateness is how long after its ideal time a step was drawn. It uses the
+        transport's BPM while the transport runs from its internal clock; with an
+        external beat (BlinkClock.set_beat() or a beat passed to tick()) it uses the tempo
+        measured between successive steps, so the first such step is left out. Jitter is the
+        standard deviation of the intervals between steps.
 
-    def set_pan(self, state):
+        Returns:
+            dict: "steps", "skipped", "interval_ms" (mean), "jitter_ms", "late_ms_mean",
+                "late_ms_p99", "cost_us_mean", "cost_us_p99" and "messages_per_step".
         """
-        Set the state of the pan button LED.
+        if not self._history:
+            return {"steps": 0, "skipped": self._skipped}
+        times, lateness, costs, sent = (np.array(column, dtype=np.float64) for column in zip(*self._history))
+        intervals = np.diff(times) * 1000
+        lateness = lateness[~np.isnan(lateness)]
+        return {
+            "steps": len(times),
+            "skipped": self._skipped,
+            "interval_ms": float(intervals.mean()) if intervals.size else math.nan,
+            "jitter_ms": float(intervals.std()) if intervals.size else math.nan,
+            "late_ms_mean": float(lateness.mean() * 1000) if lateness.size else math.nan,
+            "late_ms_p99": float(np.percentile(lateness, 99) * 1000) if lateness.size else math.nan,
+            "cost_us_mean": float(costs.mean() * 1e6),
+            "cost_us_p99": float(np.percentile(costs, 99) * 1e6),
+            "messages_per_step": float(sent.mean()),
+        }
 
-        Args:
-            state (bool): The state of the pan button LED.
-                - True: On
-                - False: Off
+    def reset_metrics(self):
+        """
+        Forget the recorded steps.
 
         Returns:
             None
         """
-        self.midiout.sendNoteOn(1, 0x57 + 1, 1 if state else 0)
+        self._history.clear()
+        self._skipped = 0
 
-    def set_sends(self, state):
-        """
-        Set the state of the sends button LED.
 
+class APC40MK2:
+    """Main class to manage functionalities of APC40MK2."""
+
+    __slots__ = (
+        "midiout", "output", "sender", "led", "knob", "mode", "input", "effects", "presets", "blink",
+        "bindings", "shared", "instrumentation", "_original_classes", "_restore_output",
+    )
+
+    def __init__(self, midiout, messages_per_tick=None, bytes_per_second=None, threaded=False,
+                 queue_size=1024, backpressure="coalesce"):
+        """
         Args:
-            state (bool): The state of the sends button LED.
-                - True: On
-                - False: Off
+            midiout (MIDI Out CHOP): The CHOP that sends MIDI to the APC40 MK2, or an output
+                such as RawBytesOutput or LoopbackOutput.
+            messages_per_tick (int|None): If set, route output through an OutputScheduler
+                releasing at most this many messages per tick().
+            bytes_per_second (float|None): If set, route output through an OutputScheduler
+                limited to this many MIDI bytes per second.
+            threaded (bool): If True, send from a background thread (see ThreadedOutput),
+                available as apc.sender.
+            queue_size (int): Capacity of the background thread's queue.
+            backpressure (str): Policy when that queue is full, one of BACKPRESSURE_POLICIES.
+        """
+        self.midiout = midiout
+        self.output = _as_output(midiout)
+        self.sender = None
+        if threaded:
+            self.sender = self.output = ThreadedOutput(self.output, queue_size, backpressure)
+        if messages_per_tick is not None or bytes_per_second is not None:
+            self.output = OutputScheduler(self.output, messages_per_tick, bytes_per_second)
+        self.led = LEDController(midiout, self.output)
+        self.knob = KnobController(midiout, self.output)
+        self.mode = DeviceModeController(midiout, self.output)
+        self.input = InputController()
+        self.effects = GridEffects(self.led)
+        self.presets = PresetBank(self)
+        self.blink = BlinkClock(self.led)
+        self.bindings = KnobBindings(self.knob, self.input)
+        self.shared = None
+        self.instrumentation = None
+        self._original_classes = []
+        self._restore_output = None
+
+    def _route(self, output):
+        self.led.output = output
+        self.knob.output = output
+        self.mode.output = output
+
+    def snapshot(self):
+        """
+        Capture the last known state of every LED, knob ring type and knob ring value.
 
         Returns:
-            None
+            SurfaceState: A copy of the state.
         """
-        self.midiout.sendNoteOn(1, 0x58 + 1, 1 if state else 0)
-    
-    def set_user(self, state):
+        return SurfaceState(self.led._color_view, self.led._led_type_view,
+                            self.knob._type_view, self.knob._value_view)
+
+    def restore(self, state=None, messages_per_tick=32, from_defaults=True):
         """
-        Set the state of the user button LED.
+        Bring the device back to a snapshot in as few messages as possible.
+
+        Call this after the APC40 MK2 was reconnected, power-cycled, or reset by
+        set_device_mode(). With from_defaults, the device is assumed to show its power-on
+        state, so only entries that differ from it are sent. The messages go through the
+        output scheduler so the device's input buffer never overflows; without one, a
+        temporary scheduler releasing messages_per_tick per tick() is used until drained.
+
+        Example:
+            apc.mode.set_device_mode(2)
+            apc.restore()
 
         Args:
-            state (bool): The state of the user button LED.
-                - True: On
-                - False: Off
+            state (SurfaceState|None): The state to restore. Defaults to the current state.
+            messages_per_tick (int): Pace for the temporary scheduler.
+            from_defaults (bool): Whether the device shows its power-on state. If False,
+                every known entry is resent (e.g. after a TouchDesigner restart, when the
+                device still shows the saved state and resending causes no flash).
 
         Returns:
-            None
+            int: The number of messages queued.
         """
-        self.midiout.sendNoteOn(1, 0x59 + 1, 1 if state else 0)
-    
-    def set_metronome(self, state):
+        if state is None:
+            state = self.snapshot()
+        if not isinstance(self.output, OutputScheduler) and self._restore_output is None:
+            self._restore_output = OutputScheduler(self.output, messages_per_tick)
+            self._route(self._restore_output)
+
+        led = self.led
+        known = state.led_color != _UNKNOWN
+        led._color_view[:] = state.led_color
+        led._led_type_view[:] = state.led_type
+        if from_defaults:
+            led._sent_color_view[:] = np.where(known, POWER_ON_LED_COLOR, _UNKNOWN)
+            led._sent_led_type_view[:] = np.where(known, POWER_ON_LED_TYPE, _UNKNOWN)
+        else:
+            led._sent_color_view.fill(_UNKNOWN)
+            led._sent_led_type_view.fill(_UNKNOWN)
+        queued = 0 if led._batch_depth else led.flush()
+
+        knob = self.knob
+        for values, default, send in ((state.knob_type, POWER_ON_KNOB_TYPE, knob._send_type),
+                                      (state.knob_value, POWER_ON_KNOB_VALUE, knob._send_value)):
+            needed = values != _UNKNOWN
+            if from_defaults:
+                needed &= values != default
+            for slot in np.flatnonzero(needed).tolist():
+                send(slot, int(values[slot]))
+            queued += int(needed.sum())
+        knob._type_view[:] = state.knob_type
+        knob._value_view[:] = state.knob_value
+        known = state.knob_value != _UNKNOWN
+        knob._current[known] = state.knob_value[known] / 127
+        return queued
+
+    def enable_instrumentation(self):
         """
-        Set the state of the metronome button LED.
+        Start counting calls, messages and latencies on this APC40MK2.
 
-        Args:
-            state (bool): The state of the metronome button LED.
-                - True: On
-                - False: Off
+        Returns:
+            Instrumentation: The counters, also available as apc.instrumentation.
+        """
+        if self.instrumentation is not None:
+            return self.instrumentation
+        instrumentation = Instrumentation()
+        terminal = self.output
+        while hasattr(terminal, "output"):
+            terminal = terminal.output
+        targets = [(self.led, "led."), (self.knob, "knob."), (self.mode, "mode."), (self.input, "input.")]
+        if terminal is not self.output:
+            targets.append((self.output, "output."))
+            targets.append((terminal, "midiout."))
+        else:
+            targets.append((terminal, "output."))
+        for obj, prefix in targets:
+            cls = type(obj)
+            self._original_classes.append((obj, cls))
+            obj.__class__ = instrumentation._instrumented_class(cls, prefix, terminal=obj is terminal)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        """
+        Stop instrumentation and restore the uninstrumented classes.
 
         Returns:
-            None
+            Instrumentation|None: The final counters, or None if instrumentation was not enabled.
         """
-        self.midiout.sendNoteOn(1, 0x5A + 1, 1 if state else 0)
-    
-    def set_play(self, state):
+        for obj, cls in self._original_classes:
+            obj.__class__ = cls
+        self._original_classes = []
+        instrumentation = self.instrumentation
+        self.instrumentation = None
+        return instrumentation
+
+    def share(self, name=None):
         """
-        Set the state of the play button LED.
+        Publish the surface state to other processes through shared memory, updated by tick().
 
         Args:
-            state (bool): The state of the play button LED.
-                - True: On
-                - False: Off
+            name (str|None): The shared memory name. Defaults to a generated name.
 
         Returns:
-            None
+            SharedSurface: The publisher, also available as apc.shared. Stop with unshare().
+
+        Raises:
+            FileExistsError: If a block with that name already exists.
         """
-        self.midiout.sendNoteOn(1, 0x5B + 1, 1 if state else 0)
-    
-    def set_record(self, state):
+        if self.shared is None or self.shared.closed:
+            self.shared = SharedSurface(self, name)
+        return self.shared
+
+    def unshare(self, unlink=True):
         """
-        Set the state of the record button LED.
+        Stop publishing the surface state started by share().
 
         Args:
-            state (bool): The state of the record button LED.
-                - True: On
-                - False: Off
+            unlink (bool): Also remove the shared memory block.
 
         Returns:
             None
         """
-        self.midiout.sendNoteOn(1, 0x5D + 1, 1 if state else 0)
-    
-    def set_session(self, state):
+        if self.shared is not None:
+            if not self.shared.closed:
+                self.shared.close(unlink)
+            self.shared = None
+
+    def tick(self):
         """
-        Set the state of the session button LED.
-        
-        Args:
-            state (bool): The state of the session button LED.
-                - True: On
-                - False: Off
+        Advance one frame. Call this once per frame, e.g. from an Execute DAT's onFrameStart.
+
+        Dispatches coalesced input, pushes changed knob bindings, advances preset crossfades,
+        software blinking and knob ring animations, publishes shared state, then releases
+        queued output.
 
         Returns:
-            None
+            int: The number of messages released by the output scheduler (0 without one, unless
+                a restore() is being paced).
         """
-        self.midiout.sendNoteOn(1, 0x66 + 1, 1 if state else 0)
-        
-    def set_bank(self, state):
+        self.input.tick()
+        self.bindings.tick()
+        self.presets.tick()
+        self.blink.tick()
+        self.knob.tick()
+        if self.shared is not None:
+            self.shared.publish()
+        sent = self.output.tick()
+        if self._restore_output is not None:
+            sent += self._restore_output.tick()
+            if not self._restore_output.pending:
+                self._route(self.output)
+                self._restore_output = None
+        return sent
+    
+
+# Registry key -> (APC40MK2, the keyword arguments it was created with).
+_INSTANCES = {}
+
+
+def _registry_key(midiout):
+    # TouchDesigner may hand out a new Python object for the same operator, so key by path.
+    return midiout.path if hasattr(midiout, "OPType") else midiout
+
+
+def get(midiout, **kwargs):
+    """
+    Return the long-lived APC40MK2 for a MIDI Out CHOP, creating it on first use.
+
+    TouchDesigner re-executes scripts often. Building a new APC40MK2 each time throws
+    away what the device is known to show; get() returns the same instance to every
+    script in the process instead. If the operator was deleted and recreated, a new
+    instance is built.
+
+    Example:
+        apc = apc40mk2.get(op('midiout1'))
+
+    Args:
+        midiout (MIDI Out CHOP): The CHOP, or any output accepted by APC40MK2.
+        **kwargs: Passed to APC40MK2 when the instance is created. Later calls may omit
+            them, or must repeat them unchanged.
+
+    Returns:
+        APC40MK2: The shared instance.
+
+    Raises:
+        ValueError: If kwargs differ from those the existing instance was created with;
+            call release() first to rebuild it with new ones.
+    """
+    key = _registry_key(midiout)
+    apc, created = _INSTANCES.get(key, (None, None))
+    if apc is None or not getattr(apc.midiout, "valid", True):
+        apc = APC40MK2(midiout, **kwargs)
+        _INSTANCES[key] = (apc, kwargs)
+    elif kwargs and kwargs != created:
+        raise ValueError(f"Invalid options: {kwargs}. The instance was created with {created}; "
+                         "call release() to rebuild it.")
+    return apc
+
+
+def release(midiout):
+    """
+    Remove the instance get() holds for a MIDI Out CHOP, so the next get() builds a new one.
+
+    Args:
+        midiout (MIDI Out CHOP): The CHOP passed to get().
+
+    Returns:
+        APC40MK2|None: The removed instance, or None if there was none.
+    """
+    return _INSTANCES.pop(_registry_key(midiout), (None, None))[0]
+
+
+class _AsyncController:
+    """
+    Wraps a controller so every setter (set_*) returns an awaitable flush. Other
+    methods, such as batch() or flush(), are passed through unchanged.
+    """
+
+    def __init__(self, owner, controller):
+        self._owner = owner
+        self._controller = controller
+
+    def __getattr__(self, name):
+        attr = getattr(self._controller, name)
+        if not name.startswith("set_") or not callable(attr):
+            return attr
+        owner = self._owner
+
+        def call(*args, **kwargs):
+            flushed = owner._open()
+            attr(*args, **kwargs)
+            return flushed
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+
+class AsyncAPC40MK2:
+    """
+    asyncio front end of APC40MK2 for plain CPython processes.
+
+    Setters (set_*) write immediately and return a future that completes once the
+    write has been flushed to the backend; its result is the number of LED messages
+    the flush sent. Every setter called before the event loop next runs its callbacks
+    joins the same LED batch, so only the net difference is sent, in one flush. Other
+    controller methods behave exactly as on APC40MK2.
+
+    Example:
+        async def main():
+            apc = apc40mk2.AsyncAPC40MK2(apc40mk2.RawBytesOutput(port.send_message, batched=False))
+            ticker = asyncio.create_task(apc.run())
+            for column in range(1, 9):
+                apc.led.set_clip_launch(1, column, "red", 0)
+            await apc.led.set_play(True)
+    """
+
+    def __init__(self, backend, messages_per_tick=None, bytes_per_second=None):
         """
-        Set the state of the bank button LED.
-        
         Args:
-            state (bool): The state of the bank button LED.
-                - True: On
-                - False: Off
+            backend: An output such as RawBytesOutput or LoopbackOutput.
+            messages_per_tick (int|None): See APC40MK2.
+            bytes_per_second (float|None): See APC40MK2.
+        """
+        self.apc = APC40MK2(backend, messages_per_tick, bytes_per_second)
+        self.led = _AsyncController(self, self.apc.led)
+        self.knob = _AsyncController(self, self.apc.knob)
+        self.mode = _AsyncController(self, self.apc.mode)
+        self.input = self.apc.input
+        self._flushed = None
+
+    def _open(self):
+        if self._flushed is None:
+            import asyncio  # Imported on first use; it is slow to import and only needed here.
+
+            loop = asyncio.get_running_loop()
+            self.apc.led.begin()
+            self._flushed = loop.create_future()
+            loop.call_soon(self._flush)
+        return self._flushed
+
+    def _flush(self):
+        flushed, self._flushed = self._flushed, None
+        try:
+            sent = self.apc.led.commit()
+            if not isinstance(self.apc.output, OutputScheduler):
+                self.apc.output.flush()
+        except Exception as exc:
+            if not flushed.done():
+                flushed.set_exception(exc)
+        else:
+            if not flushed.done():
+                flushed.set_result(sent)
+
+    def tick(self):
+        """
+        Advance one frame. See APC40MK2.tick.
 
         Returns:
-            None
+            int: The number of messages released by the output scheduler.
         """
-        self.midiout.sendNoteOn(1, 0x67 + 1, 1 if state else 0)
-        
-class KnobController:
-    """Class to manage all knob functionalities of APC40MK2."""
-    
-    def __init__(self, midiout):
-        self.midiout = midiout
-    
-    def set_track_knob_type(self, index, type):
+        return self.apc.tick()
+
+    async def run(self, interval=1 / 60):
         """
-        Set the type of the track knob.
+        Call tick() every interval seconds until cancelled.
 
         Args:
-            index (int): The index of the track knob (1-8).
-            type (int): The type of the track knob.
-                - 0: Off
-                - 1: Single
-                - 2: Volume style
-                - 3: Pan style
-                - 4-127: Custom values (treated as Single)
+            interval (float): Seconds between ticks.
 
         Returns:
             None
+        """
+        import asyncio
 
-        Raises:
-            ValueError: If the index is not in the range 1-8 or type is not in the range 0-127.
+        while True:
+            self.tick()
+            await asyncio.sleep(interval)
+
+    async def flush(self):
         """
-        
-        if index not in range(1, 9):
-            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
-        
-        if type not in range(128):
-            raise ValueError(f"Invalid type: {type}. The type must be in the range 0-127.")
-        
-        self.midiout.send(0xB0, 0x38 + index - 1, type)
-        
-    def set_track_knob_value(self, index, value):
+        Send everything that is queued, ignoring any output budget.
+
+        Returns:
+            int: The number of messages sent.
         """
-        Set the value of a track knob.
+        if self._flushed is not None:
+            import asyncio
 
-        Args:
-            index (int): The index of the track knob (1-8).
-            value (int): The value of the track knob (0-127).
+            await asyncio.shield(self._flushed)
+        return self.apc.output.flush()
+
+
+class _Broadcast:
+    """Forwards attribute access and calls to several objects at once."""
+
+    def __init__(self, targets):
+        self._targets = targets
+
+    def __getattr__(self, name):
+        attrs = [getattr(target, name) for target in self._targets]
+        if all(callable(attr) for attr in attrs):
+            def call(*args, **kwargs):
+                return [attr(*args, **kwargs) for attr in attrs]
+            return call
+        return _Broadcast(attrs)
 
-        Returns:
-            None
+
+class APC40MK2Pool:
+    """
+    Drives several APC40 MK2 units as one logical surface.
+
+    Each unit is a full APC40MK2 with its own LED framebuffer and output budget, so a
+    change on one unit never resends another. Colors are resolved (and RGB arrays
+    quantized) once per logical write, then fanned out to the units.
+
+    - Stitched (default): the clip grids form one 5 x (8 * units) grid; unit 1 holds
+      columns 1-8, unit 2 columns 9-16, and so on.
+    - Mirrored: every write goes to every unit.
+
+    Example:
+        pool = apc40mk2.APC40MK2Pool([op('midiout1'), op('midiout2')], messages_per_tick=64)
+        pool.set_clip_launch(row=1, column=12, color="red", led_type=0)  # unit 2, column 4
+        pool.all.led.set_play(True)  # any APC40MK2 call, on every unit
+    """
+
+    def __init__(self, midiouts, mirrored=False, messages_per_tick=None, bytes_per_second=None):
+        """
+        Args:
+            midiouts (list): One MIDI Out CHOP per unit, left to right.
+            mirrored (bool): Whether every write goes to every unit.
+            messages_per_tick (int|list|None): Output budget per unit, or one per unit.
+            bytes_per_second (float|list|None): Output byte rate per unit, or one per unit.
 
         Raises:
-            ValueError: If the index is not in the range 1-8 or value is not in the range 0-127.
+            ValueError: If no MIDI outs are given, or a per-unit list has the wrong length.
         """
-        if index not in range(1, 9):
-            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
-        
-        if value not in range(128):
-            raise ValueError(f"Invalid value: {value}. The value must be in the range 0-127.")
-        
-        self.midiout.send(0xB0, 0x30 + index - 1, value)
+        if not midiouts:
+            raise ValueError("At least one MIDI Out is required.")
+        count = len(midiouts)
 
-    def set_device_ctrl_knob_type(self, channel, index, knob_type):
+        def per_unit(value, name):
+            if isinstance(value, (list, tuple)):
+                if len(value) != count:
+                    raise ValueError(f"Invalid {name}: expected {count} values, got {len(value)}.")
+                return list(value)
+            return [value] * count
+
+        self.mirrored = mirrored
+        self.units = [
+            APC40MK2(midiout, budget, rate)
+            for midiout, budget, rate in zip(midiouts, per_unit(messages_per_tick, "messages_per_tick"),
+                                             per_unit(bytes_per_second, "bytes_per_second"))
+        ]
+        self.all = _Broadcast(self.units)
+
+    @property
+    def columns(self):
+        """int: The number of logical clip launch columns."""
+        return 8 if self.mirrored else 8 * len(self.units)
+
+    def set_clip_launch(self, row, column, color, led_type):
         """
-        Configure the LED ring type for a device knob.
+        Set the color of a clip launch button on the logical grid.
 
         Args:
-            channel (int): MIDI channel (1-9).
-                - 1-8: Tracks 1-8
-                - 9: Master
-                - Note: Set to 1 for modes 1 (Ableton Live Mode) and 2 (Alternate Ableton Live Mode).
-            index (int): Knob index (1-8).
-            knob_type (int): LED ring style.
-                - 0: Off
-                - 1: Single
-                - 2: Volume Style
-                - 3: Pan Style
+            row (int): The row index (1-5).
+            column (int): The logical column index (1-8 when mirrored, 1-8 * units when stitched).
+            color (str|int|Color): See LEDController.set_clip_launch.
+            led_type (int): LED Type (0-15), see LEDController.set_clip_launch.
 
         Returns:
             None
 
         Raises:
-            ValueError: If the channel is not in the range 1-9, index is not in the range 1-8, or knob_type is not in the range 0-127.
+            ValueError: If the row, column, color or LED type is out of its valid range.
         """
-        if channel not in range(1, 10):
-            raise ValueError(f"Invalid channel: {channel}. The channel must be in the range 1-9.")
-        
-        if index not in range(1, 9):
-            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
-        
-        if knob_type not in range(4):
-            raise ValueError(f"Invalid knob_type: {knob_type}. The knob_type must be in the range 0-3.")
-        
-        self.midiout.send(0xB0 + channel - 1, 0x18 + index - 1, knob_type)
-    
-    def set_device_ctrl_knob_value(self, channel, index, value):
+        if column not in range(1, self.columns + 1):
+            raise ValueError(f"Invalid column: {column}. Must be 1-{self.columns}.")
+        color = _resolve_color(color)
+        if self.mirrored:
+            for unit in self.units:
+                unit.led.set_clip_launch(row, column, color, led_type)
+        else:
+            self.units[(column - 1) // 8].led.set_clip_launch(row, (column - 1) % 8 + 1, color, led_type)
+
+    def set_scene_launch(self, scene, color, led_type, unit=None):
         """
-        Set the value of a device knob.
+        Set the LED of a scene launch button.
 
         Args:
-            channel (int): MIDI channel (1-9).
-                - 1-8: Tracks 1-8
-                - 9: Master
-                - Note: Set to 1 for modes 1 (Ableton Live Mode) and 2 (Alternate Ableton Live Mode).
-            index (int): Knob index (1-8).
-            value (int): The value of the device knob (0-127).
-            
+            scene (int): Scene index (1-5).
+            color (str|int|Color): See LEDController.set_scene_launch.
+            led_type (int): LED Type (0-15).
+            unit (int|None): The unit (1-based), or None for every unit.
+
         Returns:
             None
-        
+
         Raises:
-            ValueError: If the channel is not in the range 1-9, index is not in the range 1-8, or value is not in the range 0-127.
+            ValueError: If the scene, color, LED type or unit is out of its valid range.
         """
-        if channel not in range(1, 10):
-            raise ValueError(f"Invalid channel: {channel}. The channel must be in the range 1-9.")
-        
-        if index not in range(1, 9):
-            raise ValueError(f"Invalid index: {index}. The index must be in the range 1-8.")
-        
-        if value not in range(128):
-            raise ValueError(f"Invalid value: {value}. The value must be in the range 0-127.")
-        
-        self.midiout.send(0xB0 + channel - 1, 0x10 + index - 1, value)
+        color = _resolve_color(color)
+        if unit is None:
+            for target in self.units:
+                target.led.set_scene_launch(scene, color, led_type)
+            return
+        if unit not in range(1, len(self.units) + 1):
+            raise ValueError(f"Invalid unit: {unit}. Must be 1-{len(self.units)}.")
+        self.units[unit - 1].led.set_scene_launch(scene, color, led_type)
 
-class DeviceModeController:
-    """Handles device mode settings for APC40MK2."""
-    
-    def __init__(self, midiout):
-        self.midiout = midiout
-    
-    def set_device_mode(self, mode):
+    def set_clip_grid(self, colors, led_type=0):
         """
-        Set the device mode.
+        Set the whole logical clip grid in one call.
 
         Args:
-            mode (int): The device mode.
-                - 0: Generic Mode
-                - 1: Ableton Live Mode
-                - 2: Alternate Ableton Live Mode
+            colors (numpy.ndarray): Palette indices of shape (5, columns) or RGB colors of
+                shape (5, columns, 3), where columns is self.columns.
+            led_type (int|numpy.ndarray): LED Type (0-15), or an array of shape (5, columns).
 
         Returns:
-            None
+            int: The number of messages sent across all units.
 
         Raises:
-            ValueError: If the mode is not 0, 1, or 2.
+            ValueError: If the array shape, color indices, or LED types are invalid.
         """
-        if mode not in [0, 1, 2]:
-            raise ValueError(f"Invalid mode: {mode}. Valid modes are 0 (Generic Mode), 1 (Ableton Live Mode), and 2 (Alternate Ableton Live Mode).")
-        
-        self.midiout.sendExclusive(0x47, 0x7F, 0x29, 0x60, 0x00, 0x04, 0x40 + mode, 0x01, 0x00, 0x00)
+        colors = np.asarray(colors)
+        if colors.ndim == 3:
+            colors = quantize_rgb(colors)
+        if colors.shape != (5, self.columns):
+            raise ValueError(f"Invalid grid shape: {colors.shape}. Must be (5, {self.columns}).")
+        if self.mirrored:
+            return sum(unit.led.set_clip_grid(colors, led_type) for unit in self.units)
+        led_type = np.asarray(led_type)
+        sent = 0
+        for i, unit in enumerate(self.units):
+            columns = slice(i * 8, i * 8 + 8)
+            sent += unit.led.set_clip_grid(colors[:, columns], led_type[:, columns] if led_type.ndim else int(led_type))
+        return sent
 
-class APC40MK2:
-    """Main class to manage functionalities of APC40MK2."""
+    def force_resync(self):
+        """
+        Resend every known LED on every unit.
 
-    def __init__(self, midiout):
-        self.midiout = midiout
-        self.led = LEDController(midiout)
-        self.knob = KnobController(midiout)
-        self.mode = DeviceModeController(midiout)
-    
\ No newline at end of file
+        Returns:
+            int: The number of messages sent.
+        """
+        return sum(unit.led.force_resync() for unit in self.units)
+
+    def tick(self):
+        """
+        Advance every unit by one frame. Call this once per frame.
+
+        Returns:
+            int: The number of messages released by the units' output schedulers.
+        """
+        return sum(unit.tick() for unit in self.units)
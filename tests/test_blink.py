@@ -0,0 +1,43 @@
+"""
+Regression tests for BlinkClock edge scheduling.
+
+Usage:
+    python -m pytest tests
+"""
+
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import apc40mk2  # noqa: E402
+
+
+def test_next_edge_is_always_after_the_beat():
+    for period, duty, offset in itertools.product((1 / 3, 0.25, 0.1, 1 / 7, 0.75, 2.0),
+                                                  (0.3, 0.5, 1 / 3),
+                                                  (0.0, 0.5, 1 / 3, 0.1)):
+        apc = apc40mk2.APC40MK2(apc40mk2.MockMidiOut(record=False))
+        apc.blink.start("play", period=period, duty=duty, offset=offset)
+        for i in range(200):
+            beat = i / 24
+            apc.blink.tick(beat)
+            assert apc.blink._heap[0][0] > beat
+
+
+def test_large_beat_positions():
+    apc = apc40mk2.APC40MK2(apc40mk2.MockMidiOut(record=False))
+    apc.blink.start("play", period=0.25, duty=0.3, offset=1 / 3)
+    apc.blink.tick(6106.908333333333)
+    assert apc.blink._heap[0][0] > 6106.908333333333
+
+
+def test_led_follows_duty_cycle():
+    midiout = apc40mk2.MockMidiOut()
+    apc = apc40mk2.APC40MK2(midiout)
+    apc.blink.start("play", period=1.0, duty=0.5)
+    apc.blink.tick(0.25)
+    assert apc.led._color[apc40mk2.BUTTON_SLOTS["play"]] == 127
+    apc.blink.tick(0.75)
+    assert apc.led._color[apc40mk2.BUTTON_SLOTS["play"]] == 0